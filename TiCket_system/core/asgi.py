@@ -13,4 +13,25 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after Django is set up, the gateway client reads settings
+from tickets.gateway import close_async_client
+
+
+async def application(scope, receive, send):
+    """
+    Django's ASGI handler plus lifespan support, so the pooled async SSLCommerz
+    client is closed cleanly when the server shuts down.
+    """
+    if scope['type'] != 'lifespan':
+        return await django_application(scope, receive, send)
+
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_async_client()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
@@ -58,6 +58,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'tickets.instrumentation.InstrumentationMiddleware', # Per-request timings: logs, Server-Timing, /metrics
+    'tickets.db_router.ReplicaRoutingMiddleware', # Replica reads for the catalogue and admin
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     
@@ -93,10 +95,72 @@ WSGI_APPLICATION = 'core.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
+# DB_ENGINE=postgresql for production; SQLite (the default) is for development and local load tests.
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+# Seconds a connection is kept for reuse across requests (0: close after each request)
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', 60))
+
+if DB_ENGINE == 'postgresql':
+    # pip install "psycopg[binary,pool]". DB_POOL_MAX_SIZE > 0 uses psycopg's connection pool instead
+    # of persistent connections, so a burst of requests shares a bounded number of connections.
+    DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 2))
+    DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 0))
+
+    def _postgres(host, port):
+        options = {}
+        if DB_POOL_MAX_SIZE:
+            options['pool'] = {
+                'min_size': DB_POOL_MIN_SIZE,
+                'max_size': DB_POOL_MAX_SIZE,
+                'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)), # Seconds to wait for a free connection
+            }
+        return {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'tickets'),
+            'USER': os.environ.get('DB_USER', 'tickets'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': host,
+            'PORT': port,
+            'CONN_MAX_AGE': 0 if DB_POOL_MAX_SIZE else DB_CONN_MAX_AGE, # Pooled connections cannot also persist
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': options,
+        }
+
+    DATABASES = {'default': _postgres(os.environ.get('DB_HOST', 'localhost'), os.environ.get('DB_PORT', '5432'))}
+    # A streaming read replica with the same credentials. Reads are routed to it by tickets.db_router.
+    if os.environ.get('DB_REPLICA_HOST'):
+        DATABASES['replica'] = {
+            **_postgres(os.environ['DB_REPLICA_HOST'], os.environ.get('DB_REPLICA_PORT', '5432')),
+            'TEST': {'MIRROR': 'default'},
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'OPTIONS': {
+                # WAL lets readers run alongside the writer; transactions take the write lock when they
+                # begin, so concurrent writers queue on the busy timeout instead of failing to upgrade a lock
+                'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL',
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': int(os.environ.get('DB_BUSY_TIMEOUT', 20)), # Seconds to wait for the write lock
+            },
+        }
+    }
+
+DATABASE_ROUTERS = ['tickets.db_router.PrimaryReplicaRouter']
+# After a client's write, its reads go to the primary for this many seconds, covering replication lag
+DB_REPLICA_STICKY_SECONDS = int(os.environ.get('DB_REPLICA_STICKY_SECONDS', 10))
+
+
+# Cache
+# Local memory by default. Point CACHE_BACKEND/CACHE_LOCATION at a shared cache (e.g. Redis) when running
+# several processes, so catalogue invalidations are seen by all of them.
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'tickets'),
     }
 }
 
@@ -148,6 +212,16 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles') # For production deployment
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # --- LOGGING Configuration ---
+# Records go through an in-memory queue to a background thread (tickets.log.QueueHandler), so a slow
+# disk or console never stalls a request. LOG_QUEUE=False writes them from the calling thread instead.
+LOG_QUEUE = os.environ.get('LOG_QUEUE', 'True').lower() in ('true', '1', 't')
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO') # Of the tickets app; DEBUG for detailed app logs
+# Fraction of the INFO/DEBUG records kept per logger, e.g. the per-request timing lines of tickets.requests
+LOG_SAMPLE_RATES = {
+    'tickets.requests': float(os.environ.get('LOG_SAMPLE_REQUESTS', 1)),
+}
+_LOG_HANDLERS = ['queue'] if LOG_QUEUE else ['console', 'file']
+
 # This dictionary configures how Django handles logging messages.
 LOGGING = {
     'version': 1, # Specifies the logging schema version
@@ -163,6 +237,16 @@ LOGGING = {
             'format': '{levelname} {message}',
             'style': '{',
         },
+        'json': { # One object per line, with the tran_id/booking context and `extra` fields
+            '()': 'tickets.log.JSONFormatter',
+        },
+    },
+
+    'filters': {
+        'sampling': {
+            '()': 'tickets.log.SamplingFilter',
+            'rates': LOG_SAMPLE_RATES,
+        },
     },
 
     # Define where log messages go (e.g., console, file)
@@ -170,44 +254,118 @@ LOGGING = {
         'console': { # Logs to the console (where you run runserver)
             'class': 'logging.StreamHandler',
             'formatter': 'simple',
+            'filters': [] if LOG_QUEUE else ['sampling'],
         },
         'file': { # Logs to a file (useful for production)
             'class': 'logging.handlers.RotatingFileHandler',
             'filename': os.path.join(LOGS_DIR, 'django.log'), # Path to your log file
             'maxBytes': 1024 * 1024 * 5,  # 5 MB
             'backupCount': 5, # Keep up to 5 old log files
-            'formatter': 'verbose',
+            'formatter': 'json',
+            'filters': [] if LOG_QUEUE else ['sampling'],
         },
     },
 
     # Define loggers for specific Django components or your apps
     'root': { # Default logger for anything not specifically handled
-        'handlers': ['console', 'file'],
+        'handlers': _LOG_HANDLERS,
         'level': 'INFO',
     },
     'loggers': {
         'django': { # Logs for Django's core operations
-            'handlers': ['console', 'file'],
+            'handlers': _LOG_HANDLERS,
             'level': 'INFO', # Can be 'DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'
             'propagate': False, # Don't pass messages to parent loggers
         },
         'tickets': { # Logger specifically for your 'tickets' app
-            'handlers': ['console', 'file'],
-            'level': 'DEBUG', # Set to DEBUG for detailed app logs
+            'handlers': _LOG_HANDLERS,
+            'level': LOG_LEVEL,
+            'propagate': False,
+        },
+        'django.core.mail': { # Django's email sending
+            'handlers': _LOG_HANDLERS,
+            'level': 'INFO',
             'propagate': False,
         },
-        'django.core.mail': { # NEW: Logger for Django's email sending
-            'handlers': ['console', 'file'],
-            'level': 'DEBUG', # Set to DEBUG to see detailed email errors
+        'httpx': { # The async gateway client logs every request at INFO
+            'handlers': _LOG_HANDLERS,
+            'level': 'WARNING',
             'propagate': False,
         },
     },
 }
+if LOG_QUEUE:
+    LOGGING['handlers']['queue'] = { # Named to sort after the handlers it feeds, which must exist first
+        '()': 'tickets.log.QueueHandler',
+        'handlers': ['cfg://handlers.console', 'cfg://handlers.file'],
+        'filters': ['sampling'],
+    }
 
 
 # Add SSLCommerz Credentials
 SSLCOMMERZ_STORE_ID = os.environ.get('SSLCOMMERZ_STORE_ID')
 SSLCOMMERZ_STORE_PASSWORD = os.environ.get('SSLCOMMERZ_STORE_PASSWORD')
+# Leave unset to pick sandbox/live from DEBUG. Set to e.g. http://127.0.0.1:8001 to use `manage.py fake_sslcommerz`
+SSLCOMMERZ_BASE_URL = os.environ.get('SSLCOMMERZ_BASE_URL')
+# Gateway client: keep-alive pool size, timeouts in seconds, and retries (with jittered backoff) on connection errors/5xx
+SSLCOMMERZ_POOL_SIZE = int(os.environ.get('SSLCOMMERZ_POOL_SIZE', 20))
+SSLCOMMERZ_CONNECT_TIMEOUT = float(os.environ.get('SSLCOMMERZ_CONNECT_TIMEOUT', 3.05))
+SSLCOMMERZ_READ_TIMEOUT = float(os.environ.get('SSLCOMMERZ_READ_TIMEOUT', 15))
+SSLCOMMERZ_MAX_RETRIES = int(os.environ.get('SSLCOMMERZ_MAX_RETRIES', 2))
+SSLCOMMERZ_RETRY_BACKOFF = float(os.environ.get('SSLCOMMERZ_RETRY_BACKOFF', 0.25))
+# How long a val_id confirmed by the validator API is trusted without asking again
+SSLCOMMERZ_VALIDATION_CACHE_SECONDS = int(os.environ.get('SSLCOMMERZ_VALIDATION_CACHE_SECONDS', 24 * 60 * 60))
+
+# Ticket holds: stock is reserved when a booking is created and released if unpaid after this many seconds
+TICKET_HOLD_TTL_SECONDS = int(os.environ.get('TICKET_HOLD_TTL_SECONDS', 15 * 60))
+
+# Booking lifecycle (`manage.py reap_bookings`): bookings still pending after this many seconds are expired,
+# and with --archive, finished bookings made more than this many days ago move to the archive table
+BOOKING_PENDING_TTL_SECONDS = int(os.environ.get('BOOKING_PENDING_TTL_SECONDS', 60 * 60))
+BOOKING_ARCHIVE_AFTER_DAYS = int(os.environ.get('BOOKING_ARCHIVE_AFTER_DAYS', 180))
+
+# Ticket catalogue: cache alias holding the pre-serialized /api/ticket-types/ response, and a safety TTL
+TICKETS_CATALOGUE_CACHE = os.environ.get('TICKETS_CATALOGUE_CACHE', 'default')
+TICKETS_CATALOGUE_CACHE_SECONDS = int(os.environ.get('TICKETS_CATALOGUE_CACHE_SECONDS', 300))
+
+# Waiting room for ticket types with an admission rate (tickets.waiting_room). Its queues live in this
+# cache alias, which must be shared between processes. Queue tickets and admission tokens expire after these seconds.
+WAITING_ROOM_CACHE = os.environ.get('WAITING_ROOM_CACHE', 'default')
+WAITING_ROOM_QUEUE_TTL_SECONDS = int(os.environ.get('WAITING_ROOM_QUEUE_TTL_SECONDS', 2 * 60 * 60))
+WAITING_ROOM_ADMISSION_TTL_SECONDS = int(os.environ.get('WAITING_ROOM_ADMISSION_TTL_SECONDS', 5 * 60))
+
+# Rate limits, "N/S": bursts of N requests, refilled over S seconds ('' turns a limit off). See tickets.ratelimit.
+RATE_LIMITS = {
+    'catalogue:ip': os.environ.get('RATE_LIMIT_CATALOGUE_IP', '120/60'),
+    'booking:ip': os.environ.get('RATE_LIMIT_BOOKING_IP', '20/60'),
+    'booking:email': os.environ.get('RATE_LIMIT_BOOKING_EMAIL', '5/300'),
+    'booking:global': os.environ.get('RATE_LIMIT_BOOKING_GLOBAL', '100/1'),
+}
+# tickets.ratelimit.LocalBackend (per process) or tickets.ratelimit.CacheBackend (shared through RATE_LIMIT_CACHE)
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'tickets.ratelimit.LocalBackend')
+RATE_LIMIT_CACHE = os.environ.get('RATE_LIMIT_CACHE', 'default')
+# Reverse proxies in front of the app; the client IP is read from X-Forwarded-For when set
+RATE_LIMIT_PROXY_COUNT = int(os.environ.get('RATE_LIMIT_PROXY_COUNT', 0))
+
+# Live availability stream (ASGI only): deltas are pushed at most once per interval, with a keep-alive
+# comment every heartbeat, to at most this many connections per process
+AVAILABILITY_PUSH_INTERVAL_SECONDS = float(os.environ.get('AVAILABILITY_PUSH_INTERVAL_SECONDS', 1))
+AVAILABILITY_HEARTBEAT_SECONDS = float(os.environ.get('AVAILABILITY_HEARTBEAT_SECONDS', 15))
+AVAILABILITY_MAX_CONNECTIONS = int(os.environ.get('AVAILABILITY_MAX_CONNECTIONS', 10_000))
+
+# Venue check-in (tickets.checkin): the bearer token gate scanners send (unset: check-in is off), how often
+# each process tops up its index of paid bookings, and how far each top-up reaches back for late commits
+CHECKIN_TOKEN = os.environ.get('CHECKIN_TOKEN')
+CHECKIN_REFRESH_SECONDS = float(os.environ.get('CHECKIN_REFRESH_SECONDS', 5))
+CHECKIN_REFRESH_OVERLAP_SECONDS = int(os.environ.get('CHECKIN_REFRESH_OVERLAP_SECONDS', 60))
+
+# Sharded ticket types: how long the catalogue may serve a cached sum of a ticket type's stock shards
+TICKET_SHARD_TOTAL_CACHE_SECONDS = int(os.environ.get('TICKET_SHARD_TOTAL_CACHE_SECONDS', 2))
+
+# Request instrumentation: add a Server-Timing header to responses (exposes timings to clients),
+# and the bearer token /metrics requires (unset: open, so restrict it at the proxy)
+TICKETS_SERVER_TIMING = os.environ.get('TICKETS_SERVER_TIMING', 'True').lower() in ('true', '1', 't')
+TICKETS_METRICS_TOKEN = os.environ.get('TICKETS_METRICS_TOKEN')
 
 # Email Settings (for sending confirmation emails)
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend' 
@@ -218,6 +376,19 @@ EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL')
 
+# Email outbox (delivered by `manage.py send_outbox_emails`): retries back off exponentially from
+# OUTBOX_RETRY_BASE_SECONDS, and an email is dead-lettered after OUTBOX_MAX_ATTEMPTS failures.
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 8))
+OUTBOX_RETRY_BASE_SECONDS = int(os.environ.get('OUTBOX_RETRY_BASE_SECONDS', 30))
+OUTBOX_LEASE_SECONDS = int(os.environ.get('OUTBOX_LEASE_SECONDS', 300)) # How long a worker owns a claimed batch
+
+# Ticket artifacts (tickets.artifacts): QR codes and PDF tickets are rendered by this many worker processes
+# (0: in the calling process), cached in this directory up to this many bytes, and served with this max-age
+TICKET_ARTIFACT_WORKERS = int(os.environ.get('TICKET_ARTIFACT_WORKERS', 2))
+TICKET_ARTIFACT_DIR = os.environ.get('TICKET_ARTIFACT_DIR', os.path.join(BASE_DIR, 'ticket_artifacts'))
+TICKET_ARTIFACT_MAX_BYTES = int(os.environ.get('TICKET_ARTIFACT_MAX_BYTES', 512 * 1024 * 1024))
+TICKET_ARTIFACT_CACHE_SECONDS = int(os.environ.get('TICKET_ARTIFACT_CACHE_SECONDS', 24 * 60 * 60))
+
 # CORS Settings (if frontend is on a different domain/port)
 # pip install django-cors-headers
 CORS_ALLOWED_ORIGINS = [
@@ -14,6 +14,7 @@ document.addEventListener('DOMContentLoaded', function() {
             const data = await response.json();
             ticketTypesData = data;
             renderTicketSelection();
+            subscribeToAvailability();
         } catch (error) {
             console.error('Error fetching ticket types:', error);
             ticketSelectionDiv.innerHTML = '<div class="alert alert-danger">Error loading ticket types. Please try again later.</div>';
@@ -43,7 +44,7 @@ document.addEventListener('DOMContentLoaded', function() {
                            value="0" min="0" max="${ticket.available_quantity}">
                 </div>
                 <div class="col-md-4">
-                    <small class="form-text text-muted">Available: ${ticket.available_quantity}</small>
+                    <small class="form-text text-muted ticket-available" data-ticket-id="${ticket.id}">Available: ${ticket.available_quantity}</small>
                 </div>
             `;
             ticketSelectionDiv.appendChild(ticketDiv);
@@ -57,6 +58,38 @@ document.addEventListener('DOMContentLoaded', function() {
         calculateTotal(); // Initial calculation
     }
 
+    // Function to apply live availability ({ticket id: available quantity}) to the rendered fields
+    function applyAvailability(quantities) {
+        Object.entries(quantities).forEach(([ticketId, available]) => {
+            const input = ticketSelectionDiv.querySelector(`.ticket-quantity[data-ticket-id="${ticketId}"]`);
+            const label = ticketSelectionDiv.querySelector(`.ticket-available[data-ticket-id="${ticketId}"]`);
+            if (!input) {
+                return; // Not on this page yet; it shows up on the next load
+            }
+            input.dataset.availableQuantity = available;
+            input.max = available;
+            input.disabled = available === 0;
+            if (available === 0) {
+                input.value = 0;
+            }
+            if (label) {
+                label.textContent = available === 0 ? 'Sold out' : `Available: ${available}`;
+            }
+        });
+        calculateTotal();
+    }
+
+    // Live availability over Server-Sent Events; the browser reconnects on its own if it drops
+    function subscribeToAvailability() {
+        if (!window.EventSource) {
+            return;
+        }
+        const source = new EventSource('/api/availability/stream/');
+        const onUpdate = event => applyAvailability(JSON.parse(event.data));
+        source.addEventListener('snapshot', onUpdate);
+        source.addEventListener('availability', onUpdate);
+    }
+
     // Function to calculate total amount
     function calculateTotal() {
         let total = 0;
@@ -68,6 +101,75 @@ document.addEventListener('DOMContentLoaded', function() {
         totalAmountSpan.textContent = total.toFixed(2);
     }
 
+    // --- Waiting room ---
+    // Ticket types with an admission rate can only be booked with an admission token from the
+    // waiting room. The booking API answers 429 without one; we then queue, show the position,
+    // poll when the server says to (retry_after), and resubmit the booking with the token.
+    const waitingRoomDiv = document.getElementById('waitingRoom');
+
+    function showQueuePosition(position, retryAfter) {
+        waitingRoomDiv.classList.remove('d-none');
+        waitingRoomDiv.textContent = position > 0
+            ? `You are in the queue: ${position} ahead of you. Checking again in ${retryAfter}s, please keep this page open.`
+            : 'It is your turn! Creating your booking...';
+    }
+
+    function hideQueuePosition() {
+        waitingRoomDiv.classList.add('d-none');
+        waitingRoomDiv.textContent = '';
+    }
+
+    const sleep = seconds => new Promise(resolve => setTimeout(resolve, seconds * 1000));
+
+    function waitingRoomError(message) {
+        const error = new Error(message);
+        error.name = 'WaitingRoomError';
+        return error;
+    }
+
+    // Resolves with an admission token once the queue reaches us
+    async function waitForAdmission(ticketTypeIds, csrfToken) {
+        let response = await fetch('/api/waiting-room/', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-CSRFToken': csrfToken
+            },
+            body: JSON.stringify({ ticket_types: ticketTypeIds })
+        });
+        let status = await response.json();
+        if (!response.ok) {
+            throw waitingRoomError(status.error || 'Could not join the waiting room.');
+        }
+        const queueTicket = status.queue_ticket;
+        while (!status.admission_token) {
+            showQueuePosition(status.position, status.retry_after);
+            await sleep(status.retry_after || 1);
+            response = await fetch(`/api/waiting-room/?ticket=${encodeURIComponent(queueTicket)}`);
+            status = await response.json();
+            if (!response.ok) {
+                throw waitingRoomError(status.error || 'Lost your place in the waiting room, please try again.');
+            }
+        }
+        showQueuePosition(0, 0);
+        return status.admission_token;
+    }
+
+    async function postBooking(payload, csrfToken, admissionToken) {
+        const headers = {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': csrfToken
+        };
+        if (admissionToken) {
+            headers['X-Admission-Token'] = admissionToken;
+        }
+        return fetch('/api/book-tickets/', {
+            method: 'POST',
+            headers: headers,
+            body: JSON.stringify(payload)
+        });
+    }
+
     // Form Submission
     bookingForm.addEventListener('submit', async function(event) {
         event.preventDefault();
@@ -112,16 +214,17 @@ document.addEventListener('DOMContentLoaded', function() {
         submitButton.textContent = 'Processing...';
 
         try {
-            const response = await fetch('/api/book-tickets/', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                    'X-CSRFToken': csrfToken
-                },
-                body: JSON.stringify(payload)
-            });
+            let response = await postBooking(payload, csrfToken);
+            let data = await response.json();
 
-            const data = await response.json();
+            if (response.status === 429 && data.waiting_room) {
+                // On sale through the waiting room: queue, then book with the admission token
+                submitButton.textContent = 'Waiting in queue...';
+                const admissionToken = await waitForAdmission(data.ticket_types, csrfToken);
+                submitButton.textContent = 'Processing...';
+                response = await postBooking(payload, csrfToken, admissionToken);
+                data = await response.json();
+            }
 
             if (response.ok) {
                 if (data.gateway_url) {
@@ -135,6 +238,8 @@ document.addEventListener('DOMContentLoaded', function() {
                 let errorMessage = 'Failed to create booking.';
                 if (data.error) {
                     errorMessage = data.error;
+                } else if (response.status === 429 && data.detail) {
+                    errorMessage = data.detail; // Rate limited
                 } else if (data.customer_name) {
                     errorMessage += `\nName: ${data.customer_name[0]}`;
                 } else if (data.customer_email) {
@@ -144,8 +249,9 @@ document.addEventListener('DOMContentLoaded', function() {
             }
         } catch (error) {
             console.error('Network or server error:', error);
-            alert('An unexpected error occurred. Please try again.');
+            alert(error.name === 'WaitingRoomError' ? error.message : 'An unexpected error occurred. Please try again.');
         } finally {
+            hideQueuePosition();
             submitButton.disabled = false;
             submitButton.textContent = 'Proceed to Payment';
         }
@@ -1,20 +1,234 @@
-from django.contrib import admin
-from .models import TicketType, Booking, BookedTicket
+import uuid
+from datetime import datetime
+from django.contrib import admin, messages
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.db import connections
+from django.db.models import OuterRef, Q, Subquery, Sum
+from django.utils import timezone
+from .models import TicketType, Booking, BookedTicket, TicketSales, TicketHold, EmailOutbox, PaymentEvent, CheckIn, ArchivedBooking
+from .sales import lines_total
+
+AFTER_VAR = 'after'   # Keyset cursor: show bookings older than this one
+BEFORE_VAR = 'before' # Keyset cursor: show bookings newer than this one
+
+
+def estimate_count(queryset, limit):
+    """
+    Returns (count, exact) without counting more than `limit` rows. An unfiltered table on
+    PostgreSQL is estimated from the planner statistics instead.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql' and not queryset.query.where:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        if row and row[0] > limit:
+            return row[0], False
+    count = queryset.order_by()[:limit + 1].count()
+    return min(count, limit), count <= limit
+
+
+def _cursor_for(booking):
+    return f"{booking.booking_time.isoformat()}_{booking.pk}"
+
+
+def _parse_cursor(value):
+    try:
+        booking_time, pk = value.rsplit('_', 1)
+        return datetime.fromisoformat(booking_time), int(pk)
+    except ValueError:
+        raise IncorrectLookupParameters(f"Invalid cursor {value!r}")
+
+
+# The redundant bound on booking_time lets the database seek into booking_time_idx instead of
+# filtering from the newest row down
+
+def _older_than(booking_time, pk):
+    return Q(booking_time__lte=booking_time) & (Q(booking_time__lt=booking_time) | Q(pk__lt=pk))
+
+
+def _newer_than(booking_time, pk):
+    return Q(booking_time__gte=booking_time) & (Q(booking_time__gt=booking_time) | Q(pk__gt=pk))
+
+
+def _prefix(field, term):
+    # A range rather than LIKE 'term%', so a plain B-tree index on the field is used on every backend
+    return Q(**{f"{field}__gte": term, f"{field}__lt": term + '\U0010ffff'})
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Pages newest-first over (booking_time, id) with cursors instead of page numbers, so every page
+    is an index range scan however deep it is, and shows a bounded count estimate instead of COUNT(*).
+    """
+    def get_queryset(self, request, exclude_parameters=None):
+        # The cursors are not field lookups
+        for var in (AFTER_VAR, BEFORE_VAR):
+            self.params.pop(var, None)
+            self.filter_params.pop(var, None)
+        return super().get_queryset(request, exclude_parameters)
+
+    def get_results(self, request):
+        queryset = self.queryset.order_by('-booking_time', '-pk')
+        per_page = self.list_per_page
+        if BEFORE_VAR in request.GET:
+            newer = queryset.filter(_newer_than(*_parse_cursor(request.GET[BEFORE_VAR])))
+            page = list(newer.reverse()[:per_page])[::-1]
+            has_newer = bool(page) and newer.filter(_newer_than(page[0].booking_time, page[0].pk)).exists()
+        else:
+            if AFTER_VAR in request.GET:
+                queryset = queryset.filter(_older_than(*_parse_cursor(request.GET[AFTER_VAR])))
+            page = list(queryset[:per_page])
+            has_newer = AFTER_VAR in request.GET
+        has_older = bool(page) and self.queryset.filter(_older_than(page[-1].booking_time, page[-1].pk)).exists()
+
+        self.result_count, self.result_count_exact = estimate_count(self.queryset, self.model_admin.count_limit)
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.can_show_all = False
+        self.multi_page = False # No numbered pages; pagination.html links the cursors below
+        self.paginator = None
+        # A queryset (not a list) for the list_editable formset, in display order
+        self.result_list = self.queryset.filter(pk__in=[booking.pk for booking in page]).order_by('-booking_time', '-pk')
+        self.newer_url = has_newer and self.get_query_string({BEFORE_VAR: _cursor_for(page[0])}, remove=[AFTER_VAR])
+        self.older_url = has_older and self.get_query_string({AFTER_VAR: _cursor_for(page[-1])}, remove=[BEFORE_VAR])
+        self.first_url = has_newer and self.get_query_string(remove=[AFTER_VAR, BEFORE_VAR])
 
 @admin.register(TicketType)
 class TicketTypeAdmin(admin.ModelAdmin):
-    list_display = ('name', 'price', 'available_quantity', 'is_active')
-    list_editable = ('price', 'available_quantity', 'is_active')
+    list_display = ('name', 'price', 'available_quantity', 'held_quantity', 'shard_count', 'admission_rate', 'is_active')
+    list_editable = ('price', 'available_quantity', 'admission_rate', 'is_active')
+    readonly_fields = ('held_quantity', 'shard_count') # Maintained by the hold/expiry machinery and `shard_inventory`
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            return super().save_model(request, obj, form, change)
+        # held_quantity moves under concurrent holds and releases, so writing back the value read when the
+        # form loaded would undo them; the stock of a sharded type lives on its shards, not on this row
+        fields = [field.attname for field in obj._meta.concrete_fields if not field.primary_key and field.name not in self.readonly_fields]
+        shard_count = TicketType.objects.filter(pk=obj.pk).values_list('shard_count', flat=True).first()
+        if shard_count:
+            fields.remove('available_quantity')
+            if 'available_quantity' in form.changed_data:
+                self.message_user(
+                    request, f"The stock of {obj.name} is split over {shard_count} shards and was not changed; "
+                    "merge them with `manage.py shard_inventory --shards 0` to edit it.", messages.WARNING,
+                )
+        obj.save(update_fields=fields)
 
 class BookedTicketInline(admin.TabularInline):
     model = BookedTicket
     extra = 0
     readonly_fields = ('subtotal',)
 
+    def get_queryset(self, request):
+        # Each line's __str__ shows its ticket type and booking
+        return super().get_queryset(request).select_related('ticket_type', 'booking')
+
 @admin.register(Booking)
 class BookingAdmin(admin.ModelAdmin):
-    list_display = ('unique_id', 'customer_name', 'customer_email', 'booking_time', 'is_paid', 'transaction_id')
-    list_filter = ('is_paid', 'booking_time')
+    list_display = ('unique_id', 'customer_name', 'customer_email', 'booking_time', 'status', 'transaction_id', 'ticket_count', 'total_amount')
+    list_filter = ('status', 'booking_time')
     search_fields = ('customer_name', 'customer_email', 'unique_id', 'transaction_id')
+    search_help_text = 'Booking ID or transaction ID (exact), or the start of the customer email or name (case-sensitive).'
+    ordering = ('-booking_time', '-pk') # Served by booking_time_idx
+    sortable_by = () # Keyset pagination only works in the index order
+    show_full_result_count = False
+    count_limit = 10_000 # Count at most this many matching bookings in the changelist
     inlines = [BookedTicketInline]
-    readonly_fields = ('unique_id', 'booking_time', 'transaction_id') # These should not be editable manually
\ No newline at end of file
+    # These should not be editable manually; is_paid and status only change together, through tickets.lifecycle
+    readonly_fields = ('unique_id', 'booking_time', 'status', 'is_paid', 'transaction_id', 'paid_at', 'total_amount')
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_queryset(self, request):
+        # Correlated subqueries are only evaluated for the rows on the page, unlike a join + GROUP BY
+        lines = BookedTicket.objects.filter(booking=OuterRef('pk')).order_by().values('booking')
+        return super().get_queryset(request).annotate(
+            ticket_count=Subquery(lines.annotate(n=Sum('quantity')).values('n')),
+        )
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Lines may have been edited in the inline
+        Booking.objects.filter(pk=form.instance.pk).update(total_amount=lines_total())
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Index-friendly search: substring matching would scan the whole table.
+        """
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        try:
+            return queryset.filter(unique_id=uuid.UUID(term)), False
+        except ValueError:
+            pass
+        return queryset.filter(
+            Q(transaction_id=term) | _prefix('customer_email', term) | _prefix('customer_name', term)
+        ), False
+
+    @admin.display(description='Tickets')
+    def ticket_count(self, obj):
+        return obj.ticket_count
+
+
+@admin.register(TicketSales)
+class TicketSalesAdmin(admin.ModelAdmin):
+    list_display = ('ticket_type', 'sold_quantity', 'revenue', 'updated_at')
+    list_select_related = ('ticket_type',)
+    readonly_fields = ('ticket_type', 'sold_quantity', 'revenue', 'updated_at') # Maintained on payment and by `rebuild_sales`
+
+@admin.register(TicketHold)
+class TicketHoldAdmin(admin.ModelAdmin):
+    list_display = ('booking', 'ticket_type', 'quantity', 'status', 'expires_at')
+    list_filter = ('status',)
+    list_select_related = ('booking', 'ticket_type')
+    readonly_fields = ('booking', 'booked_ticket', 'ticket_type', 'quantity', 'status', 'created_at', 'expires_at')
+
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ('booking', 'kind', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status', 'kind')
+    list_select_related = ('booking',)
+    readonly_fields = ('booking', 'kind', 'attempts', 'created_at', 'sent_at', 'last_error')
+    actions = ['retry_now']
+
+    @admin.action(description='Retry selected emails now')
+    def retry_now(self, request, queryset):
+        updated = queryset.exclude(status=EmailOutbox.SENT).update(
+            status=EmailOutbox.PENDING, attempts=0, next_attempt_at=timezone.now()
+        )
+        self.message_user(request, f"{updated} email(s) queued for retry.")
+
+@admin.register(PaymentEvent)
+class PaymentEventAdmin(admin.ModelAdmin):
+    list_display = ('tran_id', 'val_id', 'source', 'status', 'duplicate_count', 'received_at')
+    list_filter = ('status', 'source')
+    search_fields = ('tran_id', 'val_id')
+    readonly_fields = ('tran_id', 'val_id', 'source', 'amount', 'status', 'last_error', 'duplicate_count', 'received_at')
+
+@admin.register(CheckIn)
+class CheckInAdmin(admin.ModelAdmin):
+    list_display = ('code', 'gate', 'status', 'entry_number', 'scanned_at')
+    list_filter = ('status', 'gate')
+    list_select_related = ('booking',)
+    search_fields = ('code',)
+    readonly_fields = ('booking', 'code', 'gate', 'status', 'entry_number', 'scanned_at')
+
+@admin.register(ArchivedBooking)
+class ArchivedBookingAdmin(admin.ModelAdmin):
+    list_display = ('unique_id', 'customer_name', 'customer_email', 'booking_time', 'status', 'total_amount', 'archived_at')
+    list_filter = ('status',)
+    search_fields = ('=customer_email',)
+    readonly_fields = [field.name for field in ArchivedBooking._meta.fields]
+
+    def get_search_results(self, request, queryset, search_term):
+        # A booking id is matched exactly; anything else is taken as an email
+        try:
+            return queryset.filter(unique_id=uuid.UUID(search_term.strip())), False
+        except ValueError:
+            return super().get_search_results(request, queryset, search_term)
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class TicketsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tickets'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from . import signals # Connects the signal receivers
+        from .instrumentation import install_db_wrapper
+        connection_created.connect(install_db_wrapper, dispatch_uid='tickets.instrumentation')
@@ -0,0 +1,227 @@
+# tickets/artifacts.py
+"""
+Ticket artifacts: the QR code of a paid booking (PNG) and a PDF ticket per booked line, rendered by
+`tickets.ticket_render` in a pool of TICKET_ARTIFACT_WORKERS processes and kept on local disk.
+
+Files are stored under the hash of everything they are rendered from (kind, render version and
+ticket fields). An unchanged ticket therefore maps to the file rendered before, so resends and
+downloads read it back instead of rendering again, while an edited one (say, a renamed ticket type)
+gets a new file. Identical artifacts are stored once, such as the QR PNG shared by a booking's lines.
+
+The directory is capped at TICKET_ARTIFACT_MAX_BYTES: reads refresh a file's mtime, and a write
+that takes the total over the cap deletes the least recently used files. Anything evicted is
+rendered again the next time it is needed.
+"""
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from django.conf import settings
+from .instrumentation import timed
+from .ticket_render import RENDER_VERSION, render
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPES = {
+    'pdf': 'application/pdf',
+    'png': 'image/png',
+}
+EVICT_TO = 0.9 # Eviction frees space down to this fraction of the cap, so it does not run on every write
+
+
+def ticket_fields(booked_ticket):
+    """
+    What a booked line's artifacts are rendered from. Needs its booking and ticket type loaded.
+    """
+    booking = booked_ticket.booking
+    return {
+        'code': str(booking.unique_id),
+        'ticket_type': booked_ticket.ticket_type.name,
+        'quantity': booked_ticket.quantity,
+        'customer_name': booking.customer_name,
+        'booking_time': booking.booking_time.strftime('%Y-%m-%d %H:%M %Z'),
+    }
+
+
+def _inputs(kind, ticket):
+    # The QR code only encodes the booking id, so all lines of a booking share one PNG
+    return {'code': ticket['code']} if kind == 'png' else ticket
+
+
+def artifact_key(kind, ticket):
+    payload = json.dumps([kind, RENDER_VERSION, _inputs(kind, ticket)], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class DiskStore:
+    """
+    Content-addressed files under `directory`, least recently used evicted beyond `max_bytes`.
+    With several processes on one directory, each keeps its own running total and evicts by the
+    shared mtimes.
+    """
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total = None # Bytes stored, counted on first write
+
+    def path(self, key, kind):
+        return os.path.join(self.directory, key[:2], f"{key}.{kind}")
+
+    def read(self, key, kind):
+        """
+        Returns the stored bytes, or None if there are none.
+        """
+        path = self.path(key, kind)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+            os.utime(path) # Marks it recently used
+        except FileNotFoundError:
+            return None
+        return data
+
+    def write(self, key, kind, data):
+        path = self.path(key, kind)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written aside and renamed into place, so readers never see a partial file
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.replace(temp_path, path)
+        with self._lock:
+            if self._total is None:
+                self._total = sum(size for _, size, _ in self._files())
+            else:
+                self._total += len(data)
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _files(self):
+        """
+        Yields (mtime, size, path) of every stored file.
+        """
+        try:
+            shards = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return
+        for shard in shards:
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError: # Evicted by another process meanwhile
+                    continue
+                yield stat.st_mtime, stat.st_size, entry.path
+
+    def _evict(self):
+        files = sorted(self._files())
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.max_bytes * EVICT_TO:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._total = total
+
+
+_store = None
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None or (_store.directory, _store.max_bytes) != (settings.TICKET_ARTIFACT_DIR, settings.TICKET_ARTIFACT_MAX_BYTES):
+        _store = DiskStore(settings.TICKET_ARTIFACT_DIR, settings.TICKET_ARTIFACT_MAX_BYTES)
+    return _store
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # Spawned rather than forked: the workers only need tickets.ticket_render, and forking
+                # a threaded server process can deadlock the children
+                _pool = ProcessPoolExecutor(
+                    max_workers=settings.TICKET_ARTIFACT_WORKERS, mp_context=multiprocessing.get_context('spawn'),
+                )
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
+
+
+def _render_all(jobs):
+    """
+    Renders (kind, ticket) jobs, in the pool unless TICKET_ARTIFACT_WORKERS is 0 or there is only one.
+    """
+    if settings.TICKET_ARTIFACT_WORKERS and len(jobs) > 1:
+        try:
+            return list(_get_pool().map(render, *zip(*jobs), chunksize=max(1, len(jobs) // (4 * settings.TICKET_ARTIFACT_WORKERS))))
+        except BrokenProcessPool:
+            logger.warning("Ticket artifact worker pool broke; rendering in process")
+            shutdown_pool()
+    return [render(kind, ticket) for kind, ticket in jobs]
+
+
+def render_many(jobs):
+    """
+    Returns {key: bytes} for (kind, ticket) jobs, rendering (in parallel) only what is not stored.
+    """
+    store = get_store()
+    results, missing = {}, {}
+    for kind, ticket in jobs:
+        key = artifact_key(kind, ticket)
+        if key in results or key in missing:
+            continue
+        data = store.read(key, kind)
+        if data is None:
+            missing[key] = (kind, ticket)
+        else:
+            results[key] = data
+    if missing:
+        with timed('render'):
+            rendered = _render_all(list(missing.values()))
+        for (key, (kind, _)), data in zip(missing.items(), rendered):
+            store.write(key, kind, data)
+            results[key] = data
+    return results
+
+
+def booking_tickets(bookings, kind='pdf'):
+    """
+    Returns {booking pk: [(booked ticket, bytes), ...]} for paid bookings, rendering all missing
+    artifacts of all of them in one pass through the pool. Prefetch `booked_tickets__ticket_type`.
+    """
+    lines = [(booking, line, ticket_fields(line)) for booking in bookings for line in booking.booked_tickets.all()]
+    rendered = render_many([(kind, ticket) for _, _, ticket in lines])
+    result = {booking.pk: [] for booking in bookings}
+    for booking, line, ticket in lines:
+        result[booking.pk].append((line, rendered[artifact_key(kind, ticket)]))
+    return result
+
+
+def read_or_render(kind, ticket):
+    """
+    Returns (key, bytes) of one artifact.
+    """
+    key = artifact_key(kind, ticket)
+    return key, render_many([(kind, ticket)])[key]
@@ -0,0 +1,132 @@
+# tickets/async_views.py
+"""
+Async versions of the booking API for the ASGI entry point (core/asgi.py).
+
+The payment gateway call is awaited instead of blocking a worker thread, so one ASGI
+process can keep many bookings in flight while SSLCommerz responds. Responses match
+the DRF views in views.py.
+"""
+import json
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework import serializers
+from .gateway import get_async_client, GatewayError
+from .serializers import BookingSerializer
+from .views import build_payment_data
+from . import availability, catalogue, ratelimit, waiting_room
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _throttled(wait):
+    response = JsonResponse(ratelimit.throttled_payload(wait), status=429)
+    response['Retry-After'] = str(wait)
+    return response
+
+
+@require_GET
+async def ticket_type_list(request):
+    """
+    Async counterpart of TicketTypeListView, served from the same catalogue cache.
+    """
+    wait = await sync_to_async(ratelimit.catalogue_wait)(request)
+    if wait:
+        return _throttled(wait)
+
+    version = await catalogue.acurrent_version()
+    etag = catalogue.etag_for(version)
+    last_modified = catalogue.last_modified_for(version)
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = HttpResponse(await catalogue.aget_catalogue(version), content_type='application/json')
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def _create_booking(serializer):
+    """
+    Validates and saves a booking. Runs in a worker thread since it needs a DB transaction.
+    Returns (booking, errors).
+    """
+    try:
+        if not serializer.is_valid():
+            return None, serializer.errors
+        try:
+            booking = serializer.save()
+        except serializers.ValidationError as e:
+            return None, e.detail
+        return booking, None
+    finally:
+        # This runs outside the request thread, so honour CONN_MAX_AGE here ourselves
+        close_old_connections()
+
+
+@csrf_exempt # Same as the DRF view: session CSRF checks only apply to authenticated users
+@require_POST
+async def create_booking(request):
+    """
+    Async counterpart of CreateBookingView: creates the booking and awaits the SSLCommerz session.
+    """
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'detail': 'JSON parse error.'}, status=400)
+
+    wait = await sync_to_async(ratelimit.booking_wait)(request, data)
+    if wait:
+        return _throttled(wait)
+
+    try:
+        admission_id = await sync_to_async(waiting_room.admit)(data, request.headers.get(waiting_room.TOKEN_HEADER))
+    except waiting_room.AdmissionError as e:
+        return JsonResponse(e.payload(), status=e.status)
+
+    # Not thread-sensitive: bookings are created in parallel threads instead of queueing
+    # behind every other sync call of this process on the single request thread.
+    booking, errors = await sync_to_async(_create_booking, thread_sensitive=False)(BookingSerializer(data=data))
+    if errors is not None:
+        waiting_room.release(admission_id)
+        return JsonResponse(errors, status=400)
+
+    post_data = build_payment_data(request, booking)
+    try:
+        response_data = await get_async_client().initiate_payment(post_data)
+    except GatewayError as e:
+        logger.error("Error connecting to SSLCommerz for booking %s: %s", booking.unique_id, e)
+        waiting_room.release(admission_id)
+        return JsonResponse({'error': 'Failed to connect to payment gateway. Please try again later.'}, status=500)
+
+    if response_data['status'] == 'SUCCESS':
+        return JsonResponse({'gateway_url': response_data['GatewayPageURL'], 'booking_id': str(booking.unique_id)})
+    logger.error("SSLCommerz initiation failed for booking %s: %s", booking.unique_id, response_data)
+    waiting_room.release(admission_id)
+    return JsonResponse({'error': response_data.get('failedreason', 'Payment initiation failed')}, status=400)
+
+
+@require_GET
+async def availability_stream(request):
+    """
+    Server-Sent Events stream of ticket availability (see tickets.availability).
+    Only served through core.asgi: under WSGI every open stream would hold a worker.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'error': 'Live availability needs the ASGI server.'}, status=503)
+    broadcaster = availability.get_broadcaster()
+    if len(broadcaster.subscribers) >= settings.AVAILABILITY_MAX_CONNECTIONS:
+        return JsonResponse({'error': 'Too many live connections, please retry later.'}, status=503)
+
+    response = StreamingHttpResponse(availability.stream(broadcaster), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no' # Stop nginx from buffering the events
+    return response
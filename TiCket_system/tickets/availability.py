@@ -0,0 +1,142 @@
+# tickets/availability.py
+"""
+Live availability push for the ASGI app, over Server-Sent Events.
+
+Every stock change (holds on booking, the decrement when `sslcommerz_success`/`sslcommerz_ipn`
+apply a payment, releases and expiries) bumps the catalogue version (see `inventory._stock_changed`).
+One watcher task per process compares that version every AVAILABILITY_PUSH_INTERVAL_SECONDS and,
+when it moved, rebuilds the availability map from the cached catalogue and pushes only the ticket
+types whose available quantity changed. A burst of stock changes therefore reaches clients as at
+most one update per interval, and costs one catalogue rebuild per process however many clients
+are connected.
+
+Connections are cheap: each is a coroutine waiting on an asyncio.Event, with a dict of pending
+changes that further deltas are merged into if the client is slow to read. The watcher stops when
+the last client disconnects.
+
+Events:
+    snapshot      {"<ticket type id>": available quantity, ...} for all ticket types on sale, sent first
+    availability  the same, for the ticket types that changed; 0 means sold out or withdrawn
+"""
+import asyncio
+import contextvars
+import json
+import weakref
+from django.conf import settings
+from . import catalogue
+import logging
+
+logger = logging.getLogger(__name__)
+
+RETRY_MILLISECONDS = 5000 # How long browsers wait before reconnecting a dropped stream
+
+
+def _encode(quantities):
+    return json.dumps({str(pk): quantity for pk, quantity in quantities.items()}, separators=(',', ':'))
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+class _Subscriber:
+    __slots__ = ('pending', 'event')
+
+    def __init__(self):
+        self.pending = {}
+        self.event = asyncio.Event()
+
+
+class Broadcaster:
+    """
+    Fans availability deltas out to the stream connections of one event loop.
+    """
+    def __init__(self):
+        self.subscribers = set()
+        self.snapshot = None # {ticket type id: available quantity} as last pushed
+        self.version = None
+        self._watcher = None
+
+    async def refresh(self):
+        """
+        Re-reads availability if the catalogue version moved. Returns the changed quantities.
+        """
+        version = await catalogue.acurrent_version()
+        if version == self.version:
+            return {}
+        body = await catalogue.aget_catalogue(version)
+        current = {t['id']: t['available_quantity'] for t in json.loads(body)}
+        previous = self.snapshot or {}
+        delta = {pk: quantity for pk, quantity in current.items() if previous.get(pk) != quantity}
+        delta.update(dict.fromkeys(previous.keys() - current.keys(), 0)) # No longer on sale
+        self.version, self.snapshot = version, current
+        return delta
+
+    def publish(self, delta):
+        for subscriber in self.subscribers:
+            subscriber.pending.update(delta)
+            subscriber.event.set()
+
+    async def subscribe(self):
+        """
+        Registers a connection. Returns (subscriber, snapshot); deltas published from then on
+        apply to that snapshot.
+        """
+        if self._watcher is None or self._watcher.done():
+            # Nobody was watching, so the last snapshot may be old
+            await self.refresh()
+        subscriber = _Subscriber()
+        self.subscribers.add(subscriber)
+        if self._watcher is None or self._watcher.done():
+            # Outlives this request, so it must not inherit its context variables (DB routing, logging)
+            self._watcher = asyncio.get_running_loop().create_task(self._watch(), context=contextvars.Context())
+        return subscriber, dict(self.snapshot)
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    async def _watch(self):
+        while self.subscribers:
+            await asyncio.sleep(settings.AVAILABILITY_PUSH_INTERVAL_SECONDS)
+            try:
+                delta = await self.refresh()
+            except Exception:
+                logger.exception("Could not refresh availability for the live stream")
+                continue
+            if delta:
+                self.publish(delta)
+
+
+_broadcasters = weakref.WeakKeyDictionary()
+
+
+def get_broadcaster():
+    """
+    Returns the broadcaster of the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    broadcaster = _broadcasters.get(loop)
+    if broadcaster is None:
+        broadcaster = _broadcasters[loop] = Broadcaster()
+    return broadcaster
+
+
+async def stream(broadcaster):
+    """
+    Yields the SSE stream of one connection: the snapshot, then deltas as they are published,
+    with a comment line every AVAILABILITY_HEARTBEAT_SECONDS to keep proxies from timing it out.
+    """
+    subscriber, snapshot = await broadcaster.subscribe()
+    try:
+        yield f"retry: {RETRY_MILLISECONDS}\n" + sse_event('snapshot', _encode(snapshot))
+        while True:
+            try:
+                await asyncio.wait_for(subscriber.event.wait(), settings.AVAILABILITY_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ': ping\n\n'
+                continue
+            subscriber.event.clear()
+            delta, subscriber.pending = subscriber.pending, {}
+            yield sse_event('availability', _encode(delta))
+    finally:
+        broadcaster.unsubscribe(subscriber)
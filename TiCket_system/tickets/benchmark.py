@@ -0,0 +1,134 @@
+# tickets/benchmark.py
+"""
+Seeding, an in-process test server and invariant checks for the `bench_booking` command.
+
+Everything a run creates is tagged with its run id (ticket type names and customer emails start
+with "bench-<run id>"), so it can be found and removed afterwards without touching real data.
+"""
+import random
+import threading
+import uuid
+from contextlib import contextmanager
+from decimal import Decimal
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+from django.db.models import Sum
+from django.test.utils import override_settings
+from . import catalogue, gateway
+from .fake_gateway import FakeSSLCommerzServer
+from .models import BookedTicket, Booking, PaymentEvent, TicketType
+
+
+def new_run_id():
+    return uuid.uuid4().hex[:8]
+
+
+def run_prefix(run_id):
+    return f"bench-{run_id}"
+
+
+def seed(run_id, ticket_types, stock, bookings, lines_per_booking=2, batch_size=1000):
+    """
+    Creates `ticket_types` ticket types with `stock` tickets each, plus `bookings` existing
+    bookings (about half of them paid) spread over them, so the tables have realistic volume.
+    Returns the ticket types.
+    """
+    prefix = run_prefix(run_id)
+    created = TicketType.objects.bulk_create([
+        TicketType(name=f"{prefix}-{i}", price=Decimal(random.choice((50, 100, 250))), available_quantity=stock)
+        for i in range(ticket_types)
+    ])
+    if not created[0].pk: # Backends that do not return ids from bulk_create
+        created = list(TicketType.objects.filter(name__startswith=prefix).order_by('pk'))
+
+    for start in range(0, bookings, batch_size):
+        batch = Booking.objects.bulk_create([
+            Booking(
+                customer_name=f"Bench Customer {n}", customer_email=f"{prefix}-{n}@example.com",
+                is_paid=n % 2 == 0, status=Booking.PAID if n % 2 == 0 else Booking.PENDING,
+                transaction_id=f"VAL-{prefix}-{n}" if n % 2 == 0 else None,
+            )
+            for n in range(start, min(start + batch_size, bookings))
+        ])
+        if not batch[0].pk:
+            batch = list(Booking.objects.filter(customer_email__startswith=prefix).order_by('-pk')[:len(batch)])
+        # Historical lines only: they do not hold or consume the seeded stock
+        lines = []
+        for booking in batch:
+            for ticket_type in random.sample(created, min(lines_per_booking, len(created))):
+                lines.append(BookedTicket(booking=booking, ticket_type=ticket_type, quantity=1, subtotal=ticket_type.price))
+        BookedTicket.objects.bulk_create(lines, batch_size=batch_size)
+    catalogue.bump_version()
+    return created
+
+
+def oversold(ticket_types, stock, since_pk):
+    """
+    Returns {ticket type name: tickets sold beyond `stock`} for the benchmark's ticket types,
+    counting paid bookings made during the run (pk > since_pk), plus any negative stock.
+    """
+    sold = dict(
+        BookedTicket.objects.filter(
+            ticket_type__in=ticket_types, booking__is_paid=True, booking__pk__gt=since_pk,
+        ).values_list('ticket_type').annotate(total=Sum('quantity')).order_by()
+    )
+    result = {}
+    for ticket_type in TicketType.objects.filter(pk__in=[t.pk for t in ticket_types]):
+        excess = max(sold.get(ticket_type.pk, 0) - stock, -ticket_type.available_quantity, 0)
+        if excess:
+            result[ticket_type.name] = excess
+    return result
+
+
+def cleanup(run_id):
+    """
+    Deletes everything a run created.
+    """
+    prefix = run_prefix(run_id)
+    bookings = Booking.objects.filter(customer_email__startswith=prefix)
+    PaymentEvent.objects.filter(tran_id__in=[str(u) for u in bookings.values_list('unique_id', flat=True)]).delete()
+    bookings.delete()
+    TicketType.objects.filter(name__startswith=prefix).delete()
+    catalogue.bump_version()
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class _Server(ThreadedWSGIServer):
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            connections.close_all() # Each request thread has its own connections
+
+
+@contextmanager
+def local_servers(gateway_latency=0.0):
+    """
+    Serves the app (core.wsgi, threaded) and a fake SSLCommerz on free local ports, with the app's
+    gateway client pointed at the fake. Yields (app URL, fake gateway).
+    The load generator shares this process, so absolute numbers are lower than a real deployment's;
+    use it to compare revisions on the same machine.
+    """
+    fake = FakeSSLCommerzServer(store_id='bench-store', latency=gateway_latency).start()
+    try:
+        # All the load comes from one address, so the per-client rate limits are off
+        with override_settings(SSLCOMMERZ_BASE_URL=fake.url, SSLCOMMERZ_STORE_ID=fake.store_id,
+                               ALLOWED_HOSTS=['127.0.0.1', 'localhost'], RATE_LIMITS={}):
+            gateway._client = None # Rebuilt with the fake's URL on first use
+            server = _Server(('127.0.0.1', 0), _QuietHandler)
+            server.set_app(get_wsgi_application())
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            try:
+                yield f"http://127.0.0.1:{server.server_address[1]}", fake
+            finally:
+                server.shutdown()
+                server.server_close()
+                gateway._client = None
+    finally:
+        fake.stop()
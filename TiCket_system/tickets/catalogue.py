@@ -0,0 +1,118 @@
+# tickets/catalogue.py
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.renderers import JSONRenderer
+from .inventory import load_shard_totals
+from .models import IN_CATALOGUE, TicketType
+from .serializers import ticket_type_data
+from . import singleflight
+
+VERSION_KEY = 'tickets:catalogue:version'
+ENTRY_KEY = 'tickets:catalogue:{}'
+
+
+def _cache():
+    return caches[settings.TICKETS_CATALOGUE_CACHE]
+
+
+def bump_version():
+    """
+    Marks the cached catalogue as stale. Call whenever a ticket type or its stock changes.
+
+    The version is the bump time in nanoseconds, so it doubles as the Last-Modified date
+    and stays unique even if the cache is flushed or shared between processes.
+    """
+    version = time.time_ns()
+    _cache().set(VERSION_KEY, version, None)
+    return version
+
+
+def current_version():
+    """
+    Returns the current catalogue version, starting a new one if the cache has none.
+    """
+    version = _cache().get(VERSION_KEY)
+    if version is None:
+        version = bump_version()
+    return version
+
+
+def etag_for(version):
+    return f'"catalogue-{version}"'
+
+
+def last_modified_for(version):
+    return version // 1_000_000_000
+
+
+def _catalogue_queryset():
+    # The built catalogue is cached and served to everyone for TICKETS_CATALOGUE_CACHE_SECONDS, so it is
+    # read from the primary even inside replica_reads requests: a lagging replica would pin stale stock
+    return TicketType.objects.using('default').filter(IN_CATALOGUE)
+
+
+def query_ticket_types():
+    """
+    Returns the active ticket types that still have unreserved stock.
+    """
+    return [t for t in load_shard_totals(list(_catalogue_queryset())) if t.unreserved_quantity > 0]
+
+
+def _render(ticket_types):
+    return JSONRenderer().render(ticket_type_data(ticket_types))
+
+
+def get_catalogue(version):
+    """
+    Returns the serialized catalogue for `version` as JSON bytes.
+    The bytes are cached under the version, so a version bump makes the next call rebuild them.
+    """
+    cache = _cache()
+    key = ENTRY_KEY.format(version)
+    body = cache.get(key)
+    if body is None:
+        # Concurrent misses wait for one rebuild instead of each querying the database
+        body = singleflight.do(key, lambda: _rebuild(key))
+    return body
+
+
+def _rebuild(key):
+    cache = _cache()
+    body = cache.get(key) # Filled by another process meanwhile?
+    if body is None:
+        body = _render(query_ticket_types())
+        cache.set(key, body, settings.TICKETS_CATALOGUE_CACHE_SECONDS)
+    return body
+
+
+# --- Async variants for the ASGI views ---
+
+async def acurrent_version():
+    version = await _cache().aget(VERSION_KEY)
+    if version is None:
+        version = time.time_ns()
+        await _cache().aset(VERSION_KEY, version, None)
+    return version
+
+
+async def aget_catalogue(version):
+    cache = _cache()
+    key = ENTRY_KEY.format(version)
+    body = await cache.aget(key)
+    if body is None:
+        body = await singleflight.ado(key, lambda: _arebuild(key))
+    return body
+
+
+async def _arebuild(key):
+    cache = _cache()
+    body = await cache.aget(key)
+    if body is None:
+        ticket_types = [t async for t in _catalogue_queryset()]
+        if any(t.shard_count for t in ticket_types):
+            ticket_types = await sync_to_async(load_shard_totals)(ticket_types)
+        body = _render([t for t in ticket_types if t.unreserved_quantity > 0])
+        await cache.aset(key, body, settings.TICKETS_CATALOGUE_CACHE_SECONDS)
+    return body
@@ -0,0 +1,300 @@
+# tickets/checkin.py
+"""
+Venue check-in: validates scanned booking codes (Booking.unique_id) against an in-memory index.
+
+Each process keeps every paid booking's code, ticket count and entries admitted so far in dicts,
+so a scan costs a few dict lookups plus the INSERT of its CheckIn row, instead of a booking query.
+The index is loaded once, then topped up every CHECKIN_REFRESH_SECONDS with the bookings paid
+since the last refresh (Booking.paid_at). A code missing from it is looked up in the database, so
+a booking paid moments ago, or marked paid from the admin, still gets in. A booking archived since
+it was indexed fails its CheckIn insert; it is then dropped from the index and scans as unknown.
+
+A booking with N tickets admits N entries, numbered 1..N; the unique constraint on CheckIn makes
+each number usable once. A process whose count is behind (the booking was also scanned through
+another process) hits that constraint, reloads the count and tries the next number.
+
+The manifest is the index in a compact binary form for gate devices that must work offline:
+
+    header  ">4sBIQ"  b'TKCI', format version 1, record count, generated at (Unix seconds)
+    record  ">16sHH"  booking code (UUID bytes), tickets, entries admitted when generated
+
+Records are sorted by code, so a device can binary-search the file in place.
+"""
+import struct
+import threading
+import time
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Max, Sum
+from django.utils import timezone
+from .models import Booking, CheckIn
+
+MANIFEST_MAGIC = b'TKCI'
+MANIFEST_VERSION = 1
+MANIFEST_HEADER = struct.Struct('>4sBIQ')
+MANIFEST_RECORD = struct.Struct('>16sHH')
+
+
+class _Archived(Exception):
+    """Raised when an indexed booking no longer exists, e.g. it was archived after being indexed."""
+
+
+class PaidIndex:
+    """
+    The paid bookings of the database as of the last refresh, and the entries admitted per booking.
+    """
+    def __init__(self):
+        self.bookings = {} # Booking code as an int (smaller than a UUID object) -> booking pk
+        self.tickets = {}  # Booking pk -> tickets in the booking
+        self.admitted = {} # Booking pk -> entries admitted so far
+        self.refreshed_at = None
+        self._next_refresh = 0.0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.bookings)
+
+    def _add(self, rows):
+        """
+        Adds (unique_id, pk, tickets) rows. Returns the pks that were not indexed yet.
+        """
+        new = []
+        with self._lock:
+            for unique_id, pk, tickets in rows:
+                if pk not in self.tickets:
+                    new.append(pk)
+                self.bookings[unique_id.int] = pk
+                self.tickets[pk] = tickets or 0
+        return new
+
+    def _load_admitted(self, pks=None):
+        entries = CheckIn.objects.filter(status=CheckIn.ADMITTED)
+        if pks is not None:
+            entries = entries.filter(booking_id__in=pks)
+        counts = entries.order_by().values_list('booking').annotate(last=Max('entry_number'))
+        with self._lock:
+            for pk, last in counts:
+                self.admitted[pk] = max(self.admitted.get(pk, 0), last)
+
+    def refresh(self, full=False):
+        """
+        Loads the bookings paid since the last refresh (all of them on the first call or with `full`).
+        """
+        started = timezone.now()
+        paid = Booking.objects.filter(is_paid=True)
+        if not full and self.refreshed_at is not None:
+            # Overlaps the previous refresh, for payments that committed after it had read
+            paid = paid.filter(paid_at__gte=self.refreshed_at - timedelta(seconds=settings.CHECKIN_REFRESH_OVERLAP_SECONDS))
+        else:
+            full = True
+        rows = paid.annotate(ticket_count=Sum('booked_tickets__quantity')).values_list('unique_id', 'pk', 'ticket_count')
+        new = self._add(rows.iterator(chunk_size=5000))
+        if full:
+            self._load_admitted()
+        elif new:
+            for start in range(0, len(new), 500):
+                self._load_admitted(new[start:start + 500])
+        self.refreshed_at = started
+        self._next_refresh = time.monotonic() + settings.CHECKIN_REFRESH_SECONDS
+
+    def refresh_if_due(self):
+        if time.monotonic() < self._next_refresh:
+            return
+        # One thread refreshes; the others carry on with the index as it is
+        if self._refresh_lock.acquire(blocking=False):
+            try:
+                self.refresh()
+            finally:
+                self._refresh_lock.release()
+
+    def lookup(self, code):
+        """
+        Returns the booking pk of a paid booking code, or None if it is not in the index.
+        """
+        return self.bookings.get(code.int)
+
+    def reserve(self, pk):
+        """
+        Takes the booking's next entry number. Returns it, or None when every ticket is in.
+        """
+        with self._lock:
+            entry = self.admitted.get(pk, 0) + 1
+            if entry > self.tickets.get(pk, 0):
+                return None
+            self.admitted[pk] = entry
+            return entry
+
+    def unreserve(self, pk, entry):
+        with self._lock:
+            if self.admitted.get(pk) == entry:
+                self.admitted[pk] = entry - 1
+
+    def sync(self, pk):
+        """
+        Reloads a booking's admitted count from the database, after another process admitted it.
+        """
+        self._load_admitted([pk])
+
+    def discard(self, code, pk):
+        """
+        Drops a booking that no longer exists from the index.
+        """
+        with self._lock:
+            self.bookings.pop(code.int, None)
+            self.tickets.pop(pk, None)
+            self.admitted.pop(pk, None)
+
+    def add_booking(self, booking):
+        """
+        Indexes a paid booking found in the database on a miss.
+        """
+        if self._add([(booking.unique_id, booking.pk, booking.ticket_count)]):
+            self.sync(booking.pk)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """
+    Returns this process's index, loading it on first use.
+    """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = PaidIndex()
+                index.refresh(full=True)
+                _index = index
+    return _index
+
+
+def reset_index():
+    """
+    Drops the index, so the next scan reloads it (e.g. between tests).
+    """
+    global _index
+    _index = None
+
+
+def _record(status, code, gate, booking_id=None, entry=None):
+    return CheckIn.objects.create(booking_id=booking_id, code=code[:64], gate=gate[:50], status=status, entry_number=entry)
+
+
+def _record_indexed(index, status, code, gate, pk, entry=None):
+    """
+    Records a scan of an indexed booking. Raises _Archived, after dropping the booking from the
+    index, if the booking was deleted since it was indexed.
+    """
+    try:
+        with transaction.atomic():
+            _record(status, code, gate, pk, entry)
+    except IntegrityError:
+        # Only worth a query on this rare path: the scan normally never reads the booking
+        if Booking.objects.filter(pk=pk).exists():
+            raise
+        index.discard(uuid.UUID(code), pk)
+        raise _Archived()
+
+
+def _admit(index, pk, code, gate):
+    """
+    Records the booking's next entry. Returns the entry number, or None when every ticket is in.
+    """
+    while True:
+        entry = index.reserve(pk)
+        if entry is None:
+            return None
+        try:
+            _record_indexed(index, CheckIn.ADMITTED, code, gate, pk, entry)
+            return entry
+        except IntegrityError:
+            # Taken through another process: catch up with the database and try the next number
+            index.sync(pk)
+        except Exception:
+            index.unreserve(pk, entry)
+            raise
+
+
+def scan(code, gate=''):
+    """
+    Checks in one scanned booking code. Returns (status, details); status is one of the CheckIn
+    statuses, and details carries 'entry' and 'tickets' for a known booking. Every scan is recorded.
+    """
+    code = str(code).strip()
+    try:
+        key = uuid.UUID(code)
+    except ValueError:
+        _record(CheckIn.UNKNOWN, code, gate)
+        return CheckIn.UNKNOWN, {}
+
+    index = get_index()
+    index.refresh_if_due()
+    pk = index.lookup(key)
+    if pk is None:
+        # Not paid as of the last refresh: ask the database
+        booking = (
+            Booking.objects.filter(unique_id=key).annotate(ticket_count=Sum('booked_tickets__quantity'))
+            .only('pk', 'unique_id', 'is_paid').first()
+        )
+        if booking is None:
+            _record(CheckIn.UNKNOWN, code, gate)
+            return CheckIn.UNKNOWN, {}
+        if not booking.is_paid:
+            _record(CheckIn.UNPAID, code, gate, booking.pk)
+            return CheckIn.UNPAID, {}
+        index.add_booking(booking)
+        pk = booking.pk
+
+    details = {'tickets': index.tickets[pk]}
+    try:
+        entry = _admit(index, pk, code, gate)
+        if entry is None:
+            _record_indexed(index, CheckIn.ALREADY_USED, code, gate, pk)
+            return CheckIn.ALREADY_USED, details
+    except _Archived:
+        _record(CheckIn.UNKNOWN, code, gate)
+        return CheckIn.UNKNOWN, {}
+    return CheckIn.ADMITTED, {**details, 'entry': entry}
+
+
+def write_manifest(file):
+    """
+    Writes the manifest of the current index to a binary file object. Returns the record count.
+    """
+    index = get_index()
+    index.refresh()
+    with index._lock:
+        records = sorted(
+            (code, index.tickets[pk], index.admitted.get(pk, 0)) for code, pk in index.bookings.items()
+        )
+    file.write(MANIFEST_HEADER.pack(MANIFEST_MAGIC, MANIFEST_VERSION, len(records), int(time.time())))
+    for start in range(0, len(records), 10_000):
+        file.write(b''.join(
+            MANIFEST_RECORD.pack(code.to_bytes(16, 'big'), min(tickets, 0xFFFF), min(admitted, 0xFFFF))
+            for code, tickets, admitted in records[start:start + 10_000]
+        ))
+    return len(records)
+
+
+def read_manifest(data):
+    """
+    Parses a manifest. Returns (generated at, {UUID: (tickets, admitted)}).
+    Raises ValueError if `data` is not a manifest this version can read.
+    """
+    if len(data) < MANIFEST_HEADER.size:
+        raise ValueError('Truncated check-in manifest.')
+    magic, version, count, generated_at = MANIFEST_HEADER.unpack_from(data)
+    if magic != MANIFEST_MAGIC or version != MANIFEST_VERSION:
+        raise ValueError('Not a check-in manifest, or an unsupported version.')
+    if len(data) != MANIFEST_HEADER.size + count * MANIFEST_RECORD.size:
+        raise ValueError('Truncated check-in manifest.')
+    records = {
+        uuid.UUID(bytes=code): (tickets, admitted)
+        for code, tickets, admitted in MANIFEST_RECORD.iter_unpack(data[MANIFEST_HEADER.size:])
+    }
+    return generated_at, records
@@ -0,0 +1,108 @@
+# tickets/db_router.py
+"""
+Primary/replica routing.
+
+Writes always go to the primary ('default'). Reads go to the 'replica' database only inside requests
+that opt in, which `ReplicaRoutingMiddleware` allows for safe (GET/HEAD) requests to admin pages and to
+views decorated with `replica_reads`, such as the ticket catalogue (whose shared cache is still rebuilt
+from the primary, see tickets.catalogue). Everything else, including the booking and payment callback
+views, reads from the primary.
+
+Reads stick to the primary, so a client always sees its own writes:
+  * for the rest of a request once it has written anything, and
+  * for DB_REPLICA_STICKY_SECONDS after a request that wrote, through a short-lived cookie.
+
+Without a 'replica' in DATABASES the router is a no-op.
+"""
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+REPLICA = 'replica'
+PRIMARY_COOKIE = 'tickets_primary' # Set after a write, pins the client's reads to the primary
+
+
+class _Routing:
+    def __init__(self):
+        self.replica_reads = False
+        self.wrote = False
+
+
+_routing = ContextVar('tickets_db_routing', default=None)
+
+
+def replica_reads(view):
+    """
+    Marks a view whose safe requests may read from the replica.
+    """
+    view.replica_reads = True
+    return view
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        routing = _routing.get()
+        if routing is not None and routing.replica_reads and not routing.wrote and REPLICA in connections.settings:
+            return REPLICA
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        routing = _routing.get()
+        if routing is not None:
+            routing.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True # The replica holds the same data as the primary
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Decides per request whether its reads may use the replica (see the module docstring).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        routing = _Routing()
+        token = _routing.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            _routing.reset(token)
+        return self.pin_after_write(request, response, routing)
+
+    async def __acall__(self, request):
+        routing = _Routing()
+        token = _routing.set(routing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _routing.reset(token)
+        return self.pin_after_write(request, response, routing)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        routing = _routing.get()
+        if routing is None or request.method not in ('GET', 'HEAD') or PRIMARY_COOKIE in request.COOKIES:
+            return None
+        match = request.resolver_match
+        routing.replica_reads = getattr(view_func, 'replica_reads', False) or (match is not None and match.namespace == 'admin')
+        return None
+
+    def pin_after_write(self, request, response, routing):
+        if routing.wrote and REPLICA in connections.settings:
+            response.set_cookie(
+                PRIMARY_COOKIE, '1', max_age=settings.DB_REPLICA_STICKY_SECONDS, httponly=True, samesite='Lax',
+            )
+        return response
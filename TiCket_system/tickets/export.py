@@ -0,0 +1,101 @@
+# tickets/export.py
+"""
+Streaming export of booked tickets, one row per booked line, for door scanning and finance reconciliation.
+
+Rows are read with `QuerySet.iterator()` and encoded in small batches, so memory use stays
+flat however many bookings are exported.
+"""
+import csv
+from datetime import datetime, time
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from .models import BookedTicket
+
+COLUMNS = (
+    ('booking_id', 'booking__unique_id'),
+    ('customer_name', 'booking__customer_name'),
+    ('customer_email', 'booking__customer_email'),
+    ('booking_time', 'booking__booking_time'),
+    ('is_paid', 'booking__is_paid'),
+    ('transaction_id', 'booking__transaction_id'),
+    ('ticket_type', 'ticket_type__name'),
+    ('price', 'ticket_type__price'),
+    ('quantity', 'quantity'),
+    ('subtotal', 'subtotal'),
+)
+HEADER = [name for name, _ in COLUMNS]
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+BATCH_ROWS = 500 # Rows encoded into one chunk of output
+
+
+def parse_when(value, end=False):
+    """
+    Parses an ISO date or datetime. A bare date means the start of that day, or its end if `end`.
+    Raises ValueError for anything else.
+    """
+    when = parse_datetime(value)
+    if when is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Invalid date: {value!r}")
+        when = datetime.combine(day, time.max if end else time.min)
+    if timezone.is_naive(when):
+        when = timezone.make_aware(when)
+    return when
+
+
+def export_rows(since=None, until=None, is_paid=None, chunk_size=2000):
+    """
+    Yields one tuple per booked ticket, in HEADER order, for bookings made in [since, until].
+    """
+    queryset = BookedTicket.objects.all()
+    if since is not None:
+        queryset = queryset.filter(booking__booking_time__gte=since)
+    if until is not None:
+        queryset = queryset.filter(booking__booking_time__lte=until)
+    if is_paid is not None:
+        queryset = queryset.filter(booking__is_paid=is_paid)
+    # values_list skips model instantiation; ordering by the FK keeps a booking's lines together
+    return queryset.order_by('booking_id', 'pk').values_list(*(source for _, source in COLUMNS)).iterator(chunk_size=chunk_size)
+
+
+class _Echo:
+    """A file-like object that hands back what csv.writer writes, instead of storing it."""
+    def write(self, value):
+        return value
+
+
+def _batched(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_ROWS:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def csv_chunks(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(HEADER)
+    for batch in _batched(rows):
+        yield ''.join(writer.writerow(row) for row in batch)
+
+
+def ndjson_chunks(rows):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for batch in _batched(rows):
+        yield ''.join(encoder.encode(dict(zip(HEADER, row))) + '\n' for row in batch)
+
+
+def export_chunks(format, **filters):
+    """
+    Yields the export as text chunks in `format` ('csv' or 'ndjson').
+    """
+    rows = export_rows(**filters)
+    return csv_chunks(rows) if format == 'csv' else ndjson_chunks(rows)
@@ -0,0 +1,127 @@
+# tickets/fake_gateway.py
+"""
+A local stand-in for the SSLCommerz API, for tests, load tests and benchmarks.
+
+It implements the session initiation and validator endpoints used by `tickets.gateway`.
+Every initiated session is treated as paid, with `val_id` = "VAL-<tran_id>".
+Point SSLCOMMERZ_BASE_URL at it, or pass `base_url=server.url` to a gateway client.
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from .gateway import INITIATE_PATH, VALIDATE_PATH
+
+
+def val_id_for(tran_id):
+    return f"VAL-{tran_id}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # Keep-alive, like the real gateway
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _simulate(self):
+        """
+        Applies the configured latency and failure rate. Returns False if the request should fail.
+        """
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        with server.lock:
+            server.request_count += 1
+        if server.failure_rate and random.random() < server.failure_rate:
+            self._send_json({'status': 'FAILED', 'failedreason': 'Injected failure'}, status=503)
+            return False
+        return True
+
+    def do_POST(self):
+        if urlparse(self.path).path != INITIATE_PATH:
+            return self._send_json({'status': 'FAILED', 'failedreason': 'Not found'}, status=404)
+        length = int(self.headers.get('Content-Length', 0))
+        data = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+        if not self._simulate():
+            return
+        tran_id = data.get('tran_id')
+        if not tran_id or data.get('store_id') != self.server.store_id:
+            return self._send_json({'status': 'FAILED', 'failedreason': 'Invalid store or transaction'})
+        with self.server.lock:
+            self.server.sessions[tran_id] = data
+        self._send_json({
+            'status': 'SUCCESS',
+            'sessionkey': f"SESSION-{tran_id}",
+            'GatewayPageURL': f"{self.server.url}/gwprocess/v4/gw.php?Q=pay&SESSIONKEY=SESSION-{tran_id}",
+        })
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != VALIDATE_PATH:
+            return self._send_json({'status': 'FAILED', 'failedreason': 'Not found'}, status=404)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if not self._simulate():
+            return
+        val_id = params.get('val_id', '')
+        tran_id = val_id[len('VAL-'):] if val_id.startswith('VAL-') else None
+        with self.server.lock:
+            session = self.server.sessions.get(tran_id)
+        if session is None or params.get('store_id') != self.server.store_id:
+            return self._send_json({'status': 'INVALID_TRANSACTION'})
+        self._send_json({
+            'status': 'VALID',
+            'tran_id': tran_id,
+            'val_id': val_id,
+            'amount': session['total_amount'],
+            'currency': session.get('currency', 'BDT'),
+        })
+
+
+class FakeSSLCommerzServer(ThreadingHTTPServer):
+    """
+    Threaded fake gateway. Use as a context manager to run it in a background thread:
+
+        with FakeSSLCommerzServer(store_id='test') as server:
+            client = SSLCommerzClient(base_url=server.url)
+    """
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, store_id=None, latency=0.0, failure_rate=0.0):
+        super().__init__((host, port), _Handler)
+        self.store_id = store_id
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.sessions = {}
+        self.request_count = 0
+        self.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
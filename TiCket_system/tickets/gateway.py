@@ -0,0 +1,191 @@
+# tickets/gateway.py
+import asyncio
+import random
+import threading
+import time
+import weakref
+from django.conf import settings
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from .instrumentation import timed
+import logging
+
+logger = logging.getLogger(__name__)
+
+INITIATE_PATH = '/gwprocess/v4/api.php'
+VALIDATE_PATH = '/validator/api/validationserverAPI.php'
+
+# Gateway responses worth retrying: the request never reached SSLCommerz or it was overloaded
+RETRY_STATUSES = {502, 503, 504}
+
+
+class GatewayError(Exception):
+    """Raised when SSLCommerz cannot be reached or keeps failing after all retries."""
+
+
+def default_base_url():
+    if settings.SSLCOMMERZ_BASE_URL:
+        return settings.SSLCOMMERZ_BASE_URL.rstrip('/')
+    # Determine SSLCommerz API endpoint based on DEBUG setting
+    if settings.DEBUG:
+        return 'https://sandbox.sslcommerz.com'
+    return 'https://securepay.sslcommerz.com'
+
+
+def backoff_delay(attempt, base):
+    """
+    Exponential backoff with full jitter, so retrying workers do not hit the gateway in lockstep.
+    """
+    return random.uniform(0, base * (2 ** attempt))
+
+
+class _ClientConfig:
+    def __init__(self, base_url=None, pool_size=None, connect_timeout=None, read_timeout=None,
+                 max_retries=None, backoff=None):
+        self.base_url = base_url or default_base_url()
+        self.pool_size = pool_size or settings.SSLCOMMERZ_POOL_SIZE
+        self.connect_timeout = connect_timeout or settings.SSLCOMMERZ_CONNECT_TIMEOUT
+        self.read_timeout = read_timeout or settings.SSLCOMMERZ_READ_TIMEOUT
+        self.max_retries = settings.SSLCOMMERZ_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff = settings.SSLCOMMERZ_RETRY_BACKOFF if backoff is None else backoff
+
+    def store_credentials(self):
+        return {
+            'store_id': settings.SSLCOMMERZ_STORE_ID,
+            'store_passwd': settings.SSLCOMMERZ_STORE_PASSWORD,
+        }
+
+
+class SSLCommerzClient(_ClientConfig):
+    """
+    Blocking SSLCommerz client backed by one pooled keep-alive session.
+    Share a single instance per process (see `get_client`) so TLS connections are reused.
+    """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _request(self, method, path, **kwargs):
+        url = self.base_url + path
+        for attempt in range(self.max_retries + 1):
+            try:
+                with timed('gateway'):
+                    response = self.session.request(
+                        method, url, timeout=(self.connect_timeout, self.read_timeout), **kwargs
+                    )
+                if response.status_code not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    return response.json()
+                error = GatewayError(f"SSLCommerz returned HTTP {response.status_code}")
+            except requests.exceptions.ConnectionError as e:
+                # Connection refused/reset or connect timeout: the request was not processed
+                error = GatewayError(f"Could not connect to SSLCommerz: {e}")
+            except (requests.exceptions.RequestException, ValueError) as e:
+                raise GatewayError(f"SSLCommerz request failed: {e}") from e
+
+            if attempt < self.max_retries:
+                delay = backoff_delay(attempt, self.backoff)
+                logger.warning("%s; retrying %s %s in %.2fs", error, method, path, delay)
+                time.sleep(delay)
+        raise error
+
+    def initiate_payment(self, post_data):
+        """
+        Creates a payment session and returns the gateway's JSON response.
+        """
+        return self._request('POST', INITIATE_PATH, data={**self.store_credentials(), **post_data})
+
+    def validate(self, val_id):
+        """
+        Asks the validator API whether `val_id` is a genuine payment and returns its JSON response.
+        """
+        params = {**self.store_credentials(), 'val_id': val_id, 'format': 'json'}
+        return self._request('GET', VALIDATE_PATH, params=params)
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncSSLCommerzClient(_ClientConfig):
+    """
+    Non-blocking counterpart of `SSLCommerzClient` for async views.
+    An httpx connection pool is bound to one event loop, use `get_async_client` to get the one for the running loop.
+    """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+            timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+        )
+
+    async def _request(self, method, path, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            try:
+                with timed('gateway'):
+                    response = await self.client.request(method, path, **kwargs)
+                if response.status_code not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    return response.json()
+                error = GatewayError(f"SSLCommerz returned HTTP {response.status_code}")
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                error = GatewayError(f"Could not connect to SSLCommerz: {e}")
+            except (httpx.HTTPError, ValueError) as e:
+                raise GatewayError(f"SSLCommerz request failed: {e}") from e
+
+            if attempt < self.max_retries:
+                delay = backoff_delay(attempt, self.backoff)
+                logger.warning("%s; retrying %s %s in %.2fs", error, method, path, delay)
+                await asyncio.sleep(delay)
+        raise error
+
+    async def initiate_payment(self, post_data):
+        return await self._request('POST', INITIATE_PATH, data={**self.store_credentials(), **post_data})
+
+    async def validate(self, val_id):
+        params = {**self.store_credentials(), 'val_id': val_id, 'format': 'json'}
+        return await self._request('GET', VALIDATE_PATH, params=params)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+_client = None
+_client_lock = threading.Lock()
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_client():
+    """
+    Returns the process-wide blocking client, creating it on first use.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = SSLCommerzClient()
+    return _client
+
+
+def get_async_client():
+    """
+    Returns the async client for the running event loop, creating it on first use.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncSSLCommerzClient()
+    return client
+
+
+async def close_async_client():
+    """
+    Closes the running loop's async client, e.g. on ASGI lifespan shutdown.
+    """
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
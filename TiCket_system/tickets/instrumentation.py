@@ -0,0 +1,243 @@
+# tickets/instrumentation.py
+"""
+Per-request performance instrumentation.
+
+`InstrumentationMiddleware` measures every request and breaks its time down by phase: database
+queries (counted through a DB execute wrapper), SSLCommerz calls, template rendering and email.
+Code marks a phase with the `timed` context manager:
+
+    with timed('gateway'):
+        response = session.post(...)
+
+Each request's breakdown is logged to `tickets.requests` (kept at the LOG_SAMPLE_REQUESTS rate) and
+returned in a `Server-Timing` header.
+Histograms aggregated over all requests are served in the Prometheus text format by the
+`metrics` view. They live in process memory, so each worker process reports its own.
+"""
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+logger = logging.getLogger('tickets.requests')
+
+PHASES = ('db', 'gateway', 'template', 'email')
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+
+class Histogram:
+    """
+    A labelled Prometheus histogram. Only the bucket counts, sum and count are kept.
+    """
+    def __init__(self, name, help, labelnames, buckets):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, [list(s[0]), s[1], s[2]]) for labels, s in self._series.items())
+        for labels, (counts, total, count) in series:
+            label_text = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labels))
+            prefix = label_text + ',' if label_text else ''
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {total}')
+            lines.append(f'{self.name}_count{{{label_text}}} {count}')
+        return '\n'.join(lines)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REQUEST_SECONDS = Histogram(
+    'tickets_request_duration_seconds', 'Time to handle a request.', ('view', 'method', 'status'), DURATION_BUCKETS,
+)
+PHASE_SECONDS = Histogram(
+    'tickets_request_phase_seconds', 'Time a request spent in each phase.', ('view', 'phase'), DURATION_BUCKETS,
+)
+REQUEST_QUERIES = Histogram(
+    'tickets_request_db_queries', 'Database queries issued by a request.', ('view',), QUERY_COUNT_BUCKETS,
+)
+# Phases timed outside any request, e.g. by `send_outbox_emails`
+BACKGROUND_PHASE_SECONDS = Histogram(
+    'tickets_background_phase_seconds', 'Time spent in each phase outside requests.', ('phase',), DURATION_BUCKETS,
+)
+HISTOGRAMS = [REQUEST_SECONDS, PHASE_SECONDS, REQUEST_QUERIES, BACKGROUND_PHASE_SECONDS]
+
+
+class RequestTimings:
+    def __init__(self):
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+        self.queries = 0
+
+    def add(self, phase, seconds):
+        self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+
+
+# Set by the middleware for the duration of a request. asgiref copies the context into
+# sync_to_async threads, so work the request hands to a thread is still counted.
+_current = ContextVar('tickets_request_timings', default=None)
+
+
+@contextmanager
+def timed(phase):
+    """
+    Adds the time spent in the block to `phase` of the current request, or to the background
+    histogram outside a request.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        timings = _current.get()
+        if timings is not None:
+            timings.add(phase, elapsed)
+        else:
+            BACKGROUND_PHASE_SECONDS.observe(elapsed, phase)
+
+
+def _db_wrapper(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.add('db', time.perf_counter() - start)
+        timings.queries += 1
+
+
+def install_db_wrapper(sender, connection, **kwargs):
+    """
+    `connection_created` receiver: counts the queries of every new connection, in any thread.
+    """
+    if _db_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_db_wrapper)
+
+
+class _KeyValues:
+    """
+    The key=value part of a request's log line, built only if the line is written.
+    """
+    __slots__ = ('record',)
+
+    def __init__(self, record):
+        self.record = record
+
+    def __str__(self):
+        return ' '.join(f"{key}={value}" for key, value in self.record.items() if key not in ('method', 'status') and value != 0)
+
+
+class InstrumentationMiddleware:
+    """
+    Times each request and records its phase breakdown. Place it near the top of MIDDLEWARE
+    so that the total includes the other middleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timings, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timings, time.perf_counter() - start)
+
+    def finish(self, request, response, timings, total):
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        REQUEST_SECONDS.observe(total, view, request.method, response.status_code)
+        REQUEST_QUERIES.observe(timings.queries, view)
+        for phase, seconds in timings.seconds.items():
+            PHASE_SECONDS.observe(seconds, view, phase)
+
+        record = {
+            'view': view,
+            'method': request.method,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 2),
+            'db_queries': timings.queries,
+            **{f"{phase}_ms": round(seconds * 1000, 2) for phase, seconds in timings.seconds.items()},
+        }
+        logger.info(
+            "%s %s %s %s", request.method, request.path, response.status_code, _KeyValues(record),
+            extra={'timings': record},
+        )
+        if settings.TICKETS_SERVER_TIMING:
+            response['Server-Timing'] = server_timing(timings, total)
+        return response
+
+
+def server_timing(timings, total):
+    """
+    The Server-Timing header value: each phase the request spent time in, then the total.
+    """
+    metrics = []
+    for phase, seconds in timings.seconds.items():
+        if phase == 'db' and timings.queries:
+            metrics.append(f'db;dur={seconds * 1000:.2f};desc="{timings.queries} queries"')
+        elif seconds:
+            metrics.append(f'{phase};dur={seconds * 1000:.2f}')
+    metrics.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(metrics)
+
+
+def render_prometheus(extra_counters=()):
+    """
+    Renders all histograms, plus (name, help, {labels: value}) counters, in the Prometheus text format.
+    """
+    parts = [histogram.render() for histogram in HISTOGRAMS]
+    for name, help, values in extra_counters:
+        lines = [f"# HELP {name} {help}", f"# TYPE {name} counter"]
+        for labels, value in sorted(values.items()):
+            label_text = ','.join(f'{key}="{_escape(val)}"' for key, val in labels)
+            lines.append(f'{name}{{{label_text}}} {value}' if label_text else f'{name} {value}')
+        parts.append('\n'.join(lines))
+    return '\n'.join(parts) + '\n'
@@ -0,0 +1,467 @@
+# tickets/inventory.py
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, Q, Sum, Value, When
+from django.utils import timezone
+from .models import TicketType, TicketStockShard, TicketHold
+import logging
+import random
+
+logger = logging.getLogger(__name__)
+
+SHARD_TOTAL_CACHE_KEY = 'tickets:shard-total:{}'
+
+
+class _InsufficientStock(Exception):
+    """Raised to roll back a bulk update that could not be applied to every row."""
+
+
+def _quantities_by_type(lines):
+    """
+    Sums quantities per ticket type id.
+    A booking may contain several lines (or holds) for the same ticket type.
+    """
+    quantities = defaultdict(int)
+    for line in lines:
+        quantities[line.ticket_type_id] += line.quantity
+    return dict(quantities)
+
+
+def _quantities_by_shard(holds):
+    """
+    Sums quantities per (ticket type id, shard index) for holds placed on shards.
+    """
+    quantities = defaultdict(int)
+    for hold in holds:
+        quantities[(hold.ticket_type_id, hold.shard_index)] += hold.quantity
+    return dict(quantities)
+
+
+def _per_type(values):
+    """
+    Builds a CASE expression selecting the value for each ticket type id.
+    """
+    whens = [When(id=ticket_type_id, then=Value(value)) for ticket_type_id, value in values.items()]
+    return Case(*whens, default=Value(0))
+
+
+def _per_shard(values):
+    """
+    Builds a CASE expression selecting the value for each (ticket type id, shard index).
+    """
+    whens = [
+        When(ticket_type_id=ticket_type_id, index=index, then=Value(value))
+        for (ticket_type_id, index), value in values.items()
+    ]
+    return Case(*whens, default=Value(0))
+
+
+def _shards_of(values):
+    """
+    Builds a filter matching the shards keyed in `values`.
+    """
+    condition = Q()
+    for ticket_type_id, index in values:
+        condition |= Q(ticket_type_id=ticket_type_id, index=index)
+    return TicketStockShard.objects.filter(condition)
+
+
+def _guarded_update(ticket_type_ids, guard, **updates):
+    """
+    Applies `updates` to every ticket type in `ticket_type_ids` with a single conditional UPDATE.
+
+    `guard(ticket_type_id)` returns the Q that must hold for that row to be updated.
+    If any row fails its guard, nothing is changed and the ids of the failing rows are returned,
+    otherwise an empty set is returned.
+    """
+    condition = Q()
+    for ticket_type_id in ticket_type_ids:
+        condition |= guard(ticket_type_id)
+
+    try:
+        with transaction.atomic():
+            updated = TicketType.objects.filter(condition).update(**updates)
+            if updated != len(ticket_type_ids):
+                # Roll back the partial update, the caller decides how to proceed
+                raise _InsufficientStock()
+        return set()
+    except _InsufficientStock:
+        pass
+
+    # Slow path: lock the rows that pass their guard, so the failing set cannot change before it is acted on
+    with transaction.atomic():
+        passing = TicketType.objects.select_for_update().filter(condition).values_list('id', flat=True)
+        failed = set(ticket_type_ids) - set(passing)
+        if not failed:
+            # Stock was freed since the UPDATE above; every row passes now and stays locked
+            TicketType.objects.filter(condition).update(**updates)
+    return failed
+
+
+def _spread_over_shards(ticket_type, quantity, take):
+    """
+    Takes `quantity` units from the shards of a sharded ticket type.
+
+    A random shard is tried first so concurrent callers land on different rows. If it cannot
+    cover the whole quantity, the remainder spills over to the other shards, fullest first.
+    `take(index, amount)` must apply a guarded UPDATE to that shard and return whether it matched.
+    Returns the list of (shard index, amount) taken, or None if the shards together were short,
+    in which case the caller must roll back the partial takes.
+    """
+    start = random.randrange(ticket_type.shard_count)
+    if take(start, quantity):
+        return [(start, quantity)]
+
+    spare = dict(
+        TicketStockShard.objects.filter(ticket_type_id=ticket_type.id)
+        .values_list('index', F('available_quantity') - F('held_quantity'))
+    )
+    taken = []
+    remaining = quantity
+    for index in sorted(spare, key=spare.get, reverse=True):
+        amount = min(remaining, spare[index])
+        if amount <= 0:
+            break
+        if take(index, amount):
+            taken.append((index, amount))
+            remaining -= amount
+            if not remaining:
+                return taken
+    return None
+
+
+def _take_from_shards(ticket_type, quantity, **updates):
+    """
+    Spreads `quantity` over the shards of `ticket_type` inside a savepoint, applying
+    `updates(amount)` to each shard used. Returns the shards taken, or None with nothing changed.
+    """
+    def take(index, amount):
+        return TicketStockShard.objects.filter(
+            ticket_type_id=ticket_type.id, index=index,
+            available_quantity__gte=F('held_quantity') + amount,
+        ).update(**{field: update(amount) for field, update in updates.items()}) == 1
+
+    try:
+        with transaction.atomic():
+            taken = _spread_over_shards(ticket_type, quantity, take)
+            if taken is None:
+                raise _InsufficientStock()
+        return taken
+    except _InsufficientStock:
+        return None
+
+
+def _stock_changed(ticket_type_ids):
+    """
+    Invalidates cached stock figures once the current transaction commits.
+    """
+    # Imported here because the catalogue module depends on this one
+    from .catalogue import bump_version
+
+    def invalidate():
+        cache.delete_many([SHARD_TOTAL_CACHE_KEY.format(pk) for pk in ticket_type_ids])
+        bump_version()
+
+    transaction.on_commit(invalidate)
+
+
+def _release_holds(holds, status):
+    """
+    Returns the quantity of `holds` to the unreserved pool and marks them with `status`.
+    Must be called inside a transaction with the holds locked.
+    """
+    if not holds:
+        return
+    released = _quantities_by_type([hold for hold in holds if hold.shard_index is None])
+    if released:
+        TicketType.objects.filter(id__in=released).update(
+            held_quantity=F('held_quantity') - _per_type(released)
+        )
+    released_shards = _quantities_by_shard([hold for hold in holds if hold.shard_index is not None])
+    if released_shards:
+        _shards_of(released_shards).update(held_quantity=F('held_quantity') - _per_shard(released_shards))
+    TicketHold.objects.filter(id__in=[hold.id for hold in holds]).update(status=status)
+    _stock_changed({hold.ticket_type_id for hold in holds})
+
+
+def load_shard_totals(ticket_types, use_cache=True):
+    """
+    Replaces the quantity snapshot of sharded ticket types with the sum of their shards.
+
+    Totals are read in one aggregate query and cached for TICKET_SHARD_TOTAL_CACHE_SECONDS,
+    so the catalogue does not re-aggregate hot ticket types on every request.
+    """
+    sharded = {ticket_type.id: ticket_type for ticket_type in ticket_types if ticket_type.shard_count}
+    if not sharded:
+        return ticket_types
+
+    totals = {}
+    if use_cache:
+        cached = cache.get_many([SHARD_TOTAL_CACHE_KEY.format(pk) for pk in sharded])
+        totals = {pk: cached[key] for pk in sharded if (key := SHARD_TOTAL_CACHE_KEY.format(pk)) in cached}
+
+    missing = [pk for pk in sharded if pk not in totals]
+    if missing:
+        fresh = {
+            row['ticket_type_id']: (row['available'], row['held'])
+            # From the primary, like the catalogue they end up in: the totals are cached for every reader
+            for row in TicketStockShard.objects.using('default').filter(ticket_type_id__in=missing)
+            .values('ticket_type_id')
+            .annotate(available=Sum('available_quantity'), held=Sum('held_quantity'))
+        }
+        fresh = {pk: fresh.get(pk, (0, 0)) for pk in missing}
+        cache.set_many(
+            {SHARD_TOTAL_CACHE_KEY.format(pk): total for pk, total in fresh.items()},
+            settings.TICKET_SHARD_TOTAL_CACHE_SECONDS,
+        )
+        totals.update(fresh)
+
+    for pk, (available, held) in totals.items():
+        sharded[pk].available_quantity = available
+        sharded[pk].held_quantity = held
+    return ticket_types
+
+
+def reserve_for_booking(booking, booked_tickets, ttl=None):
+    """
+    Places a hold on stock for each booked line of a freshly created booking.
+
+    Holds on unsharded ticket types are taken with one conditional UPDATE, guarded so that
+    `held_quantity` never exceeds `available_quantity`; sharded ticket types hold on one or
+    more of their shards. Holds are all-or-nothing: if any ticket type is short, nothing is
+    reserved and the ticket types that could not be held are returned.
+    """
+    if ttl is None:
+        ttl = settings.TICKET_HOLD_TTL_SECONDS
+    expires_at = timezone.now() + timedelta(seconds=ttl)
+
+    row_lines = [bt for bt in booked_tickets if not bt.ticket_type.shard_count]
+    sharded_lines = [bt for bt in booked_tickets if bt.ticket_type.shard_count]
+    quantities = _quantities_by_type(row_lines)
+    holds = [
+        TicketHold(
+            booking=booking,
+            booked_ticket=booked_ticket,
+            ticket_type_id=booked_ticket.ticket_type_id,
+            quantity=booked_ticket.quantity,
+            expires_at=expires_at,
+        )
+        for booked_ticket in row_lines
+    ]
+
+    short_sharded = None
+    # Savepoints are only needed to undo row holds when a sharded ticket type turns out short
+    with transaction.atomic(savepoint=bool(sharded_lines)):
+        if quantities:
+            failed_type_ids = _guarded_update(
+                quantities,
+                lambda ticket_type_id: Q(id=ticket_type_id, available_quantity__gte=F('held_quantity') + quantities[ticket_type_id]),
+                held_quantity=F('held_quantity') + _per_type(quantities),
+            )
+            if failed_type_ids:
+                return list(TicketType.objects.filter(id__in=failed_type_ids))
+
+        try:
+            with transaction.atomic(savepoint=bool(sharded_lines)):
+                for booked_ticket in sharded_lines:
+                    ticket_type = booked_ticket.ticket_type
+                    taken = _take_from_shards(
+                        ticket_type, booked_ticket.quantity,
+                        held_quantity=lambda amount: F('held_quantity') + amount,
+                    )
+                    if taken is None:
+                        raise _InsufficientStock(ticket_type)
+                    holds.extend(
+                        TicketHold(
+                            booking=booking,
+                            booked_ticket=booked_ticket,
+                            ticket_type_id=ticket_type.id,
+                            quantity=amount,
+                            shard_index=index,
+                            expires_at=expires_at,
+                        )
+                        for index, amount in taken
+                    )
+        except _InsufficientStock as e:
+            # Give back the row holds taken above
+            short_sharded = e.args[0]
+            transaction.set_rollback(True)
+        else:
+            TicketHold.objects.bulk_create(holds)
+            _stock_changed({bt.ticket_type_id for bt in booked_tickets})
+
+    if short_sharded is not None:
+        return load_shard_totals([short_sharded], use_cache=False)
+    return []
+
+
+def _decrement_shards(ticket_types, quantities, holds):
+    """
+    Decrements sharded ticket types: held quantities come off the shard they were held on,
+    anything not covered by a live hold is spread over the shards like a new hold.
+    Returns the ids of ticket types that could not be fulfilled, with nothing changed for them.
+    """
+    held = _quantities_by_type(holds)
+    failed_type_ids = set()
+    for ticket_type_id, quantity in quantities.items():
+        unheld = quantity - held.get(ticket_type_id, 0)
+        if unheld > 0 and _take_from_shards(
+            ticket_types[ticket_type_id], unheld,
+            available_quantity=lambda amount: F('available_quantity') - amount,
+        ) is None:
+            failed_type_ids.add(ticket_type_id)
+
+    consumed = _quantities_by_shard([hold for hold in holds if hold.ticket_type_id not in failed_type_ids])
+    if consumed:
+        _shards_of(consumed).update(
+            available_quantity=F('available_quantity') - _per_shard(consumed),
+            held_quantity=F('held_quantity') - _per_shard(consumed),
+        )
+    return failed_type_ids
+
+
+def decrement_for_booking(booking):
+    """
+    Decrements available stock for every ticket booked in `booking`.
+
+    Live holds of the booking are consumed in the same UPDATE, so lines that were reserved
+    at booking time always succeed. Lines whose hold already expired are only fulfilled
+    from unreserved stock. Unsharded ticket types are decremented with one conditional UPDATE
+    inside a single transaction, so concurrent callbacks can never oversell. If some ticket
+    types are short on stock, the remaining types are still decremented and the booked lines
+    that could not be fulfilled are returned.
+    """
+    booked_tickets = list(booking.booked_tickets.select_related('ticket_type'))
+    ticket_types = {bt.ticket_type_id: bt.ticket_type for bt in booked_tickets}
+    sharded_ids = {pk for pk, ticket_type in ticket_types.items() if ticket_type.shard_count}
+    quantities = _quantities_by_type(booked_tickets)
+    if not quantities:
+        return []
+
+    # Joins the caller's transaction (e.g. the one marking the booking paid) without a savepoint
+    with transaction.atomic(savepoint=False):
+        # Lock the live holds so the expiry sweeper cannot release them underneath us
+        holds = list(TicketHold.objects.select_for_update().filter(booking=booking, status=TicketHold.ACTIVE))
+        held = _quantities_by_type(hold for hold in holds if hold.shard_index is None)
+
+        def guard(ticket_type_id):
+            # Stock not reserved by anyone else must cover this booking's unreserved part
+            return Q(
+                id=ticket_type_id,
+                available_quantity__gte=F('held_quantity') - held.get(ticket_type_id, 0) + quantities[ticket_type_id],
+            )
+
+        # Fast path is a single UPDATE. If a ticket type is short, drop it and retry with the rest.
+        failed_type_ids = set()
+        remaining = {t: q for t, q in quantities.items() if t not in sharded_ids}
+        while remaining:
+            remaining_held = {t: q for t, q in held.items() if t in remaining}
+            short = _guarded_update(
+                remaining, guard,
+                available_quantity=F('available_quantity') - _per_type(remaining),
+                held_quantity=F('held_quantity') - _per_type(remaining_held),
+            )
+            if not short:
+                break
+            failed_type_ids |= short
+            remaining = {t: q for t, q in remaining.items() if t not in short}
+
+        if sharded_ids:
+            failed_type_ids |= _decrement_shards(
+                ticket_types,
+                {t: q for t, q in quantities.items() if t in sharded_ids},
+                [hold for hold in holds if hold.ticket_type_id in sharded_ids],
+            )
+
+        if failed_type_ids:
+            _release_holds([hold for hold in holds if hold.ticket_type_id in failed_type_ids], TicketHold.RELEASED)
+            holds = [hold for hold in holds if hold.ticket_type_id not in failed_type_ids]
+
+        TicketHold.objects.filter(id__in=[hold.id for hold in holds]).update(status=TicketHold.CONSUMED)
+        _stock_changed(set(quantities) - failed_type_ids)
+
+    failed = [bt for bt in booked_tickets if bt.ticket_type_id in failed_type_ids]
+    for booked_ticket in failed:
+        logger.warning("Insufficient quantity for ticket type ID %s for booking %s. Booked: %s", booked_ticket.ticket_type_id, booking.unique_id, booked_ticket.quantity)
+    return failed
+
+
+def release_for_booking(booking, status=TicketHold.RELEASED):
+    """
+    Releases every live hold of `booking`, e.g. when its payment fails or is cancelled.
+    """
+    return release_for_bookings([booking.pk], status)
+
+
+def release_for_bookings(booking_ids, status=TicketHold.RELEASED):
+    """
+    Releases every live hold of the given bookings. Returns the number of holds released.
+    """
+    with transaction.atomic():
+        holds = list(TicketHold.objects.select_for_update().filter(booking_id__in=booking_ids, status=TicketHold.ACTIVE))
+        _release_holds(holds, status)
+    return len(holds)
+
+
+def expire_holds(batch_size=500, now=None):
+    """
+    Expires up to `batch_size` live holds whose TTL has passed, oldest first.
+    Holds locked by a concurrent payment callback are skipped and picked up by a later batch.
+    Returns the number of holds expired.
+    """
+    if now is None:
+        now = timezone.now()
+    with transaction.atomic():
+        holds = list(
+            TicketHold.objects.select_for_update(skip_locked=True)
+            .filter(status=TicketHold.ACTIVE, expires_at__lte=now)
+            .order_by('expires_at')
+            .only('id', 'ticket_type_id', 'quantity', 'shard_index')[:batch_size]
+        )
+        _release_holds(holds, TicketHold.EXPIRED)
+    return len(holds)
+
+
+def reshard(ticket_type_id, shard_count):
+    """
+    Moves the stock of a ticket type onto `shard_count` shard rows, or back onto the
+    TicketType row when `shard_count` is 0. Live holds move with the stock they reserve.
+    """
+    with transaction.atomic():
+        ticket_type = TicketType.objects.select_for_update().get(id=ticket_type_id)
+        shards = TicketStockShard.objects.select_for_update().filter(ticket_type=ticket_type)
+        holds = TicketHold.objects.select_for_update().filter(ticket_type=ticket_type, status=TicketHold.ACTIVE)
+        # Evaluate both querysets to lock the rows before moving stock around
+        list(shards), list(holds)
+
+        # Collapse any existing shards back onto the row first
+        if ticket_type.shard_count:
+            totals = shards.aggregate(available=Sum('available_quantity'), held=Sum('held_quantity'))
+            ticket_type.available_quantity = totals['available'] or 0
+            ticket_type.held_quantity = totals['held'] or 0
+            shards.delete()
+            holds.update(shard_index=None)
+
+        ticket_type.shard_count = shard_count
+        ticket_type.save(update_fields=['available_quantity', 'held_quantity', 'shard_count'])
+        _stock_changed({ticket_type.id})
+        if not shard_count:
+            return ticket_type
+
+        # Shard 0 keeps everything currently held plus its share of the free stock
+        free = ticket_type.available_quantity - ticket_type.held_quantity
+        share, extra = divmod(free, shard_count)
+        TicketStockShard.objects.bulk_create([
+            TicketStockShard(
+                ticket_type=ticket_type,
+                index=index,
+                available_quantity=share + (1 if index < extra else 0) + (ticket_type.held_quantity if index == 0 else 0),
+                held_quantity=ticket_type.held_quantity if index == 0 else 0,
+            )
+            for index in range(shard_count)
+        ])
+        holds.update(shard_index=0)
+    return ticket_type
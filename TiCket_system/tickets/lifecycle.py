@@ -0,0 +1,92 @@
+# tickets/lifecycle.py
+"""
+Booking lifecycle housekeeping: closing abandoned checkouts and archiving old finished bookings.
+
+A booking is created `pending` and ends `paid` (tickets.payments.apply_event), `failed` or
+`cancelled` (the SSLCommerz fail/cancel callbacks), or `expired` once it has been pending for
+BOOKING_PENDING_TTL_SECONDS (`reap_pending`). Finished bookings older than BOOKING_ARCHIVE_AFTER_DAYS
+are moved to ArchivedBooking (`archive_finished`), keeping the tables every callback, admin page and
+export reads small.
+
+Both jobs work through the oldest bookings in bounded batches, one short transaction each, skipping
+rows locked by a concurrent payment, so they can run next to live traffic.
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .inventory import release_for_bookings
+from .models import ArchivedBooking, BookedTicket, Booking, TicketHold
+
+
+def close_unpaid(booking, status):
+    """
+    Marks a pending booking failed or cancelled and releases its holds. Returns the holds released.
+    A booking that is no longer pending (paid meanwhile, or already closed) keeps its status.
+    """
+    with transaction.atomic():
+        Booking.objects.filter(pk=booking.pk, status=Booking.PENDING, is_paid=False).update(status=status)
+        return release_for_bookings([booking.pk])
+
+
+def reap_pending(batch_size=500, now=None):
+    """
+    Expires up to `batch_size` of the oldest bookings pending for longer than
+    BOOKING_PENDING_TTL_SECONDS and releases any holds they still have.
+    Returns the number of bookings expired.
+    """
+    if now is None:
+        now = timezone.now()
+    cutoff = now - timedelta(seconds=settings.BOOKING_PENDING_TTL_SECONDS)
+    with transaction.atomic():
+        ids = list(
+            Booking.objects.select_for_update(skip_locked=True)
+            .filter(status=Booking.PENDING, is_paid=False, booking_time__lt=cutoff)
+            .order_by('booking_time')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            return 0
+        # Re-checked, so a payment claimed since the SELECT wins
+        expired = Booking.objects.filter(pk__in=ids, status=Booking.PENDING, is_paid=False).update(status=Booking.EXPIRED)
+        release_for_bookings(ids, TicketHold.EXPIRED)
+    return expired
+
+
+def _archived(booking, lines):
+    return ArchivedBooking(
+        unique_id=booking.unique_id, customer_name=booking.customer_name, customer_email=booking.customer_email,
+        booking_time=booking.booking_time, status=booking.status, transaction_id=booking.transaction_id,
+        paid_at=booking.paid_at, total_amount=booking.total_amount, lines=lines,
+    )
+
+
+def archive_finished(batch_size=500, now=None):
+    """
+    Moves up to `batch_size` of the oldest finished bookings made more than BOOKING_ARCHIVE_AFTER_DAYS
+    ago to ArchivedBooking, deleting them with their lines, holds, emails and check-ins.
+    Returns the number of bookings archived.
+    """
+    if now is None:
+        now = timezone.now()
+    cutoff = now - timedelta(days=settings.BOOKING_ARCHIVE_AFTER_DAYS)
+    with transaction.atomic():
+        bookings = list(
+            Booking.objects.select_for_update(skip_locked=True)
+            .filter(status__in=Booking.FINISHED, booking_time__lt=cutoff)
+            .order_by('booking_time')[:batch_size]
+        )
+        if not bookings:
+            return 0
+        lines = {booking.pk: [] for booking in bookings}
+        rows = (
+            BookedTicket.objects.filter(booking_id__in=lines).order_by('pk')
+            .values_list('booking_id', 'ticket_type_id', 'ticket_type__name', 'quantity', 'subtotal')
+        )
+        for booking_id, ticket_type_id, name, quantity, subtotal in rows:
+            lines[booking_id].append(
+                {'ticket_type_id': ticket_type_id, 'ticket_type': name, 'quantity': quantity, 'subtotal': str(subtotal)}
+            )
+        ArchivedBooking.objects.bulk_create([_archived(booking, lines[booking.pk]) for booking in bookings])
+        Booking.objects.filter(pk__in=lines).delete()
+    return len(bookings)
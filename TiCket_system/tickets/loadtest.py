@@ -0,0 +1,96 @@
+# tickets/loadtest.py
+"""
+A small concurrent HTTP load generator used by the `loadtest` management command.
+"""
+import asyncio
+import re
+import time
+import httpx
+
+# Query count reported by tickets.instrumentation in the Server-Timing header
+QUERIES_RE = re.compile(r'desc="(\d+) queries"')
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class LoadResult:
+    def __init__(self, label, latencies, statuses, errors, elapsed, queries=()):
+        self.label = label
+        self.latencies = sorted(latencies)
+        self.statuses = statuses
+        self.errors = errors
+        self.elapsed = elapsed
+        self.queries = sorted(queries)
+
+    @property
+    def requests_per_second(self):
+        return len(self.latencies) / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self):
+        return {
+            'label': self.label,
+            'requests': len(self.latencies),
+            'seconds': round(self.elapsed, 3),
+            'requests_per_second': round(self.requests_per_second, 1),
+            **{f"p{p}_ms": round(percentile(self.latencies, p / 100) * 1000, 2) for p in (50, 95, 99)},
+            'errors': self.errors,
+            'statuses': {str(code): count for code, count in sorted(self.statuses.items())},
+            'queries_mean': round(sum(self.queries) / len(self.queries), 2) if self.queries else None,
+            'queries_max': self.queries[-1] if self.queries else None,
+        }
+
+    def summary(self):
+        def ms(seconds):
+            return f"{seconds * 1000:.1f}ms"
+
+        statuses = ' '.join(f"{code}:{count}" for code, count in sorted(self.statuses.items()))
+        return (
+            f"{self.label}: {len(self.latencies)} requests in {self.elapsed:.2f}s, "
+            f"{self.requests_per_second:,.1f} req/s, p50 {ms(percentile(self.latencies, 0.50))}, "
+            f"p95 {ms(percentile(self.latencies, 0.95))}, p99 {ms(percentile(self.latencies, 0.99))}, "
+            f"errors {self.errors}, statuses {statuses or '-'}"
+            + (f", queries mean {sum(self.queries) / len(self.queries):.1f} max {self.queries[-1]}" if self.queries else '')
+        )
+
+
+async def run_load(label, make_request, total, concurrency, base_url, timeout=30.0):
+    """
+    Sends `total` requests with up to `concurrency` in flight.
+
+    `make_request(client, n)` must send the n-th request with the given httpx.AsyncClient
+    and return the response. Query counts are collected from the Server-Timing header when the
+    server sends it.
+    """
+    latencies = []
+    queries = []
+    statuses = {}
+    errors = 0
+    counter = iter(range(total))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+        async def worker():
+            nonlocal errors
+            for n in counter:
+                start = time.perf_counter()
+                try:
+                    response = await make_request(client, n)
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                match = QUERIES_RE.search(response.headers.get('Server-Timing', ''))
+                if match:
+                    queries.append(int(match.group(1)))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return LoadResult(label, latencies, statuses, errors, elapsed, queries)
@@ -0,0 +1,134 @@
+# tickets/log.py
+"""
+Logging that stays off the request path.
+
+`QueueHandler` is the only handler the loggers in settings.LOGGING write to. It puts records on an
+in-memory queue and returns; a background `QueueListener` thread formats them and writes them to the
+real handlers (console, log file). A full queue drops records (counted, see `dropped_records`)
+instead of blocking the request.
+
+Messages use %-style arguments, which are only merged into the message when a record is actually
+written, so sampled-out and filtered records cost no formatting, and the rest are formatted on the
+listener thread. Arguments must therefore be plain values, not objects that change or query the
+database when turned into strings later.
+
+`JSONFormatter` writes one JSON object per record, with the `log_context` fields (e.g. tran_id)
+current when the record was logged and anything passed through `extra`. `SamplingFilter` keeps a
+fraction of the INFO and DEBUG records of chosen loggers, such as the per-request timing lines.
+"""
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+_context = ContextVar('tickets_log_context', default={})
+# Attributes every LogRecord has; anything else on a record came from `extra` or `log_context`
+_RECORD_ATTRIBUTES = set(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime', 'log_context'}
+
+
+@contextmanager
+def log_context(**fields):
+    """
+    Adds `fields` to every record logged inside the block (by this thread or task).
+    """
+    token = _context.set({**_context.get(), **{key: value for key, value in fields.items() if value is not None}})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'log_context', None) or _context.get())
+        entry.update({key: value for key, value in record.__dict__.items() if key not in _RECORD_ATTRIBUTES})
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Passes a `rates[logger name]` fraction of the records below WARNING of each listed logger
+    (and its children); everything else passes.
+    """
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = {name: float(rate) for name, rate in (rates or {}).items() if float(rate) < 1}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        name = record.name
+        while name:
+            rate = self.rates.get(name)
+            if rate is not None:
+                return random.random() < rate
+            name = name.rpartition('.')[0]
+        return True
+
+
+_dropped = 0
+_dropped_lock = threading.Lock()
+
+
+def dropped_records():
+    """
+    Records dropped because the log queue was full, in this process since it started.
+    """
+    return _dropped
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues records for `handlers`, which a listener thread started here writes to.
+    Configured from settings.LOGGING with handlers: ['cfg://handlers.console', ...]; it must sort after
+    them by name, since dictConfig creates handlers in name order.
+    """
+    def __init__(self, handlers, maxsize=10_000):
+        # Indexed rather than iterated: dictConfig resolves 'cfg://' references on item access
+        handlers = [handlers[i] for i in range(len(handlers))]
+        if not all(isinstance(handler, logging.Handler) for handler in handlers):
+            raise ValueError('QueueHandler targets must be configured before it (name it after them)')
+        super().__init__(queue.Queue(maxsize))
+        self.listener = logging.handlers.QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+
+    def prepare(self, record):
+        # Unlike the base class, leaves the message unformatted for the listener thread, but captures
+        # what only this thread has: the log context and the traceback of the exception being handled.
+        # Works on a copy, like the base class, since other handlers may still see the caller's record.
+        record = copy.copy(record)
+        record.log_context = _context.get()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        global _dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with _dropped_lock:
+                _dropped += 1
+
+    def close(self):
+        # Called by logging.shutdown() at exit, before the target handlers are closed
+        if self.listener._thread is not None:
+            self.listener.stop() # Writes out what is still queued
+        super().close()
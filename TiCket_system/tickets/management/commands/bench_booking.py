@@ -0,0 +1,113 @@
+import asyncio
+import json
+import random
+from contextlib import nullcontext
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+from tickets import benchmark
+from tickets.fake_gateway import val_id_for
+from tickets.loadtest import run_load
+from tickets.models import Booking
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks the booking flow end to end: seeds synthetic ticket types and bookings, serves the app '
+        'in-process against a fake SSLCommerz, and drives the catalogue, booking, IPN and duplicate success '
+        'callback endpoints with a concurrent load generator. Reports req/s, p50/p95/p99 latency and queries '
+        'per request for each, then checks that no ticket type was oversold. Seeded data is deleted afterwards. '
+        'Fails if anything was oversold, or with --max-p95-ms, if a phase is slower than that.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ticket-types', type=int, default=5)
+        parser.add_argument('--stock', type=int, default=100, help='Tickets per ticket type.')
+        parser.add_argument('--seed-bookings', type=int, default=10_000, help='Existing bookings to seed as background volume.')
+        parser.add_argument('--bookings', type=int, default=500, help='Booking requests to send.')
+        parser.add_argument('--catalogue-requests', type=int, default=1000)
+        parser.add_argument('--max-quantity', type=int, default=2, help='Tickets per booked line, from 1 to this.')
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--gateway-latency-ms', type=float, default=0)
+        parser.add_argument('--base-url', help='Load an already running server (sharing this database, pointed at '
+                                               'a fake gateway and with RATE_LIMIT_* set to \'\') instead of serving '
+                                               'the app in-process.')
+        parser.add_argument('--random-seed', type=int, default=0)
+        parser.add_argument('--max-p95-ms', type=float, help='Fail if any phase has a higher p95 latency.')
+        parser.add_argument('--json', action='store_true', help='Print the results as one JSON object.')
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded data.')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['random_seed'])
+        run_id = benchmark.new_run_id()
+        ticket_types = benchmark.seed(run_id, options['ticket_types'], options['stock'], options['seed_bookings'])
+        since_pk = Booking.objects.aggregate(last=Max('pk'))['last'] or 0 # Only bookings made by the load count as sales
+        if not options['json']:
+            self.stdout.write(
+                f"Seeded {len(ticket_types)} ticket types with {options['stock']} tickets each "
+                f"and {options['seed_bookings']} bookings (run {run_id})"
+            )
+        try:
+            servers = nullcontext((options['base_url'], None)) if options['base_url'] else \
+                benchmark.local_servers(options['gateway_latency_ms'] / 1000)
+            with servers as (base_url, _):
+                results = self.run_phases(base_url, run_id, ticket_types, rng, options)
+            oversold = benchmark.oversold(ticket_types, options['stock'], since_pk)
+        finally:
+            if not options['keep']:
+                benchmark.cleanup(run_id)
+
+        if options['json']:
+            self.stdout.write(json.dumps({
+                'run_id': run_id, 'phases': [r.as_dict() for r in results], 'oversold': oversold,
+            }, indent=2))
+        else:
+            for result in results:
+                self.stdout.write(result.summary())
+            self.stdout.write(f"Oversold: {sum(oversold.values())} ticket(s) {oversold or ''}".rstrip())
+
+        failures = [f"{sum(oversold.values())} ticket(s) oversold"] if oversold else []
+        if options['max_p95_ms'] is not None:
+            failures += [
+                f"{r.label} p95 {r.as_dict()['p95_ms']}ms > {options['max_p95_ms']}ms"
+                for r in results if r.as_dict()['p95_ms'] > options['max_p95_ms']
+            ]
+        if failures:
+            raise CommandError('; '.join(failures))
+
+    def run_phases(self, base_url, run_id, ticket_types, rng, options):
+        prefix = benchmark.run_prefix(run_id)
+        concurrency = options['concurrency']
+        ticket_type_ids = [t.pk for t in ticket_types]
+        # Pre-draw every booking's lines, so a given --random-seed always sends the same requests
+        orders = [
+            [
+                {'ticket_type': pk, 'quantity': rng.randint(1, options['max_quantity'])}
+                for pk in rng.sample(ticket_type_ids, rng.randint(1, min(3, len(ticket_type_ids))))
+            ]
+            for _ in range(options['bookings'])
+        ]
+
+        async def book(client, n):
+            return await client.post('/api/book-tickets/', json={
+                'customer_name': f"Bench Customer {n}",
+                'customer_email': f"{prefix}-new-{n}@example.com",
+                'booked_tickets': orders[n],
+            })
+
+        results = [
+            asyncio.run(run_load('catalogue', lambda client, n: client.get('/api/ticket-types/'),
+                                 options['catalogue_requests'], concurrency, base_url)),
+            asyncio.run(run_load('book', book, len(orders), concurrency, base_url)),
+        ]
+
+        # Every booking that got a payment session is paid, by IPN first and then the (duplicate) success redirect
+        callbacks = [
+            {'tran_id': str(unique_id), 'val_id': val_id_for(unique_id), 'amount': f"{total:.2f}", 'status': 'VALID'}
+            for unique_id, total in Booking.objects.filter(customer_email__startswith=f"{prefix}-new-")
+            .values_list('unique_id', 'total_amount')
+        ]
+        for label, path in (('ipn', '/sslcommerz/ipn/'), ('success', '/sslcommerz/success/')):
+            async def callback(client, n, path=path):
+                return await client.post(path, data=callbacks[n])
+            results.append(asyncio.run(run_load(label, callback, len(callbacks), concurrency, base_url)))
+        return results
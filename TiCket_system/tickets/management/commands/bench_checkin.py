@@ -0,0 +1,57 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from tickets import benchmark, checkin
+from tickets.models import Booking, CheckIn
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks gate check-in: seeds synthetic bookings (about half of them paid, two tickets each), then '
+        'compares scans/s of the per-scan booking query with lookups in the in-memory paid index and with full '
+        'check-ins (which also record the scan). Seeded data is deleted afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bookings', type=int, default=100_000, help='Bookings to seed.')
+        parser.add_argument('--scans', type=int, default=5000, help='Codes scanned in each phase.')
+        parser.add_argument('--random-seed', type=int, default=0)
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded data.')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['random_seed'])
+        run_id = benchmark.new_run_id()
+        benchmark.seed(run_id, 3, 0, options['bookings'])
+        try:
+            codes = list(
+                Booking.objects.filter(customer_email__startswith=benchmark.run_prefix(run_id), is_paid=True)
+                .values_list('unique_id', flat=True)
+            )
+            codes = rng.sample(codes, min(options['scans'], len(codes)))
+            self.stdout.write(f"Seeded {options['bookings']:,} bookings (run {run_id}); scanning {len(codes):,} paid codes")
+
+            self.report('booking query', codes, lambda code: Booking.objects.get(unique_id=code).is_paid)
+
+            checkin.reset_index()
+            start = time.perf_counter()
+            index = checkin.get_index()
+            self.stdout.write(f"  {'index load':<22} {len(index):>12,} bookings  {time.perf_counter() - start:7.2f}s")
+
+            self.report('index lookup', codes, index.lookup)
+            # Each seeded booking has two tickets: two entries get in, the third scan is refused
+            for phase, expected in (('check-in (1st entry)', CheckIn.ADMITTED), ('check-in (2nd entry)', CheckIn.ADMITTED),
+                                    ('check-in (refused)', CheckIn.ALREADY_USED)):
+                outcomes = self.report(phase, codes, lambda code: checkin.scan(str(code), 'bench')[0])
+                if any(outcome != expected for outcome in outcomes):
+                    self.stderr.write(f"    unexpected outcomes: {sorted(set(outcomes) - {expected})}")
+        finally:
+            checkin.reset_index()
+            if not options['keep']:
+                benchmark.cleanup(run_id)
+
+    def report(self, phase, codes, scan):
+        start = time.perf_counter()
+        results = [scan(code) for code in codes]
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"  {phase:<22} {len(codes) / elapsed:>12,.0f} scans/s  {elapsed:7.2f}s")
+        return results
@@ -0,0 +1,108 @@
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from tickets.export import FORMATS
+from tickets.models import Booking, BookedTicket, TicketType
+
+BENCH_EMAIL_DOMAIN = '@bench-export.invalid'
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds synthetic bookings (1-3 lines each) into the configured database, then times '
+        '`export_bookings` in a child process at each size and reports rows/s and the child\'s peak RSS. '
+        'The seeded rows are deleted afterwards unless --keep is given.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bookings', type=int, nargs='+', default=[10_000, 100_000, 1_000_000],
+                            help='Booking counts to measure at, seeded cumulatively.')
+        parser.add_argument('--formats', nargs='+', choices=sorted(FORMATS), default=sorted(FORMATS))
+        parser.add_argument('--batch-size', type=int, default=5000, help='Bookings per bulk insert while seeding.')
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded bookings.')
+
+    def handle(self, *args, **options):
+        ticket_types = [
+            TicketType.objects.create(
+                name=f"bench-{uuid.uuid4().hex[:8]}", price=price, available_quantity=0, is_active=False,
+            )
+            for price in (500, 1000, 2500)
+        ]
+        seeded = lines = 0
+        try:
+            for target in sorted(options['bookings']):
+                start = time.perf_counter()
+                while seeded < target:
+                    count = min(options['batch_size'], target - seeded)
+                    lines += self.seed(ticket_types, count)
+                    seeded += count
+                self.stdout.write(f"Seeded {seeded:,} bookings / {lines:,} lines ({time.perf_counter() - start:.1f}s)")
+                for format in options['formats']:
+                    elapsed, peak_rss_kb = self.export(format)
+                    self.stdout.write(
+                        f"  {format:<6} {lines / elapsed:>12,.0f} rows/s  {elapsed:7.1f}s  peak RSS {peak_rss_kb / 1024:,.1f} MiB"
+                    )
+        finally:
+            if not options['keep']:
+                self.cleanup(ticket_types)
+
+    def seed(self, ticket_types, count):
+        with transaction.atomic():
+            bookings = Booking.objects.bulk_create([
+                Booking(customer_name=f"Bench Customer {n}", customer_email=f"bench{n}{BENCH_EMAIL_DOMAIN}",
+                        is_paid=n % 4 != 0, status=Booking.PAID if n % 4 != 0 else Booking.PENDING,
+                        transaction_id=f"VAL-BENCH-{n}")
+                for n in range(count)
+            ])
+            booked_tickets = [
+                BookedTicket(booking=booking, ticket_type=ticket_type, quantity=quantity,
+                             subtotal=ticket_type.price * quantity)
+                for booking in bookings
+                for ticket_type in random.sample(ticket_types, random.randint(1, 3))
+                for quantity in [random.randint(1, 4)]
+            ]
+            BookedTicket.objects.bulk_create(booked_tickets)
+        return len(booked_tickets)
+
+    def export(self, format):
+        """
+        Runs the export in a fresh process and returns (seconds, peak RSS in KiB).
+
+        The peak is the child's VmHWM, polled from /proc (Linux only). Its ru_maxrss would also
+        count this process's memory, which a forked child is charged for until it execs.
+        """
+        command = [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'export_bookings',
+                   '--format', format, '--output', os.devnull]
+        start = time.perf_counter()
+        process = subprocess.Popen(command)
+        peak_rss_kb = 0
+        while process.poll() is None:
+            peak_rss_kb = max(peak_rss_kb, self.high_water_mark(process.pid))
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - start
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, command)
+        return elapsed, peak_rss_kb
+
+    def high_water_mark(self, pid):
+        try:
+            with open(f'/proc/{pid}/status') as status:
+                for line in status:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1])
+        except OSError: # Exited between poll() and open()
+            pass
+        return 0
+
+    def cleanup(self, ticket_types):
+        # Raw deletes skip the per-row cascade collection, which would take longer than the seeding
+        bookings = Booking.objects.filter(customer_email__endswith=BENCH_EMAIL_DOMAIN)
+        BookedTicket.objects.filter(booking__in=bookings)._raw_delete(BookedTicket.objects.db)
+        bookings._raw_delete(Booking.objects.db)
+        TicketType.objects.filter(pk__in=[t.pk for t in ticket_types]).delete()
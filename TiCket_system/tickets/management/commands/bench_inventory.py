@@ -0,0 +1,75 @@
+import threading
+import time
+import uuid
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction, OperationalError
+from django.db.models import F
+from tickets.inventory import _take_from_shards, reshard
+from tickets.models import TicketType
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures decrement throughput on a single hot ticket type with 1 vs N stock shards, '
+        'using concurrent threads against the configured database. The benchmark ticket type is deleted afterwards. '
+        'SQLite serializes all writers, so expect shard counts to make a difference only on a row-locking database '
+        'such as PostgreSQL.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shards', type=int, nargs='+', default=[0, 1, 8], help='Shard counts to compare (0 = plain row).')
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--ops', type=int, default=2000, help='Decrements per run, shared across threads.')
+
+    def handle(self, *args, **options):
+        for shard_count in options['shards']:
+            ticket_type = TicketType.objects.create(
+                name=f"bench-{uuid.uuid4().hex[:8]}", price=1, available_quantity=options['ops'] * 2, is_active=False,
+            )
+            try:
+                if shard_count:
+                    ticket_type = reshard(ticket_type.id, shard_count)
+                elapsed, done, errors = self.run(ticket_type, options['threads'], options['ops'])
+            finally:
+                ticket_type.delete()
+            self.stdout.write(
+                f"shards={shard_count:<3} threads={options['threads']:<3} ops={done:<6} "
+                f"errors={errors:<4} {done / elapsed:,.0f} decrements/s"
+            )
+
+    def run(self, ticket_type, threads, ops):
+        per_thread = ops // threads
+        results = []
+        lock = threading.Lock()
+
+        def decrement():
+            if ticket_type.shard_count:
+                return _take_from_shards(ticket_type, 1, available_quantity=lambda amount: F('available_quantity') - amount)
+            return TicketType.objects.filter(
+                id=ticket_type.id, available_quantity__gte=F('held_quantity') + 1,
+            ).update(available_quantity=F('available_quantity') - 1)
+
+        def worker():
+            done = errors = 0
+            try:
+                for _ in range(per_thread):
+                    try:
+                        with transaction.atomic():
+                            decrement()
+                        done += 1
+                    except OperationalError:
+                        # e.g. SQLite "database is locked" when the busy timeout is exceeded
+                        errors += 1
+            finally:
+                connection.close()
+            with lock:
+                results.append((done, errors))
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        start = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        return elapsed, sum(r[0] for r in results), sum(r[1] for r in results)
@@ -0,0 +1,107 @@
+import asyncio
+import copy
+import logging
+import logging.config
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from logging.handlers import RotatingFileHandler
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from tickets import benchmark, log
+from tickets.loadtest import run_load
+
+
+class SlowFileHandler(RotatingFileHandler):
+    """
+    The log file handler, with `latency` seconds added to every write, as on a slow or busy disk.
+    """
+    def __init__(self, *args, latency=0.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latency = latency
+
+    def emit(self, record):
+        if self.latency:
+            time.sleep(self.latency)
+        super().emit(record)
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks request latency with logging off, written directly from the request threads, and queued to '
+        'the background listener (the default). Serves the app in-process and sends catalogue GETs and failed '
+        'payment callbacks, each of which logs; logs go to a temporary file, and --disk-latency-ms slows every '
+        'write to it.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per mode.')
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--disk-latency-ms', type=float, default=0.0, help='Delay added to every log file write.')
+        parser.add_argument('--modes', nargs='+', choices=['off', 'direct', 'queued'], default=['off', 'direct', 'queued'])
+
+    def handle(self, *args, **options):
+        directory = tempfile.mkdtemp(prefix='bench-logging-')
+        try:
+            with benchmark.local_servers() as (base_url, _):
+                # Warms up connections and caches, so the first mode measured is not penalised
+                logging.disable(logging.CRITICAL)
+                try:
+                    asyncio.run(run_load('warm-up', self.make_request, 200, options['concurrency'], base_url))
+                finally:
+                    logging.disable(logging.NOTSET)
+                for mode in options['modes']:
+                    path = os.path.join(directory, f"{mode}.log")
+                    dropped = log.dropped_records()
+                    with open(os.devnull, 'w') as devnull:
+                        logging.config.dictConfig(self.config(mode, path, devnull, options['disk_latency_ms'] / 1000))
+                        if mode == 'off':
+                            logging.disable(logging.CRITICAL)
+                        try:
+                            result = asyncio.run(run_load(mode, self.make_request, options['requests'],
+                                                          options['concurrency'], base_url))
+                        finally:
+                            logging.disable(logging.NOTSET)
+                            # Closes the bench handlers; a queued one first writes out what it still holds
+                            logging.config.dictConfig(settings.LOGGING)
+                    lines = 0
+                    if os.path.exists(path):
+                        with open(path, 'rb') as file:
+                            lines = sum(1 for _ in file)
+                    self.stdout.write(
+                        f"{result.summary()}, log lines {lines:,}, dropped {log.dropped_records() - dropped:,}"
+                    )
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def config(self, mode, path, console_stream, latency):
+        """
+        settings.LOGGING with the log file at `path`, the console discarded and the queue on or off.
+        """
+        config = copy.deepcopy(settings.LOGGING)
+        handlers = config['handlers']
+        queued = mode == 'queued'
+        handlers['console'] = {**handlers['console'], 'stream': console_stream, 'filters': [] if queued else ['sampling']}
+        file = {key: value for key, value in handlers['file'].items() if key != 'class'}
+        handlers['file'] = {**file, '()': SlowFileHandler, 'filename': path, 'latency': latency,
+                            'filters': [] if queued else ['sampling']}
+        handlers.pop('queue', None)
+        names = ['console', 'file']
+        if queued:
+            handlers['queue'] = {
+                '()': 'tickets.log.QueueHandler',
+                'handlers': ['cfg://handlers.console', 'cfg://handlers.file'],
+                'filters': ['sampling'],
+            }
+            names = ['queue']
+        for logger in [config['root'], *config['loggers'].values()]:
+            logger['handlers'] = names
+        return config
+
+    async def make_request(self, client, n):
+        if n % 2:
+            # Unknown booking: logs the callback, then finds nothing to release
+            return await client.post('/sslcommerz/fail/', data={'tran_id': str(uuid.uuid4())})
+        return await client.get('/api/ticket-types/')
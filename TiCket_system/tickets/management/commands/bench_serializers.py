@@ -0,0 +1,77 @@
+import time
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+from tickets import benchmark
+from tickets.serializers import BookingSerializer, TicketTypeSerializer, ticket_type_data
+
+
+class FullBookingSerializer(BookingSerializer):
+    fast_path = False
+
+
+class Command(BaseCommand):
+    help = (
+        'Microbenchmarks booking validation with the full DRF serializer against the fast path, at 1, 10 and 100 '
+        'lines per booking, and catalogue serialization with TicketTypeSerializer against plain dicts. '
+        'Seeds temporary ticket types, checks that both paths give the same result, and deletes them afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, nargs='+', default=[1, 10, 100], help='Lines per booking.')
+        parser.add_argument('--seconds', type=float, default=1.0, help='Time spent on each measurement.')
+
+    def handle(self, *args, **options):
+        run_id = benchmark.new_run_id()
+        ticket_types = benchmark.seed(run_id, max(options['lines']), 1000, 0)
+        try:
+            self.stdout.write(f"{'':<28} {'full':>10} {'fast':>10} {'speedup':>8}")
+            for lines in options['lines']:
+                payload = {
+                    'customer_name': 'Bench Customer',
+                    'customer_email': f"{benchmark.run_prefix(run_id)}@example.com",
+                    'booked_tickets': [{'ticket_type': t.pk, 'quantity': 2} for t in ticket_types[:lines]],
+                }
+                results = []
+                for serializer_class in (FullBookingSerializer, BookingSerializer):
+                    serializer = serializer_class(data=payload)
+                    serializer.is_valid(raise_exception=True)
+                    results.append(serializer.validated_data)
+                if results[0] != results[1]:
+                    self.stderr.write(f"  {lines} line(s): validated data differs")
+                self.report(
+                    f"validate, {lines} line(s)",
+                    lambda: FullBookingSerializer(data=payload).is_valid(),
+                    lambda: BookingSerializer(data=payload).is_valid(),
+                    options['seconds'],
+                )
+
+            renderer = JSONRenderer()
+            if renderer.render(TicketTypeSerializer(ticket_types, many=True).data) != renderer.render(ticket_type_data(ticket_types)):
+                self.stderr.write("  catalogue JSON differs")
+            self.report(
+                f"catalogue, {len(ticket_types)} types",
+                lambda: renderer.render(TicketTypeSerializer(ticket_types, many=True).data),
+                lambda: renderer.render(ticket_type_data(ticket_types)),
+                options['seconds'],
+            )
+        finally:
+            benchmark.cleanup(run_id)
+
+    def report(self, label, full, fast, seconds):
+        full_us, fast_us = self.measure(full, seconds), self.measure(fast, seconds)
+        self.stdout.write(f"{label:<28} {full_us:>8.1f}us {fast_us:>8.1f}us {full_us / fast_us:>7.1f}x")
+
+    def measure(self, call, seconds):
+        """
+        Microseconds per call, running it repeatedly for about `seconds`.
+        """
+        call() # Warm-up
+        runs = 0
+        start = time.perf_counter()
+        deadline = start + seconds
+        while True:
+            call()
+            runs += 1
+            now = time.perf_counter()
+            if now >= deadline:
+                return (now - start) / runs * 1_000_000
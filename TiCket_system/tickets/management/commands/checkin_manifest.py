@@ -0,0 +1,18 @@
+import sys
+from django.core.management.base import BaseCommand
+from tickets import checkin
+
+
+class Command(BaseCommand):
+    help = 'Writes the check-in manifest (paid booking codes with their ticket and admitted counts) for offline gate devices.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', help='File to write (default: stdout).')
+
+    def handle(self, *args, **options):
+        if not options['output']:
+            count = checkin.write_manifest(sys.stdout.buffer)
+        else:
+            with open(options['output'], 'wb') as output:
+                count = checkin.write_manifest(output)
+        self.stderr.write(f"{count} bookings in the manifest")
@@ -0,0 +1,28 @@
+import time
+from django.core.management.base import BaseCommand
+from tickets.inventory import expire_holds
+
+
+class Command(BaseCommand):
+    help = 'Releases ticket holds whose TTL has passed, in batches. Use --loop to keep running as a worker.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Maximum number of holds expired per transaction.')
+        parser.add_argument('--loop', action='store_true', help='Keep sweeping instead of exiting once no stale holds remain.')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds to sleep between sweeps in --loop mode.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        while True:
+            total = 0
+            # Drain everything that is stale right now, one short transaction per batch
+            while True:
+                expired = expire_holds(batch_size=batch_size)
+                total += expired
+                if expired < batch_size:
+                    break
+            if total or options['verbosity'] > 1:
+                self.stdout.write(f"Expired {total} hold(s).")
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from tickets import export
+
+
+class Command(BaseCommand):
+    help = 'Streams booked tickets (one row per booked line) as CSV or NDJSON to a file or stdout.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(export.FORMATS), default='csv')
+        parser.add_argument('--since', help='Only bookings made on/after this ISO date or datetime.')
+        parser.add_argument('--until', help='Only bookings made on/before this ISO date or datetime.')
+        paid = parser.add_mutually_exclusive_group()
+        paid.add_argument('--paid', dest='is_paid', action='store_const', const=True, help='Only paid bookings.')
+        paid.add_argument('--unpaid', dest='is_paid', action='store_const', const=False, help='Only unpaid bookings.')
+        parser.add_argument('--output', '-o', help='File to write (default: stdout).')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched from the database at a time.')
+
+    def handle(self, *args, **options):
+        try:
+            since = export.parse_when(options['since']) if options['since'] else None
+            until = export.parse_when(options['until'], end=True) if options['until'] else None
+        except ValueError as e:
+            raise CommandError(e)
+
+        chunks = export.export_chunks(
+            options['format'], since=since, until=until, is_paid=options['is_paid'], chunk_size=options['chunk_size'],
+        )
+        if not options['output']:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+        with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+            for chunk in chunks:
+                output.write(chunk)
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from tickets.fake_gateway import FakeSSLCommerzServer
+
+
+class Command(BaseCommand):
+    help = 'Runs a local fake SSLCommerz API. Set SSLCOMMERZ_BASE_URL to its URL to use it.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--latency-ms', type=float, default=0, help='Delay added to every response.')
+        parser.add_argument('--failure-rate', type=float, default=0, help='Fraction of requests answered with HTTP 503.')
+
+    def handle(self, *args, **options):
+        server = FakeSSLCommerzServer(
+            host=options['host'],
+            port=options['port'],
+            store_id=settings.SSLCOMMERZ_STORE_ID,
+            latency=options['latency_ms'] / 1000,
+            failure_rate=options['failure_rate'],
+        )
+        self.stdout.write(f"Fake SSLCommerz listening on {server.url} (Ctrl+C to stop)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,56 @@
+import asyncio
+import uuid
+from django.core.management.base import BaseCommand, CommandError
+from tickets.loadtest import run_load
+
+
+class Command(BaseCommand):
+    help = (
+        'Load-tests the booking API of a running server and compares the WSGI and ASGI paths. '
+        'Example: serve the app with `gunicorn core.wsgi` on :8000 and `uvicorn core.asgi:application` '
+        'on :8100, with SSLCOMMERZ_BASE_URL pointing at `manage.py fake_sslcommerz --latency-ms 200` and the '
+        'RATE_LIMIT_* variables set to \'\' (all load comes from one address), then run '
+        '`manage.py loadtest --wsgi http://127.0.0.1:8000 --asgi http://127.0.0.1:8100 --ticket-type 1`.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wsgi', help='Base URL of a server running core.wsgi.')
+        parser.add_argument('--asgi', help='Base URL of a server running core.asgi.')
+        parser.add_argument('--endpoint', choices=['book', 'list'], default='book')
+        parser.add_argument('--ticket-type', type=int, help='Ticket type ID to book (required for --endpoint book).')
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=50)
+
+    def handle(self, *args, **options):
+        if not options['wsgi'] and not options['asgi']:
+            raise CommandError('Pass --wsgi and/or --asgi.')
+        if options['endpoint'] == 'book' and not options['ticket_type']:
+            raise CommandError('--ticket-type is required for --endpoint book.')
+
+        targets = [
+            ('WSGI', options['wsgi'], '/api/book-tickets/', '/api/ticket-types/'),
+            ('ASGI', options['asgi'], '/api/async/book-tickets/', '/api/async/ticket-types/'),
+        ]
+        for label, base_url, book_path, list_path in targets:
+            if not base_url:
+                continue
+            if options['endpoint'] == 'book':
+                make_request = self.booking_request(book_path, options['ticket_type'])
+            else:
+                make_request = self.catalogue_request(list_path)
+            result = asyncio.run(run_load(label, make_request, options['requests'], options['concurrency'], base_url))
+            self.stdout.write(result.summary())
+
+    def catalogue_request(self, path):
+        async def make_request(client, n):
+            return await client.get(path)
+        return make_request
+
+    def booking_request(self, path, ticket_type_id):
+        async def make_request(client, n):
+            return await client.post(path, json={
+                'customer_name': f"Load Test {n}",
+                'customer_email': f"loadtest-{uuid.uuid4().hex[:12]}@example.com",
+                'booked_tickets': [{'ticket_type': ticket_type_id, 'quantity': 1}],
+            })
+        return make_request
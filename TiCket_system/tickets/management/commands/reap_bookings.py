@@ -0,0 +1,42 @@
+import time
+from django.core.management.base import BaseCommand
+from tickets.lifecycle import archive_finished, reap_pending
+
+
+class Command(BaseCommand):
+    help = (
+        'Expires bookings left pending for longer than BOOKING_PENDING_TTL_SECONDS, releasing their holds, '
+        'and with --archive moves finished bookings older than BOOKING_ARCHIVE_AFTER_DAYS to the archive table. '
+        'Works in batches, one short transaction each. Use --loop to keep running as a worker.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Maximum number of bookings per transaction.')
+        parser.add_argument('--archive', action='store_true', help='Also archive old finished bookings.')
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help='Seconds to sleep between batches, to leave the database to live traffic.')
+        parser.add_argument('--loop', action='store_true', help='Keep sweeping instead of exiting once nothing is left.')
+        parser.add_argument('--interval', type=float, default=60.0, help='Seconds to sleep between sweeps in --loop mode.')
+
+    def handle(self, *args, **options):
+        jobs = [('Expired', reap_pending)]
+        if options['archive']:
+            jobs.append(('Archived', archive_finished))
+        while True:
+            for label, job in jobs:
+                total = self.drain(job, options['batch_size'], options['pause'])
+                if total or options['verbosity'] > 1:
+                    self.stdout.write(f"{label} {total} booking(s).")
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def drain(self, job, batch_size, pause):
+        total = 0
+        while True:
+            done = job(batch_size=batch_size)
+            total += done
+            if done < batch_size:
+                return total
+            if pause:
+                time.sleep(pause)
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from tickets.sales import rebuild_booking_totals, rebuild_ticket_sales
+
+
+class Command(BaseCommand):
+    help = (
+        'Recomputes the stored booking totals and the per-ticket-type sales aggregates from the booked lines, '
+        'in primary key batches. Safe to run while payments are coming in.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Bookings per batch.')
+        parser.add_argument('--skip-totals', action='store_true', help='Only rebuild the ticket sales aggregates.')
+
+    def handle(self, *args, **options):
+        if not options['skip_totals']:
+            updated = rebuild_booking_totals(options['batch_size'])
+            self.stdout.write(f"Recomputed the total of {updated} booking(s).")
+        written = rebuild_ticket_sales(options['batch_size'])
+        self.stdout.write(f"Rebuilt sales for {written} ticket type(s).")
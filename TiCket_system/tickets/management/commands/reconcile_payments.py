@@ -0,0 +1,26 @@
+from collections import Counter
+from django.core.management.base import BaseCommand
+from tickets.payments import reconcile_batch
+
+
+class Command(BaseCommand):
+    help = (
+        'Re-validates payment callbacks that could not be checked with the SSLCommerz validator API '
+        'and applies or rejects them. Point SSLCOMMERZ_BASE_URL at `manage.py fake_sslcommerz` to run it locally.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Pending payments loaded per batch.')
+        parser.add_argument('--concurrency', type=int, default=20, help='Validator requests in flight at once.')
+        parser.add_argument('--base-url', help='Validator base URL (default: SSLCOMMERZ_BASE_URL or sandbox/live by DEBUG).')
+
+    def handle(self, *args, **options):
+        totals = Counter()
+        after_id = 0
+        while after_id is not None:
+            counts, after_id = reconcile_batch(
+                after_id, options['batch_size'], options['concurrency'], base_url=options['base_url'],
+            )
+            totals.update(counts)
+        summary = ', '.join(f"{outcome} {count}" for outcome, count in sorted(totals.items()))
+        self.stdout.write(f"Reconciled {sum(totals.values())} payment(s): {summary or 'nothing pending'}.")
@@ -0,0 +1,28 @@
+import time
+from django.core.management.base import BaseCommand
+from tickets.outbox import deliver_batch
+
+
+class Command(BaseCommand):
+    help = 'Delivers queued emails from the outbox in batches. Use --loop to keep running as a worker.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Emails sent per SMTP connection.')
+        parser.add_argument('--max-attempts', type=int, help='Dead-letter an email after this many failures (default: OUTBOX_MAX_ATTEMPTS).')
+        parser.add_argument('--loop', action='store_true', help='Keep polling instead of exiting once the outbox is drained.')
+        parser.add_argument('--interval', type=float, default=2.0, help='Seconds to sleep between polls in --loop mode.')
+
+    def handle(self, *args, **options):
+        while True:
+            total_sent = total_failed = 0
+            while True:
+                sent, failed = deliver_batch(options['batch_size'], options['max_attempts'])
+                total_sent += sent
+                total_failed += failed
+                if sent + failed < options['batch_size']:
+                    break
+            if total_sent or total_failed or options['verbosity'] > 1:
+                self.stdout.write(f"Sent {total_sent} email(s), {total_failed} failed.")
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from tickets.inventory import reshard
+from tickets.models import TicketType
+
+
+class Command(BaseCommand):
+    help = 'Splits the stock of a ticket type across N shard rows, or merges it back with --shards 0.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('ticket_type', help='Name or ID of the ticket type.')
+        parser.add_argument('--shards', type=int, required=True, help='Number of shard rows, 0 to disable sharding.')
+
+    def handle(self, *args, **options):
+        if options['shards'] < 0:
+            raise CommandError('--shards must be 0 or more.')
+        lookup = options['ticket_type']
+        try:
+            ticket_type = TicketType.objects.get(id=int(lookup)) if lookup.isdigit() else TicketType.objects.get(name=lookup)
+        except TicketType.DoesNotExist:
+            raise CommandError(f"Ticket type '{lookup}' not found.")
+
+        ticket_type = reshard(ticket_type.id, options['shards'])
+        self.stdout.write(self.style.SUCCESS(f"{ticket_type.name} now uses {ticket_type.shard_count} shard(s)."))
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-18 06:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tickettype',
+            name='held_quantity',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='TicketHold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('status', models.CharField(choices=[('active', 'Active'), ('consumed', 'Consumed'), ('released', 'Released'), ('expired', 'Expired')], default='active', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField()),
+                ('booked_ticket', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='holds', to='tickets.bookedticket')),
+                ('booking', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='holds', to='tickets.booking')),
+                ('ticket_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tickets.tickettype')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('status', 'active')), fields=['expires_at'], name='tickethold_active_expiry_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.4 on 2026-10-18 06:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0002_ticket_holds'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tickethold',
+            name='shard_index',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tickettype',
+            name='shard_count',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='TicketStockShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveSmallIntegerField()),
+                ('available_quantity', models.IntegerField(default=0)),
+                ('held_quantity', models.IntegerField(default=0)),
+                ('ticket_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_shards', to='tickets.tickettype')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('ticket_type', 'index'), name='unique_ticket_stock_shard')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-18 06:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0004_email_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tran_id', models.CharField(max_length=64)),
+                ('val_id', models.CharField(max_length=200)),
+                ('source', models.CharField(choices=[('success', 'Success redirect'), ('ipn', 'IPN')], max_length=10)),
+                ('amount', models.CharField(blank=True, max_length=30)),
+                ('status', models.CharField(choices=[('applied', 'Applied'), ('already_paid', 'Already paid'), ('unmatched', 'Unmatched')], max_length=15)),
+                ('duplicate_count', models.PositiveIntegerField(default=0)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('tran_id', 'val_id'), name='unique_payment_event')],
+            },
+        ),
+    ]
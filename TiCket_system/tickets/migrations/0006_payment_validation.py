@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-18 06:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0005_payment_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymentevent',
+            name='last_error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='paymentevent',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending validation'), ('applied', 'Applied'), ('already_paid', 'Already paid'), ('unmatched', 'Unmatched'), ('rejected', 'Rejected')], default='pending', max_length=15),
+        ),
+        migrations.AddIndex(
+            model_name='paymentevent',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['id'], name='paymentevent_pending_idx'),
+        ),
+    ]
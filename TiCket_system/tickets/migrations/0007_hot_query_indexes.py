@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-18 06:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0006_payment_validation'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['booking_time'], name='booking_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(condition=models.Q(('is_paid', False)), fields=['booking_time'], name='booking_unpaid_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['customer_email'], name='booking_email_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['transaction_id'], name='booking_transaction_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tickettype',
+            index=models.Index(condition=models.Q(('is_active', True), models.Q(('shard_count__gt', 0), ('available_quantity__gt', models.F('held_quantity')), _connector='OR')), fields=['name'], name='tickettype_in_catalogue_idx'),
+        ),
+    ]
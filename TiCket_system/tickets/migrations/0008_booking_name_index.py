@@ -0,0 +1,17 @@
+# Generated by Django 5.2.4 on 2026-10-18 06:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0007_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['customer_name'], name='booking_name_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.4 on 2026-10-18 06:59
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_totals(apps, schema_editor):
+    # Same computation as `manage.py rebuild_sales`, with the historical models
+    Booking = apps.get_model('tickets', 'Booking')
+    BookedTicket = apps.get_model('tickets', 'BookedTicket')
+    lines = BookedTicket.objects.filter(booking=OuterRef('pk')).order_by().values('booking')
+    total = Coalesce(
+        Subquery(lines.annotate(total=Sum('subtotal')).values('total')),
+        Value(Decimal('0')), output_field=models.DecimalField(max_digits=12, decimal_places=2),
+    )
+    last = Booking.objects.aggregate(last=Max('pk'))['last'] or 0
+    for low in range(0, last, 5000):
+        Booking.objects.filter(pk__gt=low, pk__lte=low + 5000).update(total_amount=total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0008_booking_name_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketSales',
+            fields=[
+                ('ticket_type', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='sales', serialize=False, to='tickets.tickettype')),
+                ('sold_quantity', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'ticket sales',
+            },
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0009_booking_totals_and_sales'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tickettype',
+            name='admission_rate',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
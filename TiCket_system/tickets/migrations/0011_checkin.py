@@ -0,0 +1,43 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0010_ticket_type_admission_rate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CheckIn',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=64)),
+                ('gate', models.CharField(blank=True, max_length=50)),
+                ('status', models.CharField(choices=[('admitted', 'Admitted'), ('already_used', 'Already used'), ('unpaid', 'Unpaid'), ('unknown', 'Unknown')], max_length=15)),
+                ('entry_number', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('scanned_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='paid_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(condition=models.Q(('paid_at__isnull', False)), fields=['paid_at'], name='booking_paid_at_idx'),
+        ),
+        migrations.AddField(
+            model_name='checkin',
+            name='booking',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='check_ins', to='tickets.booking'),
+        ),
+        migrations.AddConstraint(
+            model_name='checkin',
+            constraint=models.UniqueConstraint(fields=('booking', 'entry_number'), name='unique_checkin_entry'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:23
+
+from django.db import migrations, models
+
+
+def backfill_status(apps, schema_editor):
+    # Unpaid bookings stay pending; `reap_bookings` expires the abandoned ones
+    Booking = apps.get_model('tickets', 'Booking')
+    Booking.objects.filter(is_paid=True).update(status='paid')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0011_checkin'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedBooking',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unique_id', models.UUIDField(unique=True)),
+                ('customer_name', models.CharField(max_length=100)),
+                ('customer_email', models.EmailField(max_length=254)),
+                ('booking_time', models.DateTimeField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('paid', 'Paid'), ('failed', 'Failed'), ('cancelled', 'Cancelled'), ('expired', 'Expired')], max_length=10)),
+                ('transaction_id', models.CharField(blank=True, max_length=200, null=True)),
+                ('paid_at', models.DateTimeField(blank=True, null=True)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('lines', models.JSONField(default=list)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('paid', 'Paid'), ('failed', 'Failed'), ('cancelled', 'Cancelled'), ('expired', 'Expired')], default='pending', max_length=10),
+        ),
+        migrations.RunPython(backfill_status, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['status', 'booking_time'], name='booking_status_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedbooking',
+            index=models.Index(fields=['customer_email'], name='archivedbooking_email_idx'),
+        ),
+    ]
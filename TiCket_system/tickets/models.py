@@ -1,26 +1,125 @@
 from django.db import models
 import uuid
 
+# Ticket types listed in the catalogue. Sharded types keep their stock on shard rows, so their
+# totals are checked after aggregation. Shared by the catalogue query and its partial index,
+# which the database only uses when the query repeats the index condition exactly.
+IN_CATALOGUE = models.Q(is_active=True) & (
+    models.Q(shard_count__gt=0) | models.Q(available_quantity__gt=models.F('held_quantity'))
+)
+
 class TicketType(models.Model):
     name = models.CharField(max_length=50, unique=True) # e.g., Silver, Gold, Platinum
     price = models.DecimalField(max_digits=10, decimal_places=2)
     available_quantity = models.IntegerField(default=0)
+    held_quantity = models.IntegerField(default=0) # Reserved by unpaid bookings with a live hold
     is_active = models.BooleanField(default=True)
+    # 0 keeps the stock on this row. N > 0 splits it across N TicketStockShard rows to spread write
+    # contention; the quantities above are then only a snapshot. Change it with `manage.py shard_inventory`.
+    shard_count = models.PositiveSmallIntegerField(default=0)
+    # Bookings per second let through the waiting room (tickets.waiting_room) during an on-sale; empty: no queue
+    admission_rate = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['name'], condition=IN_CATALOGUE, name='tickettype_in_catalogue_idx'),
+        ]
+
+    @property
+    def unreserved_quantity(self):
+        return self.available_quantity - self.held_quantity
 
     def __str__(self):
         return self.name
 
+class TicketStockShard(models.Model):
+    """
+    One slice of a sharded TicketType's stock. Each shard is an independent counter so
+    concurrent bookings for a hot ticket type update different rows.
+    """
+    ticket_type = models.ForeignKey(TicketType, on_delete=models.CASCADE, related_name='stock_shards')
+    index = models.PositiveSmallIntegerField()
+    available_quantity = models.IntegerField(default=0)
+    held_quantity = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['ticket_type', 'index'], name='unique_ticket_stock_shard'),
+        ]
+
+    def __str__(self):
+        return f"{self.ticket_type_id} shard {self.index}"
+
 class Booking(models.Model):
+    PENDING = 'pending'     # Awaiting payment
+    PAID = 'paid'
+    FAILED = 'failed'       # SSLCommerz reported the payment failed
+    CANCELLED = 'cancelled' # The customer cancelled at SSLCommerz
+    EXPIRED = 'expired'     # Abandoned checkout, closed by `reap_bookings`
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (PAID, 'Paid'),
+        (FAILED, 'Failed'),
+        (CANCELLED, 'Cancelled'),
+        (EXPIRED, 'Expired'),
+    ]
+    FINISHED = (PAID, FAILED, CANCELLED, EXPIRED)
+
     unique_id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     customer_name = models.CharField(max_length=100)
     customer_email = models.EmailField()
     booking_time = models.DateTimeField(auto_now_add=True)
     is_paid = models.BooleanField(default=False)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING) # `paid` exactly when is_paid
     transaction_id = models.CharField(max_length=200, blank=True, null=True) # From SSLCommerz
+    paid_at = models.DateTimeField(null=True, blank=True) # Set when a payment is applied; lets the check-in index catch up incrementally
+    # Sum of the line subtotals, stored when the booking is created. `rebuild_sales` recomputes it.
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        indexes = [
+            # Admin date filter and newest-first listing; an is_paid=True filter walks this index too,
+            # since most bookings end up paid
+            models.Index(fields=['booking_time'], name='booking_time_idx'),
+            # Unpaid bookings by age, a small and shrinking subset
+            models.Index(fields=['booking_time'], condition=models.Q(is_paid=False), name='booking_unpaid_time_idx'),
+            # Admin lookups by customer and by SSLCommerz transaction
+            models.Index(fields=['customer_email'], name='booking_email_idx'),
+            models.Index(fields=['customer_name'], name='booking_name_idx'),
+            models.Index(fields=['transaction_id'], name='booking_transaction_idx'),
+            # Admin status filters, and the reaper and archiver picking the oldest bookings of a status
+            models.Index(fields=['status', 'booking_time'], name='booking_status_time_idx'),
+            # Bookings paid since the check-in index last refreshed
+            models.Index(fields=['paid_at'], condition=models.Q(paid_at__isnull=False), name='booking_paid_at_idx'),
+        ]
 
     def __str__(self):
         return f"Booking {self.unique_id} - {self.customer_name}"
 
+class ArchivedBooking(models.Model):
+    """
+    A finished booking moved out of the Booking/BookedTicket tables by `reap_bookings --archive`,
+    with its lines kept as JSON: [{"ticket_type_id", "ticket_type", "quantity", "subtotal"}, ...].
+    """
+    unique_id = models.UUIDField(unique=True)
+    customer_name = models.CharField(max_length=100)
+    customer_email = models.EmailField()
+    booking_time = models.DateTimeField()
+    status = models.CharField(max_length=10, choices=Booking.STATUS_CHOICES)
+    transaction_id = models.CharField(max_length=200, blank=True, null=True)
+    paid_at = models.DateTimeField(null=True, blank=True)
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    lines = models.JSONField(default=list)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer_email'], name='archivedbooking_email_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived booking {self.unique_id} - {self.customer_name}"
+
 class BookedTicket(models.Model):
     booking = models.ForeignKey(Booking, on_delete=models.CASCADE, related_name='booked_tickets')
     ticket_type = models.ForeignKey(TicketType, on_delete=models.CASCADE)
@@ -32,4 +131,172 @@ class BookedTicket(models.Model):
         super().save(*args, **kwargs)
 
     def __str__(self):
-        return f"{self.quantity} x {self.ticket_type.name} for Booking {self.booking.unique_id}"
\ No newline at end of file
+        return f"{self.quantity} x {self.ticket_type.name} for Booking {self.booking.unique_id}"
+
+class TicketSales(models.Model):
+    """
+    Running sales totals of one ticket type over paid bookings, incremented when a payment is
+    applied, so dashboards need not aggregate every BookedTicket. `rebuild_sales` recomputes them.
+    """
+    ticket_type = models.OneToOneField(TicketType, on_delete=models.CASCADE, primary_key=True, related_name='sales')
+    sold_quantity = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'ticket sales'
+
+    def __str__(self):
+        return f"{self.ticket_type_id}: {self.sold_quantity} sold"
+
+class TicketHold(models.Model):
+    """
+    A time-boxed reservation of stock for one booked line, taken when the booking is created.
+    While active, its quantity is counted in `TicketType.held_quantity`.
+    """
+    ACTIVE = 'active'
+    CONSUMED = 'consumed' # Payment succeeded and the stock was decremented
+    RELEASED = 'released' # Payment failed or was cancelled
+    EXPIRED = 'expired'   # TTL ran out before payment
+    STATUS_CHOICES = [
+        (ACTIVE, 'Active'),
+        (CONSUMED, 'Consumed'),
+        (RELEASED, 'Released'),
+        (EXPIRED, 'Expired'),
+    ]
+
+    booking = models.ForeignKey(Booking, on_delete=models.CASCADE, related_name='holds')
+    booked_ticket = models.ForeignKey(BookedTicket, on_delete=models.CASCADE, related_name='holds')
+    ticket_type = models.ForeignKey(TicketType, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    shard_index = models.PositiveSmallIntegerField(null=True, blank=True) # Set when held on a TicketStockShard
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=ACTIVE)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # Lets the expiry sweeper pick the oldest live holds without scanning finished ones
+            models.Index(fields=['expires_at'], condition=models.Q(status='active'), name='tickethold_active_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"Hold of {self.quantity} x {self.ticket_type_id} for Booking {self.booking_id} ({self.status})"
+
+class EmailOutbox(models.Model):
+    """
+    An email waiting to be delivered by the `send_outbox_emails` worker.
+    Rows are written in the same transaction as the change that triggers them, so no email is lost
+    if the request dies, and none is sent for a change that was rolled back.
+    """
+    BOOKING_CONFIRMATION = 'booking_confirmation'
+    KIND_CHOICES = [
+        (BOOKING_CONFIRMATION, 'Booking confirmation'),
+    ]
+
+    PENDING = 'pending'
+    SENT = 'sent'
+    DEAD = 'dead' # Gave up after OUTBOX_MAX_ATTEMPTS failures
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (DEAD, 'Dead'),
+    ]
+
+    booking = models.ForeignKey(Booking, on_delete=models.CASCADE, related_name='emails')
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField()
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = 'email outbox'
+        indexes = [
+            # The worker only ever looks for pending rows that are due
+            models.Index(fields=['next_attempt_at'], condition=models.Q(status='pending'), name='emailoutbox_pending_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} for Booking {self.booking_id} ({self.status})"
+
+class PaymentEvent(models.Model):
+    """
+    One payment notification from SSLCommerz. The browser success redirect and the IPN (including
+    its retries) carry the same (tran_id, val_id), so the unique constraint lets only the first
+    delivery through; later ones just bump `duplicate_count`.
+    """
+    SUCCESS_REDIRECT = 'success'
+    IPN = 'ipn'
+    SOURCE_CHOICES = [
+        (SUCCESS_REDIRECT, 'Success redirect'),
+        (IPN, 'IPN'),
+    ]
+
+    PENDING = 'pending'           # Not yet confirmed by the validator API
+    APPLIED = 'applied'           # Marked the booking paid
+    ALREADY_PAID = 'already_paid' # Booking was already paid under another val_id
+    UNMATCHED = 'unmatched'       # No booking with this tran_id
+    REJECTED = 'rejected'         # The validator API did not confirm the payment
+    STATUS_CHOICES = [
+        (PENDING, 'Pending validation'),
+        (APPLIED, 'Applied'),
+        (ALREADY_PAID, 'Already paid'),
+        (UNMATCHED, 'Unmatched'),
+        (REJECTED, 'Rejected'),
+    ]
+
+    tran_id = models.CharField(max_length=64)
+    val_id = models.CharField(max_length=200)
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES)
+    amount = models.CharField(max_length=30, blank=True) # As reported by the gateway
+    status = models.CharField(max_length=15, choices=STATUS_CHOICES, default=PENDING)
+    last_error = models.TextField(blank=True)
+    duplicate_count = models.PositiveIntegerField(default=0)
+    received_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['tran_id', 'val_id'], name='unique_payment_event'),
+        ]
+        indexes = [
+            # `reconcile_payments` only scans events still awaiting validation
+            models.Index(fields=['id'], condition=models.Q(status='pending'), name='paymentevent_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.tran_id} / {self.val_id} ({self.status})"
+
+class CheckIn(models.Model):
+    """
+    One scan of a booking code at a venue gate. Admitted entries are numbered 1..N per booking,
+    N being its ticket count; the unique constraint makes each number usable once, so the same
+    ticket cannot get in twice through different gates or processes.
+    """
+    ADMITTED = 'admitted'
+    ALREADY_USED = 'already_used' # Every ticket of the booking is already in
+    UNPAID = 'unpaid'
+    UNKNOWN = 'unknown'           # Not a booking code
+    STATUS_CHOICES = [
+        (ADMITTED, 'Admitted'),
+        (ALREADY_USED, 'Already used'),
+        (UNPAID, 'Unpaid'),
+        (UNKNOWN, 'Unknown'),
+    ]
+
+    booking = models.ForeignKey(Booking, on_delete=models.CASCADE, null=True, blank=True, related_name='check_ins')
+    code = models.CharField(max_length=64) # As scanned
+    gate = models.CharField(max_length=50, blank=True)
+    status = models.CharField(max_length=15, choices=STATUS_CHOICES)
+    entry_number = models.PositiveSmallIntegerField(null=True, blank=True) # Set for admitted entries
+    scanned_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['booking', 'entry_number'], name='unique_checkin_entry'),
+        ]
+
+    def __str__(self):
+        return f"{self.code} at {self.gate or 'gate'} ({self.status})"
@@ -0,0 +1,141 @@
+# tickets/outbox.py
+import random
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import F
+from django.template.loader import render_to_string
+from django.utils import timezone
+from . import artifacts
+from .instrumentation import timed
+from .models import EmailOutbox
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_confirmation_email(booking):
+    """
+    Queues the booking confirmation email. Call inside the transaction that marks the booking paid.
+    """
+    return EmailOutbox.objects.create(
+        booking=booking,
+        kind=EmailOutbox.BOOKING_CONFIRMATION,
+        next_attempt_at=timezone.now(),
+    )
+
+
+def build_confirmation_email(booking, connection=None):
+    """
+    Builds the confirmation email to the customer with booking details.
+    """
+    subject = 'Your Ticket Booking Confirmation'
+    # Render the HTML email template with booking data
+    with timed('template'):
+        message = render_to_string('tickets/confirmation_email.html', {
+            'booking': booking,
+        })
+    email = EmailMultiAlternatives(
+        subject, message, settings.DEFAULT_FROM_EMAIL, [booking.customer_email], connection=connection
+    )
+    email.attach_alternative(message, 'text/html')
+    # PDF tickets with the QR code scanned at the gate; read from the artifact cache when already rendered
+    for line, pdf in artifacts.booking_tickets([booking])[booking.pk]:
+        email.attach(f"ticket-{booking.unique_id}-{line.pk}.pdf", pdf, artifacts.CONTENT_TYPES['pdf'])
+    return email
+
+
+BUILDERS = {
+    EmailOutbox.BOOKING_CONFIRMATION: build_confirmation_email,
+}
+
+
+def retry_delay(attempts):
+    """
+    Exponential backoff with jitter: roughly base, 2x base, 4x base... after each failed attempt.
+    """
+    delay = settings.OUTBOX_RETRY_BASE_SECONDS * (2 ** (attempts - 1))
+    return timedelta(seconds=delay * random.uniform(0.5, 1.5))
+
+
+def claim_batch(batch_size):
+    """
+    Claims up to `batch_size` due emails by pushing their next attempt into the future.
+    Concurrent workers therefore never pick the same email, and a worker that dies mid-batch
+    only delays its emails by OUTBOX_LEASE_SECONDS.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            EmailOutbox.objects.select_for_update(skip_locked=True)
+            .filter(status=EmailOutbox.PENDING, next_attempt_at__lte=now)
+            .order_by('next_attempt_at')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        EmailOutbox.objects.filter(id__in=ids).update(
+            attempts=F('attempts') + 1,
+            next_attempt_at=now + timedelta(seconds=settings.OUTBOX_LEASE_SECONDS),
+        )
+    return list(
+        EmailOutbox.objects.filter(id__in=ids)
+        .select_related('booking')
+        .prefetch_related('booking__booked_tickets__ticket_type')
+        .order_by('next_attempt_at', 'id')
+    )
+
+
+def _record_failure(entry, error, max_attempts):
+    entry.last_error = str(error)
+    if entry.attempts >= max_attempts:
+        entry.status = EmailOutbox.DEAD
+        logger.error("Giving up on %s for booking %s after %s attempts: %s", entry.get_kind_display(), entry.booking_id, entry.attempts, error)
+    else:
+        entry.next_attempt_at = timezone.now() + retry_delay(entry.attempts)
+        logger.warning("Failed to send %s for booking %s (attempt %s): %s", entry.get_kind_display(), entry.booking_id, entry.attempts, error)
+    entry.save(update_fields=['status', 'next_attempt_at', 'last_error'])
+
+
+def deliver_batch(batch_size=100, max_attempts=None):
+    """
+    Sends one batch of due emails over a single SMTP connection.
+    Returns (sent, failed) counts; failures are retried later or dead-lettered after `max_attempts`.
+    """
+    if max_attempts is None:
+        max_attempts = settings.OUTBOX_MAX_ATTEMPTS
+    entries = claim_batch(batch_size)
+    if not entries:
+        return 0, 0
+
+    # Render the whole batch's tickets in one pass through the worker pool; the builders then read them back
+    try:
+        artifacts.booking_tickets([entry.booking for entry in entries])
+    except Exception as e:
+        logger.warning("Could not pre-render ticket artifacts for the outbox batch: %s", e)
+
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as e:
+        logger.error("SMTP connection failed while sending outbox batch: %s", e)
+        for entry in entries:
+            _record_failure(entry, e, max_attempts)
+        return 0, len(entries)
+
+    sent = failed = 0
+    try:
+        for entry in entries:
+            try:
+                email = BUILDERS[entry.kind](entry.booking, connection=connection)
+                with timed('email'):
+                    email.send()
+            except Exception as e:
+                failed += 1
+                _record_failure(entry, e, max_attempts)
+            else:
+                sent += 1
+                EmailOutbox.objects.filter(id=entry.id).update(status=EmailOutbox.SENT, sent_at=timezone.now())
+                logger.info("Confirmation email sent to %s for booking %s", entry.booking.customer_email, entry.booking.unique_id)
+    finally:
+        connection.close()
+    return sent, failed
@@ -0,0 +1,177 @@
+# tickets/payments.py
+import threading
+import uuid
+from collections import Counter
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from .gateway import GatewayError
+from .inventory import decrement_for_booking
+from .models import Booking, PaymentEvent
+from .outbox import enqueue_confirmation_email
+from .sales import record_sale
+from .validation import verify_many, verify_payment
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Outcomes of process_payment
+APPLIED = 'applied'
+DUPLICATE = 'duplicate'       # Same (tran_id, val_id) was already processed
+ALREADY_PAID = 'already_paid' # Booking was paid by an earlier event with another val_id
+NOT_FOUND = 'not_found'
+REJECTED = 'rejected'         # The validator API did not confirm the payment
+PENDING = 'pending'           # The validator API was unreachable, left for `reconcile_payments`
+
+# Outcome reported for a repeated notification, by the status of the event it repeats
+_REPEAT_OUTCOMES = {
+    PaymentEvent.UNMATCHED: NOT_FOUND,
+    PaymentEvent.REJECTED: REJECTED,
+}
+
+_metrics = Counter()
+_metrics_lock = threading.Lock()
+
+
+def _count(outcome):
+    with _metrics_lock:
+        _metrics[outcome] += 1
+
+
+def payment_metrics():
+    """
+    Outcome counts of process_payment in this process since it started.
+    `duplicate` + `already_paid` is the number of redundant callbacks absorbed.
+    """
+    with _metrics_lock:
+        return dict(_metrics)
+
+
+def _record_event(tran_id, val_id, amount, source):
+    """
+    Inserts the ledger entry for a notification. Returns (event, created); for a repeat, the
+    existing event is returned with its duplicate_count bumped.
+    """
+    try:
+        with transaction.atomic():
+            event = PaymentEvent.objects.create(tran_id=tran_id, val_id=val_id, source=source, amount=amount or '')
+        return event, True
+    except IntegrityError:
+        events = PaymentEvent.objects.filter(tran_id=tran_id, val_id=val_id)
+        events.update(duplicate_count=F('duplicate_count') + 1)
+        return events.only('id', 'tran_id', 'val_id', 'status').get(), False
+
+
+def _settle(event, status, **fields):
+    # Only a pending event changes status, so a concurrent repeat cannot overwrite the outcome
+    PaymentEvent.objects.filter(pk=event.pk, status=PaymentEvent.PENDING).update(status=status, **fields)
+    event.status = status
+
+
+def reject_event(event, reason):
+    _settle(event, PaymentEvent.REJECTED, last_error=reason)
+
+
+def apply_event(event):
+    """
+    Applies a validated payment event. The booking is claimed with one conditional UPDATE
+    (is_paid False -> True), so only one event can ever pay it; the winner decrements stock
+    and queues the confirmation email in the same transaction. A booking that already failed,
+    was cancelled or expired is still marked paid, since the customer has been charged.
+    Returns (outcome, booking); booking is None unless the payment was applied.
+    """
+    with transaction.atomic():
+        claimed = Booking.objects.filter(unique_id=event.tran_id, is_paid=False).update(
+            is_paid=True, status=Booking.PAID, transaction_id=event.val_id, paid_at=timezone.now()
+        )
+        if not claimed:
+            outcome = ALREADY_PAID if Booking.objects.filter(unique_id=event.tran_id).exists() else NOT_FOUND
+            _settle(event, PaymentEvent.ALREADY_PAID if outcome == ALREADY_PAID else PaymentEvent.UNMATCHED)
+            return outcome, None
+
+        booking = Booking.objects.get(unique_id=event.tran_id)
+        # Decrease available ticket quantity for all booked tickets in one conditional UPDATE
+        failed_lines = decrement_for_booking(booking)
+        if failed_lines:
+            # You might want to handle this more robustly, e.g., refund or alert admin.
+            logger.warning("Booking %s paid with %s line(s) exceeding available stock.", event.tran_id, len(failed_lines))
+
+        # Count the sale in the per-ticket-type aggregates
+        record_sale(booking)
+
+        # Queue the confirmation email to the customer, delivered by `send_outbox_emails`
+        enqueue_confirmation_email(booking)
+
+        _settle(event, PaymentEvent.APPLIED)
+    return APPLIED, booking
+
+
+def process_payment(tran_id, val_id, amount, source):
+    """
+    Handles a successful payment notification exactly once. Shared by the success redirect and the IPN.
+
+    The event is recorded under a unique (tran_id, val_id) key, so a repeat of an event that was
+    already settled stops at that insert, before any validator call. New events are confirmed with
+    the validator API (see `tickets.validation`) and then applied with `apply_event`.
+    Returns (outcome, booking); booking is None unless the payment was applied.
+    """
+    try:
+        uuid.UUID(str(tran_id))
+    except ValueError:
+        _count(NOT_FOUND)
+        return NOT_FOUND, None
+
+    event, created = _record_event(str(tran_id), val_id or '', amount, source)
+    if not created and event.status != PaymentEvent.PENDING:
+        _count(DUPLICATE)
+        logger.info("Duplicate %s notification for tran_id %s absorbed.", source, tran_id)
+        return _REPEAT_OUTCOMES.get(event.status, DUPLICATE), None
+
+    # Validate outside any transaction, so no row stays locked during the round-trip
+    try:
+        valid, reason = verify_payment(tran_id, val_id, amount)
+    except GatewayError as e:
+        logger.warning("Could not validate payment %s (%s); left for reconciliation.", tran_id, e)
+        _count(PENDING)
+        return PENDING, None
+    if not valid:
+        logger.error("Payment validation failed for tran_id %s: %s", tran_id, reason)
+        reject_event(event, reason)
+        _count(REJECTED)
+        return REJECTED, None
+
+    outcome, booking = apply_event(event)
+    _count(outcome)
+    return outcome, booking
+
+
+def reconcile_batch(after_id=0, batch_size=100, concurrency=20, **client_options):
+    """
+    Re-validates one batch of pending events (callbacks received while the validator was unreachable)
+    with up to `concurrency` validator calls in flight, then applies or rejects each of them.
+
+    Returns (counts by outcome, id of the last event in the batch or None when there are no more).
+    Events that still cannot be validated stay pending for the next run.
+    """
+    events = list(
+        PaymentEvent.objects.filter(status=PaymentEvent.PENDING, pk__gt=after_id)
+        .order_by('pk')[:batch_size]
+    )
+    if not events:
+        return Counter(), None
+
+    results = verify_many(
+        [(event.tran_id, event.val_id, event.amount or None) for event in events],
+        concurrency=concurrency, **client_options,
+    )
+    counts = Counter()
+    for event, result in zip(events, results):
+        if isinstance(result, GatewayError):
+            outcome = PENDING
+        elif not result[0]:
+            reject_event(event, result[1])
+            outcome = REJECTED
+        else:
+            outcome, _ = apply_event(event)
+        counts[outcome] += 1
+    return counts, events[-1].pk
@@ -0,0 +1,185 @@
+# tickets/ratelimit.py
+"""
+Token-bucket rate limiting for the catalogue and booking APIs.
+
+Each limit in settings.RATE_LIMITS is "N/S": a bucket of N tokens refilled over S seconds, so a
+client may burst N requests and then sustain N/S per second. A limit set to '' is off.
+
+    catalogue:ip     catalogue requests per client IP
+    booking:ip       booking attempts per client IP
+    booking:email    booking attempts per customer email
+    booking:global   booking attempts across all clients
+
+Buckets are kept by RATE_LIMIT_BACKEND: `LocalBackend` (the default) holds them in process
+memory; `CacheBackend` keeps them in a Django cache shared by all processes. Any class with the
+same `take` method and a `clock` for its timestamps can be plugged in, e.g. an atomic Redis script.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+from rest_framework.throttling import BaseThrottle
+
+
+def parse_limit(value):
+    """
+    Parses "N/S" into (capacity, refill rate per second). Returns None for an empty limit.
+    """
+    if not value:
+        return None
+    count, seconds = value.split('/')
+    capacity = int(count)
+    return capacity, capacity / float(seconds)
+
+
+def _refill(state, capacity, rate, now):
+    tokens, updated = state if state is not None else (capacity, now)
+    # A clock that went back (another host's, or a reset one) refills nothing rather than draining the bucket
+    return min(capacity, tokens + max(0.0, now - updated) * rate)
+
+
+class LocalBackend:
+    """
+    Buckets in process memory, the least recently used dropped beyond `max_keys`.
+    With several processes each enforces the limits on its own share of the traffic.
+    """
+    clock = staticmethod(time.monotonic) # Only ever compared within this process
+
+    def __init__(self, max_keys=100_000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate, now):
+        """
+        Takes one token from the bucket. Returns 0 if one was available, otherwise the seconds
+        until there will be one.
+        """
+        with self._lock:
+            tokens = _refill(self._buckets.pop(key, None), capacity, rate, now)
+            allowed = tokens >= 1
+            self._buckets[key] = (tokens - 1 if allowed else tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return 0 if allowed else (1 - tokens) / rate
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class CacheBackend(LocalBackend):
+    """
+    Buckets in the RATE_LIMIT_CACHE cache, shared by all processes. The read-modify-write is not
+    atomic, so concurrent requests can occasionally slip a token past the limit.
+    """
+    # Buckets are refilled by whichever process sees the next request: wall-clock time is comparable
+    # across processes and hosts, unlike each one's monotonic clock
+    clock = staticmethod(time.time)
+
+    def __init__(self, alias=None):
+        self.cache = caches[alias or settings.RATE_LIMIT_CACHE]
+
+    def take(self, key, capacity, rate, now):
+        key = f"tickets:ratelimit:{key}"
+        tokens = _refill(self.cache.get(key), capacity, rate, now)
+        allowed = tokens >= 1
+        # Expires once it would have refilled completely anyway
+        self.cache.set(key, (tokens - 1 if allowed else tokens, now), math.ceil(capacity / rate) + 1)
+        return 0 if allowed else (1 - tokens) / rate
+
+    def reset(self):
+        pass # Entries expire on their own
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = import_string(settings.RATE_LIMIT_BACKEND)()
+    return _backend
+
+
+def reset():
+    """
+    Empties every bucket, e.g. between tests.
+    """
+    get_backend().reset()
+
+
+def hit(scope, identity):
+    """
+    Counts a request against the `scope` limit of `identity`. Returns 0 if it is allowed,
+    otherwise the whole seconds to wait before retrying.
+    """
+    limit = parse_limit(settings.RATE_LIMITS.get(scope))
+    if limit is None:
+        return 0
+    capacity, rate = limit
+    backend = get_backend()
+    return math.ceil(backend.take(f"{scope}:{identity}", capacity, rate, backend.clock()))
+
+
+def client_ip(request):
+    """
+    The client's address. Behind RATE_LIMIT_PROXY_COUNT trusted proxies it is taken from
+    X-Forwarded-For, counting that many hops from the right.
+    """
+    proxies = settings.RATE_LIMIT_PROXY_COUNT
+    if proxies:
+        hops = [hop.strip() for hop in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if hop.strip()]
+        if len(hops) >= proxies:
+            return hops[-proxies]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def catalogue_wait(request):
+    return hit('catalogue:ip', client_ip(request))
+
+
+def booking_wait(request, data):
+    """
+    Returns the seconds a booking attempt must wait, or 0 if it may proceed.
+    """
+    email = data.get('customer_email') if isinstance(data, dict) else None
+    checks = [('booking:ip', client_ip(request))]
+    if isinstance(email, str) and email.strip():
+        checks.append(('booking:email', email.strip().lower()))
+    checks.append(('booking:global', '*'))
+    for scope, identity in checks:
+        wait = hit(scope, identity)
+        if wait:
+            return wait
+    return 0
+
+
+def throttled_payload(wait):
+    # Same body as DRF's Throttled response, for the plain Django views
+    return {'detail': f"Request was throttled. Expected available in {wait} second{'s' if wait != 1 else ''}."}
+
+
+class _Throttle(BaseThrottle):
+    def allow_request(self, request, view):
+        self.retry_after = self.wait_for(request)
+        return not self.retry_after
+
+    def wait(self):
+        return self.retry_after
+
+
+class CatalogueThrottle(_Throttle):
+    def wait_for(self, request):
+        return catalogue_wait(request)
+
+
+class BookingThrottle(_Throttle):
+    def wait_for(self, request):
+        return booking_wait(request, request.data)
@@ -0,0 +1,153 @@
+# tickets/sales.py
+"""
+Stored booking totals and per-ticket-type sales aggregates.
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+from decimal import Decimal
+from django.db import connection, transaction
+from django.db.models import Case, DecimalField, F, IntegerField, Max, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import ArchivedBooking, Booking, BookedTicket, TicketSales, TicketType
+
+
+def lines_total():
+    """
+    Subquery summing the line subtotals of the booking in OuterRef('pk').
+    """
+    lines = BookedTicket.objects.filter(booking=OuterRef('pk')).order_by().values('booking')
+    return Coalesce(
+        Subquery(lines.annotate(total=Sum('subtotal')).values('total')),
+        Value(Decimal('0')), output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+
+
+def record_sale(booking):
+    """
+    Adds a newly paid booking's lines to the TicketSales of their ticket types.
+    Call inside the transaction that marks the booking paid. Issues the same three queries
+    however many lines the booking has.
+    """
+    quantities, revenue = {}, {}
+    lines = (
+        BookedTicket.objects.filter(booking=booking).order_by()
+        .values('ticket_type').annotate(quantity=Sum('quantity'), revenue=Sum('subtotal'))
+    )
+    for line in lines:
+        quantities[line['ticket_type']] = line['quantity']
+        revenue[line['ticket_type']] = line['revenue']
+    if not quantities:
+        return
+
+    # Rows for ticket types that have never sold
+    TicketSales.objects.bulk_create([TicketSales(ticket_type_id=pk) for pk in quantities], ignore_conflicts=True)
+    TicketSales.objects.filter(ticket_type_id__in=quantities).update(
+        sold_quantity=F('sold_quantity') + Case(
+            *(When(ticket_type_id=pk, then=Value(n)) for pk, n in quantities.items()),
+            default=Value(0), output_field=IntegerField(),
+        ),
+        revenue=F('revenue') + Case(
+            *(When(ticket_type_id=pk, then=Value(amount)) for pk, amount in revenue.items()),
+            default=Value(Decimal('0')), output_field=DecimalField(max_digits=14, decimal_places=2),
+        ),
+        updated_at=timezone.now(),
+    )
+
+
+def _pk_ranges(queryset, batch_size):
+    """
+    Yields (low, high) primary key ranges of at most `batch_size` ids covering the queryset.
+    """
+    last = queryset.aggregate(last=Max('pk'))['last'] or 0
+    for low in range(0, last, batch_size):
+        yield low, low + batch_size
+
+
+def rebuild_booking_totals(batch_size=5000):
+    """
+    Recomputes Booking.total_amount from the lines, one primary key range per UPDATE and transaction.
+    Returns the number of bookings updated.
+    """
+    updated = 0
+    for low, high in _pk_ranges(Booking.objects.all(), batch_size):
+        with transaction.atomic():
+            updated += Booking.objects.filter(pk__gt=low, pk__lte=high).update(total_amount=lines_total())
+    return updated
+
+
+@contextmanager
+def _read_snapshot():
+    """
+    Runs the block's queries against one consistent snapshot of the database without taking any
+    locks, so writers carry on meanwhile: a REPEATABLE READ, READ ONLY transaction on PostgreSQL,
+    and a deferred (read) transaction on SQLite, which holds a WAL snapshot instead of the write lock
+    Django's IMMEDIATE transactions take. Inside a transaction the block just joins it, as the
+    isolation level can only be set when a transaction starts.
+    """
+    if connection.vendor == 'postgresql' and not connection.in_atomic_block:
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+            yield
+    elif connection.vendor == 'sqlite' and not connection.in_atomic_block:
+        with connection.cursor() as cursor:
+            cursor.execute('BEGIN DEFERRED')
+        try:
+            yield
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute('COMMIT') # Read only, so nothing to roll back
+    else:
+        with transaction.atomic():
+            yield
+
+
+def rebuild_ticket_sales(batch_size=5000):
+    """
+    Recomputes every TicketSales row from the lines of paid bookings, aggregating one range of
+    bookings at a time, plus the archived ones.
+
+    The lines are read from one snapshot, without locks, so payments (and `reap_bookings --archive`)
+    carry on during the scan, and a booking archived meanwhile is counted once, wherever the snapshot
+    has it. The TicketSales rows are read in that snapshot too: what payments have added to them since
+    is added to the rebuilt totals in a final short transaction, the only one that locks them.
+    Returns the number of ticket types written.
+    """
+    TicketSales.objects.bulk_create(
+        [TicketSales(ticket_type_id=pk) for pk in TicketType.objects.values_list('pk', flat=True)],
+        ignore_conflicts=True,
+    )
+
+    quantities = defaultdict(int)
+    revenue = defaultdict(Decimal)
+    with _read_snapshot():
+        recorded = {pk: (n, amount) for pk, n, amount in TicketSales.objects.values_list('pk', 'sold_quantity', 'revenue')}
+        for low, high in _pk_ranges(Booking.objects.all(), batch_size):
+            lines = (
+                BookedTicket.objects.filter(booking__is_paid=True, booking_id__gt=low, booking_id__lte=high)
+                .order_by().values('ticket_type').annotate(quantity=Sum('quantity'), revenue=Sum('subtotal'))
+            )
+            for line in lines:
+                quantities[line['ticket_type']] += line['quantity']
+                revenue[line['ticket_type']] += line['revenue']
+        # Paid bookings moved out by `reap_bookings --archive` still count
+        archived = ArchivedBooking.objects.filter(status=Booking.PAID).values_list('lines', flat=True)
+        for lines in archived.iterator(chunk_size=batch_size):
+            for line in lines:
+                quantities[line['ticket_type_id']] += line['quantity']
+                revenue[line['ticket_type_id']] += Decimal(line['subtotal'])
+
+    with transaction.atomic():
+        now = timezone.now()
+        sales = []
+        for pk, n, amount in TicketSales.objects.select_for_update().values_list('pk', 'sold_quantity', 'revenue'):
+            # Sales recorded after the snapshot
+            recorded_n, recorded_amount = recorded.get(pk, (0, Decimal('0')))
+            sales.append(TicketSales(
+                ticket_type_id=pk, updated_at=now,
+                sold_quantity=quantities.get(pk, 0) + n - recorded_n,
+                revenue=revenue.get(pk, Decimal('0')) + amount - recorded_amount,
+            ))
+        TicketSales.objects.bulk_update(sales, ['sold_quantity', 'revenue', 'updated_at'], batch_size=500)
+    return len(sales)
@@ -0,0 +1,18 @@
+# tickets/signals.py
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .catalogue import bump_version
+from .models import TicketType
+from .waiting_room import forget_rates
+
+
+@receiver(post_save, sender=TicketType)
+@receiver(post_delete, sender=TicketType)
+def ticket_type_changed(sender, **kwargs):
+    """
+    Invalidates the cached catalogue and waiting room rates when a ticket type is edited (e.g. from
+    the admin). Stock changes made with bulk UPDATEs are invalidated by the inventory module instead.
+    """
+    transaction.on_commit(bump_version)
+    transaction.on_commit(forget_rates)
@@ -0,0 +1,65 @@
+# tickets/singleflight.py
+"""
+Request coalescing: concurrent callers asking for the same key share one computation.
+
+Used for catalogue cache misses, so a burst of requests arriving just after the catalogue was
+invalidated runs the catalogue query once per process instead of once per request.
+"""
+import asyncio
+import threading
+import weakref
+
+WAIT_TIMEOUT = 10 # Seconds a follower waits for the leader before computing on its own
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+_async_flights = weakref.WeakKeyDictionary() # Event loop -> {key: task}
+
+
+def do(key, compute):
+    """
+    Returns compute(). If another thread is already computing `key`, waits for its result instead.
+    """
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+    if not leader:
+        if not flight.done.wait(WAIT_TIMEOUT):
+            return compute()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    try:
+        flight.result = compute()
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
+    return flight.result
+
+
+async def ado(key, compute):
+    """
+    Async counterpart of `do` for coroutine functions, coalescing within the running event loop.
+    """
+    flights = _async_flights.setdefault(asyncio.get_running_loop(), {})
+    task = flights.get(key)
+    if task is None:
+        task = flights[key] = asyncio.ensure_future(compute())
+        task.add_done_callback(lambda _: flights.pop(key, None))
+    # Shielded, so a caller that goes away does not cancel the others' result
+    return await asyncio.shield(task)
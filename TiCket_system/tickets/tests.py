@@ -1,3 +1,1452 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.admin import site
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core import mail
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.db.models import F, QuerySet, Sum
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from .admin import BookingAdmin, _older_than
+from .catalogue import _catalogue_queryset
+from .db_router import PRIMARY_COOKIE, PrimaryReplicaRouter, ReplicaRoutingMiddleware, _Routing, _routing
+from .fake_gateway import FakeSSLCommerzServer, val_id_for
+from .gateway import SSLCommerzClient, AsyncSSLCommerzClient, GatewayError
+from .inventory import reserve_for_booking
+from .log import JSONFormatter, QueueHandler, SamplingFilter, log_context
+from .models import TicketType, TicketStockShard, Booking, BookedTicket, TicketSales, TicketHold, EmailOutbox, PaymentEvent, CheckIn, ArchivedBooking
+from .sales import rebuild_ticket_sales, record_sale
+from .serializers import BookingSerializer, TicketTypeSerializer, ticket_type_data
+from . import artifacts, availability, catalogue, checkin, inventory, lifecycle, log, outbox, payments, ratelimit, sales, singleflight, waiting_room
 
-# Create your tests here.
+
+@override_settings(SSLCOMMERZ_STORE_ID='test-store', SSLCOMMERZ_STORE_PASSWORD='secret')
+class GatewayClientTests(SimpleTestCase):
+    def test_initiate_and_validate(self):
+        with FakeSSLCommerzServer(store_id='test-store') as server:
+            client = SSLCommerzClient(base_url=server.url)
+            response = client.initiate_payment({'tran_id': 'T1', 'total_amount': '150.00'})
+            self.assertEqual(response['status'], 'SUCCESS')
+            validation = client.validate(val_id_for('T1'))
+            self.assertEqual(validation['status'], 'VALID')
+            self.assertEqual(validation['amount'], '150.00')
+            client.close()
+
+    def test_retries_then_gives_up(self):
+        with FakeSSLCommerzServer(store_id='test-store', failure_rate=1.0) as server:
+            client = SSLCommerzClient(base_url=server.url, max_retries=2, backoff=0)
+            with self.assertRaises(GatewayError):
+                client.initiate_payment({'tran_id': 'T1', 'total_amount': '10'})
+            self.assertEqual(server.request_count, 3)
+            client.close()
+
+    def test_async_client(self):
+        async def initiate(url):
+            client = AsyncSSLCommerzClient(base_url=url)
+            try:
+                return await client.initiate_payment({'tran_id': 'T2', 'total_amount': '10'})
+            finally:
+                await client.close()
+
+        with FakeSSLCommerzServer(store_id='test-store') as server:
+            response = async_to_sync(initiate)(server.url)
+        self.assertEqual(response['status'], 'SUCCESS')
+
+
+@override_settings(SSLCOMMERZ_STORE_ID='test-store', SSLCOMMERZ_STORE_PASSWORD='secret')
+class BookingQueryCountTests(TestCase):
+    """
+    Booking creation and the payment callbacks must issue a fixed number of queries,
+    however many lines a booking has.
+    """
+    def setUp(self):
+        self.ticket_types = [
+            TicketType.objects.create(name=f"Type {i}", price=Decimal('100.00'), available_quantity=50)
+            for i in range(10)
+        ]
+        self.gateway = FakeSSLCommerzServer(store_id='test-store').start()
+        self.addCleanup(self.gateway.stop)
+        self.gateway_client = SSLCommerzClient(base_url=self.gateway.url)
+        self.addCleanup(self.gateway_client.close)
+        for target in ('tickets.views.get_client', 'tickets.validation.get_client'):
+            patcher = mock.patch(target, return_value=self.gateway_client)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        cache.clear()
+        ratelimit.reset()
+
+    def book(self, lines):
+        return self.client.post('/api/book-tickets/', {
+            'customer_name': 'Test Customer',
+            'customer_email': 'customer@example.com',
+            'booked_tickets': [{'ticket_type': t.id, 'quantity': 2} for t in self.ticket_types[:lines]],
+        }, content_type='application/json')
+
+    def paid_booking(self, lines):
+        booking = Booking.objects.create(customer_name='Test Customer', customer_email='customer@example.com')
+        booked_tickets = BookedTicket.objects.bulk_create([
+            BookedTicket(booking=booking, ticket_type=t, quantity=2, subtotal=t.price * 2)
+            for t in self.ticket_types[:lines]
+        ])
+        reserve_for_booking(booking, booked_tickets)
+        # Open a gateway session, so the fake validator confirms the payment
+        self.gateway_client.initiate_payment({'tran_id': str(booking.unique_id), 'total_amount': f"{lines * 200:.2f}"})
+        return booking
+
+    def callback_data(self, booking):
+        total = sum(line.subtotal for line in booking.booked_tickets.all())
+        tran_id = str(booking.unique_id)
+        return {'tran_id': tran_id, 'val_id': val_id_for(tran_id), 'amount': f"{total:.2f}", 'status': 'VALID'}
+
+    def test_create_booking(self):
+        waiting_room.admission_rates() # Loaded once, then cached until a ticket type is saved
+        for lines in (1, 5, 10):
+            # Ticket types in_bulk, savepoint, booking, booked lines, savepoint, held quantities,
+            # release, holds, release
+            with self.subTest(lines=lines), self.assertNumQueries(9):
+                response = self.book(lines)
+            self.assertEqual(response.status_code, 200)
+
+    def test_success_callback(self):
+        for lines in (1, 5, 10):
+            booking = self.paid_booking(lines)
+            data = self.callback_data(booking)
+            # Payment event (savepoint, insert, release), then savepoint, claim booking, booking,
+            # lines with ticket types, lock holds, savepoint, stock, release, consume holds,
+            # sales per ticket type, sales rows, sales update, outbox email, event applied, release
+            with self.subTest(lines=lines), self.assertNumQueries(18):
+                response = self.client.post('/sslcommerz/success/', data)
+            self.assertEqual(response.status_code, 302)
+
+    def test_ipn_callback(self):
+        for lines in (1, 5, 10):
+            booking = self.paid_booking(lines)
+            data = self.callback_data(booking)
+            with self.subTest(lines=lines), self.assertNumQueries(18):
+                response = self.client.post('/sslcommerz/ipn/', data)
+            self.assertEqual(response.json(), {'status': 'SUCCESS'})
+
+    def test_request_timings(self):
+        booking = self.paid_booking(2)
+        response = self.client.post('/sslcommerz/ipn/', self.callback_data(booking))
+        timing = response['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn('desc="18 queries"', timing)
+        self.assertIn('gateway;dur=', timing) # The validator call
+        self.assertRegex(timing, r'total;dur=[\d.]+$')
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        self.assertIn('tickets_request_db_queries_bucket{view="sslcommerz_ipn",le="20"}', text)
+        self.assertRegex(text, r'tickets_request_phase_seconds_count\{view="sslcommerz_ipn",phase="gateway"\} [1-9]')
+        self.assertRegex(text, r'tickets_payment_outcomes_total\{outcome="applied"\} [1-9]')
+        with override_settings(TICKETS_METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get('/metrics').status_code, 401)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+    def test_duplicate_callbacks_are_absorbed(self):
+        booking = self.paid_booking(3)
+        data = self.callback_data(booking)
+        self.client.post('/sslcommerz/success/', data)
+        duplicates = payments.payment_metrics().get(payments.DUPLICATE, 0)
+        validations = self.gateway.request_count
+
+        # Savepoint, payment event, rollback, release, count duplicate, event status
+        with self.assertNumQueries(6):
+            response = self.client.post('/sslcommerz/ipn/', data)
+        self.assertEqual(response.json(), {'status': 'ALREADY_PAID'})
+        self.client.post('/sslcommerz/ipn/', data)
+
+        event = PaymentEvent.objects.get(tran_id=booking.unique_id)
+        self.assertEqual((event.status, event.duplicate_count), (PaymentEvent.APPLIED, 2))
+        self.assertEqual(payments.payment_metrics()[payments.DUPLICATE], duplicates + 2)
+        self.assertEqual(self.gateway.request_count, validations) # No validator call for a duplicate
+        self.assertEqual(EmailOutbox.objects.filter(booking=booking).count(), 1)
+        self.assertEqual(TicketType.objects.get(pk=self.ticket_types[0].pk).available_quantity, 48)
+
+    def test_totals_and_sales(self):
+        response = self.book(3)
+        booking = Booking.objects.get(unique_id=response.json()['booking_id'])
+        self.assertEqual(booking.total_amount, Decimal('600.00'))
+
+        self.client.post('/sslcommerz/ipn/', self.callback_data(booking))
+        self.client.post('/sslcommerz/ipn/', self.callback_data(self.paid_booking(1)))
+        expected = {self.ticket_types[0].pk: (4, Decimal('400.00')), self.ticket_types[1].pk: (2, Decimal('200.00')),
+                    self.ticket_types[2].pk: (2, Decimal('200.00'))}
+
+        def sold():
+            return {s.ticket_type_id: (s.sold_quantity, s.revenue) for s in TicketSales.objects.filter(sold_quantity__gt=0)}
+
+        self.assertEqual(sold(), expected)
+
+        TicketSales.objects.update(sold_quantity=0, revenue=0)
+        Booking.objects.update(total_amount=0)
+        call_command('rebuild_sales', '--batch-size', '1', stdout=io.StringIO())
+        self.assertEqual(sold(), expected)
+        self.assertEqual(Booking.objects.get(pk=booking.pk).total_amount, Decimal('600.00'))
+
+    def test_forged_callback_is_rejected(self):
+        booking = self.paid_booking(1)
+        other = self.paid_booking(1)
+        data = {**self.callback_data(booking), 'val_id': val_id_for(other.unique_id)}
+        response = self.client.post('/sslcommerz/ipn/', data)
+        self.assertEqual(response.json(), {'status': 'VALIDATION_FAILED'})
+        response = self.client.post('/sslcommerz/ipn/', {**self.callback_data(other), 'amount': '1.00'})
+        self.assertEqual(response.json(), {'status': 'VALIDATION_FAILED'})
+        self.assertFalse(Booking.objects.filter(is_paid=True).exists())
+
+    def test_reconcile_pending_payments(self):
+        bookings = [self.paid_booking(2) for _ in range(3)]
+        with mock.patch.object(self.gateway_client, 'validate', side_effect=GatewayError('down')):
+            for booking in bookings:
+                response = self.client.post('/sslcommerz/ipn/', self.callback_data(booking))
+                self.assertEqual(response.status_code, 503)
+        self.assertEqual(PaymentEvent.objects.filter(status=PaymentEvent.PENDING).count(), 3)
+
+        counts, last_id = payments.reconcile_batch(batch_size=2, concurrency=2, base_url=self.gateway.url)
+        self.assertEqual(counts, {payments.APPLIED: 2})
+        counts, _ = payments.reconcile_batch(last_id, batch_size=2, concurrency=2, base_url=self.gateway.url)
+        self.assertEqual(counts, {payments.APPLIED: 1})
+        self.assertEqual(Booking.objects.filter(is_paid=True).count(), 3)
+        self.assertEqual(payments.reconcile_batch(base_url=self.gateway.url), ({}, None))
+
+
+class HoldTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.ticket_type = TicketType.objects.create(name='Gold', price=Decimal('100.00'), available_quantity=5)
+
+    def reserve(self, quantity):
+        booking = Booking.objects.create(customer_name='Guest', customer_email='guest@example.com')
+        line = BookedTicket.objects.create(booking=booking, ticket_type=self.ticket_type, quantity=quantity)
+        self.assertEqual(reserve_for_booking(booking, [line]), [])
+        return booking
+
+    def stock(self):
+        ticket_type = TicketType.objects.get(pk=self.ticket_type.pk)
+        return ticket_type.available_quantity, ticket_type.held_quantity
+
+    def expire(self):
+        return inventory.expire_holds(now=timezone.now() + timedelta(days=1))
+
+    def test_expired_hold_returns_its_stock_once(self):
+        self.reserve(3)
+        self.assertEqual(self.stock(), (5, 3))
+        self.assertEqual(self.expire(), 1)
+        self.assertEqual(self.expire(), 0)
+        self.assertEqual(self.stock(), (5, 0))
+        self.assertEqual(TicketHold.objects.get().status, TicketHold.EXPIRED)
+
+    def test_payment_after_expiry_takes_unreserved_stock(self):
+        booking = self.reserve(3)
+        self.expire()
+        self.assertEqual(inventory.decrement_for_booking(booking), [])
+        self.assertEqual(self.stock(), (2, 0))
+        self.assertEqual(self.expire(), 0)
+        self.assertEqual(self.stock(), (2, 0))
+
+    def test_expiry_after_payment_leaves_the_consumed_hold(self):
+        booking = self.reserve(3)
+        inventory.decrement_for_booking(booking)
+        self.assertEqual(self.expire(), 0)
+        self.assertEqual(self.stock(), (2, 0))
+        self.assertEqual(TicketHold.objects.get().status, TicketHold.CONSUMED)
+
+    def test_partial_shortage_holds_nothing(self):
+        silver = TicketType.objects.create(name='Silver', price=Decimal('50.00'), available_quantity=1)
+        bronze = TicketType.objects.create(name='Bronze', price=Decimal('20.00'), available_quantity=10)
+        booking = Booking.objects.create(customer_name='Guest', customer_email='guest@example.com')
+        lines = [
+            BookedTicket.objects.create(booking=booking, ticket_type=ticket_type, quantity=quantity)
+            for ticket_type, quantity in ((self.ticket_type, 3), (silver, 2), (bronze, 12))
+        ]
+        self.assertEqual({t.pk for t in reserve_for_booking(booking, lines)}, {silver.pk, bronze.pk})
+        self.assertEqual(
+            list(TicketType.objects.order_by('pk').values_list('available_quantity', 'held_quantity')),
+            [(5, 0), (1, 0), (10, 0)],
+        )
+        self.assertFalse(TicketHold.objects.exists())
+
+    def test_stock_freed_after_a_failed_update_is_held(self):
+        update = QuerySet.update
+        calls = []
+
+        def lost_race(queryset, **kwargs):
+            # The first UPDATE misses the row, as if stock was released just after it ran
+            calls.append(kwargs)
+            return 0 if len(calls) == 1 else update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', lost_race):
+            self.reserve(3)
+        self.assertEqual(self.stock(), (5, 3))
+
+    def test_availability_excludes_held_stock(self):
+        self.reserve(4)
+        # The catalogue and a new booking both see 5 - 4
+        self.assertEqual([t['available_quantity'] for t in self.client.get('/api/ticket-types/').json()], [1])
+        serializer = BookingSerializer(data={
+            'customer_name': 'Ann', 'customer_email': 'ann@example.com',
+            'booked_tickets': [{'ticket_type': self.ticket_type.pk, 'quantity': 2}],
+        })
+        self.assertTrue(serializer.is_valid())
+        with self.assertRaises(ValidationError) as raised:
+            serializer.save()
+        self.assertEqual(raised.exception.detail, {'booked_tickets': ['Only 1 tickets available for Gold.']})
+        self.assertEqual(self.stock(), (5, 4))
+
+        with self.captureOnCommitCallbacks(execute=True): # Bumps the catalogue version
+            self.reserve(1)
+        self.assertEqual(self.client.get('/api/ticket-types/').json(), [])
+
+
+class HoldExpiryRaceTests(TransactionTestCase):
+    def test_expiry_racing_payment_counts_the_stock_once(self):
+        ticket_type = TicketType.objects.create(name='Gold', price=Decimal('100.00'), available_quantity=50)
+        bookings = []
+        for _ in range(10):
+            booking = Booking.objects.create(customer_name='Guest', customer_email='guest@example.com')
+            line = BookedTicket.objects.create(booking=booking, ticket_type=ticket_type, quantity=2)
+            reserve_for_booking(booking, [line])
+            bookings.append(booking)
+        errors = []
+        barrier = threading.Barrier(2)
+
+        def run(work):
+            try:
+                barrier.wait()
+                work()
+            except Exception as e: # Reported below; an exception in a thread would not fail the test
+                errors.append(e)
+            finally:
+                connection.close()
+
+        def retrying(work):
+            # The in-memory SQLite test database reports lock conflicts instead of waiting on them;
+            # each unit of work is one transaction, so it is simply run again
+            while True:
+                try:
+                    return work()
+                except OperationalError as e:
+                    if 'locked' not in str(e):
+                        raise
+                    time.sleep(0.001)
+
+        def pay():
+            for booking in bookings:
+                retrying(lambda: inventory.decrement_for_booking(booking))
+
+        def sweep():
+            for _ in range(10):
+                retrying(lambda: inventory.expire_holds(batch_size=1, now=timezone.now() + timedelta(days=1)))
+
+        threads = [threading.Thread(target=run, args=(work,)) for work in (pay, sweep)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+        # Whichever ran first, every booking was paid for exactly once and nothing is left held
+        ticket_type.refresh_from_db()
+        self.assertEqual((ticket_type.available_quantity, ticket_type.held_quantity), (30, 0))
+        self.assertFalse(TicketHold.objects.filter(status=TicketHold.ACTIVE).exists())
+
+
+class CatalogueCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        ratelimit.reset()
+        self.ticket_type = TicketType.objects.create(name='Gold', price=Decimal('100.00'), available_quantity=10)
+
+    def get(self, **headers):
+        return self.client.get('/api/ticket-types/', **headers)
+
+    def test_conditional_get(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([t['name'] for t in response.json()], ['Gold'])
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertEqual(etag, catalogue.etag_for(catalogue.current_version()))
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+
+        for headers in ({'HTTP_IF_NONE_MATCH': etag}, {'HTTP_IF_MODIFIED_SINCE': last_modified}):
+            with self.subTest(headers=headers), self.assertNumQueries(0):
+                response = self.get(**headers)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.content, b'')
+            self.assertEqual((response['ETag'], response['Last-Modified']), (etag, last_modified))
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH='"catalogue-0"').status_code, 200)
+
+    def test_ticket_type_changes_start_a_new_version(self):
+        etag = self.get()['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ticket_type.price = Decimal('120.00')
+            self.ticket_type.save()
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([t['price'] for t in response.json()], ['120.00'])
+        self.assertNotEqual(response['ETag'], etag)
+
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ticket_type.delete()
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [])
+
+
+class ShardedInventoryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def ticket_type(self, name, stock, shards=0):
+        ticket_type = TicketType.objects.create(name=name, price=Decimal('100.00'), available_quantity=stock)
+        return inventory.reshard(ticket_type.pk, shards) if shards else ticket_type
+
+    def booking(self, *lines):
+        booking = Booking.objects.create(customer_name='Guest', customer_email='guest@example.com')
+        booked_tickets = [
+            BookedTicket.objects.create(booking=booking, ticket_type=ticket_type, quantity=quantity)
+            for ticket_type, quantity in lines
+        ]
+        return booking, booked_tickets
+
+    def shards(self, ticket_type):
+        return list(
+            TicketStockShard.objects.filter(ticket_type=ticket_type).order_by('index')
+            .values_list('available_quantity', 'held_quantity')
+        )
+
+    def test_reservation_spills_over_from_a_short_shard(self):
+        ticket_type = self.ticket_type('Hot', 10, shards=3) # Shards of 4, 3 and 3
+        booking, lines = self.booking((ticket_type, 6))
+        with mock.patch('tickets.inventory.random.randrange', return_value=2):
+            self.assertEqual(reserve_for_booking(booking, lines), [])
+        held = [held for _, held in self.shards(ticket_type)]
+        # Shard 2 cannot cover 6 alone: the fullest shard gives 4, then another one 2
+        self.assertEqual(held[0], 4)
+        self.assertEqual(sum(held), 6)
+        holds = TicketHold.objects.filter(booking=booking)
+        self.assertEqual(sorted(holds.values_list('quantity', flat=True)), [2, 4])
+        self.assertEqual({hold.shard_index for hold in holds if hold.quantity == 4}, {0})
+
+    def test_shortage_midway_rolls_back_every_shard_taken(self):
+        plain, hot, short = self.ticket_type('Plain', 10), self.ticket_type('Hot', 10, shards=2), self.ticket_type('Short', 4, shards=2)
+        booking, lines = self.booking((plain, 2), (hot, 7), (short, 5))
+        result = reserve_for_booking(booking, lines)
+        self.assertEqual([t.pk for t in result], [short.pk])
+        self.assertEqual(result[0].unreserved_quantity, 4) # Reported from the shards
+        # The row hold, the hold spread over Hot's shards and the partial takes on Short are all undone
+        self.assertEqual(TicketType.objects.get(pk=plain.pk).held_quantity, 0)
+        self.assertEqual(self.shards(hot), [(5, 0), (5, 0)])
+        self.assertEqual(self.shards(short), [(2, 0), (2, 0)])
+        self.assertFalse(TicketHold.objects.exists())
+
+    def test_reshard_keeps_totals_with_live_holds(self):
+        ticket_type = self.ticket_type('Hot', 10)
+        booking, lines = self.booking((ticket_type, 3))
+        reserve_for_booking(booking, lines)
+
+        inventory.reshard(ticket_type.pk, 4)
+        shards = self.shards(ticket_type)
+        self.assertEqual((sum(a for a, _ in shards), sum(h for _, h in shards)), (10, 3))
+        self.assertEqual(list(TicketHold.objects.values_list('shard_index', flat=True)), [0])
+
+        inventory.reshard(ticket_type.pk, 2)
+        shards = self.shards(ticket_type)
+        self.assertEqual((sum(a for a, _ in shards), sum(h for _, h in shards)), (10, 3))
+
+        # The hold moved with its stock, so releasing it frees exactly what it reserved
+        inventory.release_for_booking(booking)
+        self.assertEqual(sum(h for _, h in self.shards(ticket_type)), 0)
+        ticket_type = inventory.reshard(ticket_type.pk, 0)
+        self.assertEqual((ticket_type.available_quantity, ticket_type.held_quantity), (10, 0))
+        self.assertFalse(TicketStockShard.objects.exists())
+
+    def test_catalogue_reports_the_shard_sum(self):
+        ticket_type = self.ticket_type('Hot', 10, shards=2)
+        booking, lines = self.booking((ticket_type, 3))
+        reserve_for_booking(booking, lines)
+        # The row's own column is not maintained for sharded types
+        TicketType.objects.filter(pk=ticket_type.pk).update(available_quantity=999)
+        catalogue.bump_version()
+        response = self.client.get('/api/ticket-types/')
+        self.assertEqual([t['available_quantity'] for t in response.json()], [7])
+
+
+@override_settings(SSLCOMMERZ_STORE_ID='test-store', SSLCOMMERZ_STORE_PASSWORD='secret')
+class WaitingRoomTests(TestCase):
+    def setUp(self):
+        self.gated = TicketType.objects.create(name='Front Row', price=Decimal('500.00'), available_quantity=100, admission_rate=2)
+        self.open = TicketType.objects.create(name='General', price=Decimal('100.00'), available_quantity=100)
+        gateway = FakeSSLCommerzServer(store_id='test-store').start()
+        self.addCleanup(gateway.stop)
+        client = SSLCommerzClient(base_url=gateway.url)
+        self.addCleanup(client.close)
+        patcher = mock.patch('tickets.views.get_client', return_value=client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+        ratelimit.reset()
+        self.now = 1_000_000.0
+        patcher = mock.patch('tickets.waiting_room.time.time', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def book(self, ticket_type, token=None, email='customer@example.com'):
+        headers = {'HTTP_X_ADMISSION_TOKEN': token} if token else {}
+        return self.client.post('/api/book-tickets/', {
+            'customer_name': 'Test Customer', 'customer_email': email,
+            'booked_tickets': [{'ticket_type': ticket_type.id, 'quantity': 1}],
+        }, content_type='application/json', **headers)
+
+    def join(self):
+        return self.client.post('/api/waiting-room/', {'ticket_types': [self.gated.id, self.open.id]}, content_type='application/json').json()
+
+    def test_booking_without_admission_is_turned_away_before_any_query(self):
+        self.assertEqual(self.book(self.open).status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.book(self.gated)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json()['ticket_types'], [self.gated.id])
+        self.assertEqual(self.book(self.gated, token='forged').status_code, 429)
+
+    def test_queue_admits_at_the_configured_rate(self):
+        clients = [self.join() for _ in range(5)]
+        # A burst of one second's worth, then 2 per second
+        self.assertEqual([c['position'] for c in clients], [0, 0, 1, 2, 3])
+        self.assertEqual([c['retry_after'] for c in clients], [0, 0, 1, 1, 2])
+        self.assertIsNone(clients[2]['admission_token'])
+
+        self.now += 1
+        polled = [self.client.get('/api/waiting-room/', {'ticket': c['queue_ticket']}) for c in clients[2:]]
+        self.assertEqual([r.json()['position'] for r in polled], [0, 0, 1])
+        self.assertEqual(polled[2]['Retry-After'], '1')
+
+        token = polled[0].json()['admission_token']
+        self.assertEqual(self.book(self.gated, token=token).status_code, 200)
+        self.assertEqual(self.book(self.gated, token=token, email='again@example.com').status_code, 409)
+        # Polling again does not hand out a fresh admission
+        again = self.client.get('/api/waiting-room/', {'ticket': clients[2]['queue_ticket']}).json()['admission_token']
+        self.assertEqual(self.book(self.gated, token=again, email='again@example.com').status_code, 409)
+
+        # An admission survives a rejected booking
+        token = polled[1].json()['admission_token']
+        self.assertEqual(self.book(self.gated, token=token, email='not-an-email').status_code, 400)
+        self.assertEqual(self.book(self.gated, token=token).status_code, 200)
+
+    def test_sold_out_race_releases_the_admission(self):
+        token = self.join()['admission_token']
+        # Stock runs out between validation and reservation
+        with mock.patch('tickets.serializers.reserve_for_booking', return_value=[self.gated]):
+            response = self.book(self.gated, token=token)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'booked_tickets': ['Only 100 tickets available for Front Row.']})
+        self.assertFalse(Booking.objects.exists())
+        # The admission can be used again
+        self.assertEqual(self.book(self.gated, token=token).status_code, 200)
+
+    def test_idle_queue_does_not_bank_admissions(self):
+        self.join()
+        self.now += 3600
+        self.assertEqual([self.join()['position'] for _ in range(4)], [0, 0, 1, 2])
+
+
+@override_settings(RATE_LIMITS={'catalogue:ip': '2/60', 'booking:ip': '', 'booking:email': '1/60', 'booking:global': ''})
+class RateLimitTests(TestCase):
+    def setUp(self):
+        ratelimit.reset()
+
+    def test_token_bucket(self):
+        backend = ratelimit.LocalBackend()
+        self.assertEqual([backend.take('k', 2, 0.5, 0) for _ in range(3)], [0, 0, 2.0])
+        self.assertEqual(backend.take('k', 2, 0.5, 1), 1.0) # Half a token refilled
+        self.assertEqual(backend.take('k', 2, 0.5, 2), 0)
+        self.assertEqual(backend.take('other', 2, 0.5, 2), 0)
+
+    def test_shared_backend_clock(self):
+        backend = ratelimit.CacheBackend()
+        backend.cache.clear()
+        self.assertIs(ratelimit.CacheBackend.clock, time.time)
+        wall, monotonic = 1_700_000_000.0, 5000.0 # Another process's monotonic clock is far behind
+        self.assertEqual([backend.take('k', 2, 0.5, wall) for _ in range(2)], [0, 0])
+        # A timestamp from behind the last one refills nothing, instead of draining the bucket for hours
+        self.assertEqual(backend.take('k', 2, 0.5, monotonic), 2.0)
+        self.assertEqual(backend.take('k', 2, 0.5, wall + 2), 0)
+        # hit() stamps shared buckets with wall-clock time
+        with override_settings(RATE_LIMITS={'test': '1/60'}), mock.patch.object(ratelimit, '_backend', backend):
+            self.assertEqual([ratelimit.hit('test', 'ip') for _ in range(2)], [0, 60])
+        self.assertAlmostEqual(backend.cache.get('tickets:ratelimit:test:ip')[1], time.time(), delta=5)
+        backend.cache.clear()
+
+    def test_catalogue_limit_per_ip(self):
+        for path in ('/api/ticket-types/', '/api/async/ticket-types/'):
+            ratelimit.reset()
+            self.assertEqual([self.client.get(path).status_code for _ in range(3)], [200, 200, 429])
+            response = self.client.get(path)
+            self.assertEqual(response['Retry-After'], '30')
+            self.assertIn('throttled', response.json()['detail'])
+            self.assertEqual(self.client.get(path, REMOTE_ADDR='10.0.0.2').status_code, 200)
+
+    def test_booking_limit_per_email(self):
+        data = {'customer_name': 'Bot', 'customer_email': 'Bot@Example.com', 'booked_tickets': [{'ticket_type': 999, 'quantity': 1}]}
+        self.assertEqual(self.client.post('/api/book-tickets/', data, content_type='application/json').status_code, 400)
+        data['customer_email'] = 'bot@example.com '
+        with self.assertNumQueries(0):
+            response = self.client.post('/api/book-tickets/', data, content_type='application/json', REMOTE_ADDR='10.0.0.3')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(self.client.post('/api/async/book-tickets/', data, content_type='application/json').status_code, 429)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_concurrent_callers_share_one_computation(self):
+        calls = []
+        barrier = threading.Barrier(5)
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'catalogue'
+
+        def caller():
+            barrier.wait()
+            results.append(singleflight.do('key', compute))
+
+        results = []
+        threads = [threading.Thread(target=caller) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['catalogue'] * 5)
+        self.assertEqual(len(calls), 1)
+
+        async def acompute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return 'catalogue'
+
+        async def main():
+            return await asyncio.gather(*(singleflight.ado('key', acompute) for _ in range(5)))
+
+        calls.clear()
+        self.assertEqual(asyncio.run(main()), ['catalogue'] * 5)
+        self.assertEqual(len(calls), 1)
+
+
+class _JSONCapture(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.setFormatter(JSONFormatter())
+        self.entries = []
+
+    def emit(self, record):
+        self.entries.append(json.loads(self.format(record)))
+
+
+class LoggingTests(TestCase):
+    def logger(self, handler):
+        logger = logging.getLogger(f"tickets.test.{uuid.uuid4().hex}")
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        logger.addHandler(handler)
+        return logger
+
+    def test_queued_records_are_written_as_json_with_context(self):
+        capture = _JSONCapture()
+        handler = QueueHandler([capture])
+        self.addCleanup(handler.close)
+        logger = self.logger(handler)
+        with log_context(tran_id='tran-1'):
+            try:
+                raise ValueError('gateway down')
+            except ValueError:
+                logger.exception("Could not validate payment %s", 'tran-1', extra={'booking': 'b-1'})
+        logger.info("Outside the context")
+        handler.listener.stop()
+
+        first, second = capture.entries
+        self.assertEqual(first['message'], 'Could not validate payment tran-1')
+        self.assertEqual((first['level'], first['tran_id'], first['booking']), ('ERROR', 'tran-1', 'b-1'))
+        self.assertIn('ValueError: gateway down', first['exception'])
+        self.assertNotIn('tran_id', second)
+
+    def test_other_handlers_see_the_callers_record(self):
+        handler = QueueHandler([_JSONCapture()])
+        self.addCleanup(handler.close)
+        logger = self.logger(handler)
+        seen = []
+        logger.addHandler(mock.Mock(level=logging.NOTSET, handle=seen.append))
+        try:
+            raise ValueError('gateway down')
+        except ValueError:
+            logger.exception("Failed")
+        record, = seen
+        self.assertIsNotNone(record.exc_info)
+        self.assertFalse(hasattr(record, 'log_context'))
+
+    def test_full_queue_drops_records(self):
+        handler = QueueHandler([_JSONCapture()], maxsize=1)
+        self.addCleanup(handler.close)
+        handler.listener.stop() # Nothing drains the queue
+        dropped = log.dropped_records()
+        logger = self.logger(handler)
+        for n in range(3):
+            logger.info("Record %s", n)
+        self.assertEqual(log.dropped_records() - dropped, 2)
+
+    def test_sampling_keeps_warnings(self):
+        sampling = SamplingFilter({'tickets.requests': 0})
+
+        def record(name, level):
+            return logging.LogRecord(name, level, '', 0, 'message', (), None)
+
+        self.assertFalse(sampling.filter(record('tickets.requests', logging.INFO)))
+        self.assertFalse(sampling.filter(record('tickets.requests.api', logging.DEBUG)))
+        self.assertTrue(sampling.filter(record('tickets.requests', logging.WARNING)))
+        self.assertTrue(sampling.filter(record('tickets.views', logging.INFO)))
+
+    def test_callbacks_log_their_tran_id(self):
+        capture = _JSONCapture()
+        views_logger = logging.getLogger('tickets.views')
+        views_logger.addHandler(capture)
+        self.addCleanup(views_logger.removeHandler, capture)
+        self.client.post('/sslcommerz/fail/', {'tran_id': 'not-a-booking'})
+        self.assertEqual(capture.entries[0]['tran_id'], 'not-a-booking')
+
+    def test_metrics_report_dropped_records(self):
+        response = self.client.get('/metrics')
+        self.assertIn('tickets_log_records_dropped_total ', response.content.decode())
+
+
+@override_settings(AVAILABILITY_PUSH_INTERVAL_SECONDS=0.05)
+class AvailabilityStreamTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.gold = TicketType.objects.create(name='Gold', price=Decimal('100.00'), available_quantity=10)
+        self.silver = TicketType.objects.create(name='Silver', price=Decimal('50.00'), available_quantity=3)
+
+    async def read_event(self, chunks):
+        chunk = await asyncio.wait_for(anext(chunks), 5)
+        chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+        event, data = re.search(r'event: (\w+)\ndata: (.*)\n\n', chunk).groups()
+        return event, json.loads(data)
+
+    async def test_stream(self):
+        response = await self.async_client.get('/api/availability/stream/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = aiter(response.streaming_content)
+        self.assertEqual(await self.read_event(chunks), ('snapshot', {str(self.gold.id): 10, str(self.silver.id): 3}))
+
+    async def test_bursts_are_coalesced_into_one_delta(self):
+        broadcaster = availability.Broadcaster()
+        chunks = availability.stream(broadcaster)
+        self.assertEqual((await self.read_event(chunks))[0], 'snapshot')
+
+        # Two changes within one interval arrive as one update with only what changed
+        await TicketType.objects.filter(pk=self.gold.pk).aupdate(held_quantity=4)
+        await sync_to_async(catalogue.bump_version)()
+        await TicketType.objects.filter(pk=self.silver.pk).aupdate(held_quantity=3)
+        await sync_to_async(catalogue.bump_version)()
+        self.assertEqual(await self.read_event(chunks), ('availability', {str(self.gold.id): 6, str(self.silver.id): 0}))
+
+        await chunks.aclose() # The client went away
+        self.assertEqual(broadcaster.subscribers, set())
+        await asyncio.sleep(0.1)
+        self.assertTrue(broadcaster._watcher.done()) # Stops with the last client
+
+    async def test_watcher_does_not_inherit_the_request_context(self):
+        broadcaster = availability.Broadcaster()
+        refresh, routings = broadcaster.refresh, []
+
+        async def recording_refresh():
+            routings.append(_routing.get())
+            return await refresh()
+
+        token = _routing.set(_Routing()) # As in the request that starts the watcher
+        try:
+            with override_settings(AVAILABILITY_PUSH_INTERVAL_SECONDS=0.01), \
+                 mock.patch.object(broadcaster, 'refresh', recording_refresh):
+                subscriber, _ = await broadcaster.subscribe()
+                await asyncio.sleep(0.1)
+                broadcaster.unsubscribe(subscriber)
+                await asyncio.sleep(0.05)
+        finally:
+            _routing.reset(token)
+        self.assertIsNotNone(routings[0]) # The first refresh runs in the request
+        self.assertGreater(len(routings), 1)
+        self.assertEqual(set(routings[1:]), {None})
+
+    def test_needs_asgi(self):
+        self.assertEqual(self.client.get('/api/availability/stream/').status_code, 503)
+
+
+@override_settings(CHECKIN_TOKEN='gate-token')
+class CheckInTests(TestCase):
+    def setUp(self):
+        ticket_type = TicketType.objects.create(name='Gold', price=Decimal('100.00'), available_quantity=10)
+        self.paid = self.booking(ticket_type, is_paid=True)
+        self.unpaid = self.booking(ticket_type, is_paid=False)
+        checkin.reset_index()
+        self.addCleanup(checkin.reset_index)
+
+    def booking(self, ticket_type, is_paid):
+        booking = Booking.objects.create(customer_name='Guest', customer_email='guest@example.com', is_paid=is_paid)
+        BookedTicket.objects.create(booking=booking, ticket_type=ticket_type, quantity=2)
+        return booking
+
+    def scan(self, code, token='gate-token'):
+        return self.client.post('/api/checkin/', {'code': str(code), 'gate': 'north'}, content_type='application/json',
+                                HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    def test_scan(self):
+        self.assertEqual(self.scan(self.paid.unique_id, token='wrong').status_code, 401)
+        response = self.scan(self.paid.unique_id)
+        self.assertEqual((response.status_code, response.json()), (200, {'status': 'admitted', 'tickets': 2, 'entry': 1}))
+        # Served from the index: savepoint, insert, release, and no booking query
+        with self.assertNumQueries(3):
+            self.assertEqual(self.scan(self.paid.unique_id).json()['entry'], 2)
+        self.assertEqual(self.scan(self.paid.unique_id).status_code, 409)
+        self.assertEqual(self.scan(self.unpaid.unique_id).status_code, 402)
+        self.assertEqual(self.scan(uuid.uuid4()).status_code, 404)
+        self.assertEqual(self.scan('not a code').status_code, 404)
+        self.assertEqual(
+            list(CheckIn.objects.order_by('pk').values_list('status', 'entry_number')),
+            [('admitted', 1), ('admitted', 2), ('already_used', None), ('unpaid', None), ('unknown', None), ('unknown', None)],
+        )
+
+    def test_bookings_paid_after_the_index_loaded(self):
+        index = checkin.get_index()
+        Booking.objects.filter(pk=self.unpaid.pk).update(is_paid=True, paid_at=timezone.now())
+        index.refresh()
+        self.assertEqual(index.lookup(self.unpaid.unique_id), self.unpaid.pk)
+        # Marked paid without paid_at (e.g. from the admin): found on the miss
+        late = self.booking(TicketType.objects.get(), is_paid=True)
+        self.assertIsNone(index.lookup(late.unique_id))
+        self.assertEqual(self.scan(late.unique_id).json()['status'], 'admitted')
+
+    def test_entries_admitted_through_another_process(self):
+        self.assertEqual(self.scan(self.paid.unique_id).status_code, 200)
+        CheckIn.objects.create(booking=self.paid, code=str(self.paid.unique_id), status=CheckIn.ADMITTED, entry_number=2)
+        self.assertEqual(self.scan(self.paid.unique_id).json()['status'], 'already_used')
+        self.assertEqual(CheckIn.objects.filter(status=CheckIn.ADMITTED).count(), 2)
+
+    def test_manifest(self):
+        self.scan(self.paid.unique_id)
+        response = self.client.get('/api/checkin/manifest/', HTTP_AUTHORIZATION='Bearer gate-token')
+        generated_at, records = checkin.read_manifest(response.content)
+        self.assertEqual(records, {self.paid.unique_id: (2, 1)})
+        self.assertEqual(len(response.content), checkin.MANIFEST_HEADER.size + checkin.MANIFEST_RECORD.size)
+
+
+class CheckInArchiveTests(TransactionTestCase):
+    """
+    Deleting a booking only fails its CheckIn inserts at commit (the foreign key is deferred), hence TransactionTestCase.
+    """
+    def setUp(self):
+        ticket_type = TicketType.objects.create(name='Gold', price=Decimal('100.00'), available_quantity=10)
+        self.booking = Booking.objects.create(
+            customer_name='Guest', customer_email='guest@example.com', is_paid=True, status=Booking.PAID,
+        )
+        BookedTicket.objects.create(booking=self.booking, ticket_type=ticket_type, quantity=2)
+        Booking.objects.filter(pk=self.booking.pk).update(booking_time=timezone.now() - timedelta(days=365))
+        checkin.reset_index()
+        self.addCleanup(checkin.reset_index)
+
+    def test_scan_of_an_archived_booking(self):
+        index = checkin.get_index()
+        self.assertEqual(index.lookup(self.booking.unique_id), self.booking.pk)
+        with override_settings(BOOKING_ARCHIVE_AFTER_DAYS=180):
+            self.assertEqual(lifecycle.archive_finished(), 1)
+        self.assertEqual(checkin.scan(self.booking.unique_id), (CheckIn.UNKNOWN, {}))
+        self.assertIsNone(index.lookup(self.booking.unique_id))
+        self.assertEqual(checkin.scan(self.booking.unique_id), (CheckIn.UNKNOWN, {}))
+        self.assertEqual(list(CheckIn.objects.values_list('status', 'booking')), [('unknown', None)] * 2)
+
+
+class BookingLifecycleTests(TestCase):
+    def setUp(self):
+        self.ticket_type = TicketType.objects.create(name='Gold', price=Decimal('100.00'), available_quantity=10)
+
+    def booking(self, status=Booking.PENDING, days_old=0):
+        booking = Booking.objects.create(
+            customer_name='Guest', customer_email='guest@example.com', status=status, is_paid=status == Booking.PAID,
+        )
+        lines = [BookedTicket.objects.create(booking=booking, ticket_type=self.ticket_type, quantity=2)]
+        if status == Booking.PENDING:
+            reserve_for_booking(booking, lines)
+        Booking.objects.filter(pk=booking.pk).update(booking_time=timezone.now() - timedelta(days=days_old))
+        return booking
+
+    def status_of(self, booking):
+        return Booking.objects.get(pk=booking.pk).status
+
+    def test_fail_and_cancel_callbacks(self):
+        failed, cancelled, paid = self.booking(), self.booking(), self.booking(Booking.PAID)
+        for booking, path in ((failed, 'fail'), (cancelled, 'cancel'), (paid, 'fail')):
+            self.client.post(f'/sslcommerz/{path}/', {'tran_id': str(booking.unique_id)})
+        self.assertEqual([self.status_of(b) for b in (failed, cancelled, paid)], ['failed', 'cancelled', 'paid'])
+        self.assertEqual(TicketType.objects.get().held_quantity, 0)
+
+    def test_unsuccessful_ipn_closes_the_booking(self):
+        failed, cancelled, unattempted = self.booking(), self.booking(), self.booking()
+        for booking, ipn_status in ((failed, 'FAILED'), (cancelled, 'CANCELLED'), (unattempted, 'UNATTEMPTED')):
+            response = self.client.post('/sslcommerz/ipn/', {'tran_id': str(booking.unique_id), 'status': ipn_status})
+            self.assertEqual(response.json(), {'status': 'UNSUCCESSFUL_PAYMENT'})
+        self.assertEqual([self.status_of(b) for b in (failed, cancelled, unattempted)], ['failed', 'cancelled', 'pending'])
+        # Only the unattempted booking still holds stock
+        self.assertEqual(TicketType.objects.get().held_quantity, 2)
+        self.assertEqual(TicketHold.objects.filter(booking=failed, status=TicketHold.RELEASED).count(), 1)
+
+    def test_reaper_expires_stale_pending_bookings_in_batches(self):
+        stale = [self.booking(days_old=1) for _ in range(3)]
+        recent, paid = self.booking(), self.booking(Booking.PAID, days_old=1)
+        self.assertEqual(lifecycle.reap_pending(batch_size=2), 2)
+        call_command('reap_bookings', batch_size=2, stdout=io.StringIO())
+        self.assertEqual([self.status_of(b) for b in stale], ['expired'] * 3)
+        self.assertEqual([self.status_of(b) for b in (recent, paid)], ['pending', 'paid'])
+        # Only the recent booking still holds stock
+        self.assertEqual(TicketType.objects.get().held_quantity, 2)
+        self.assertEqual(TicketHold.objects.filter(status=TicketHold.EXPIRED).count(), 3)
+
+    def test_archive_moves_old_finished_bookings(self):
+        old_paid, old_failed = self.booking(Booking.PAID, days_old=365), self.booking(Booking.FAILED, days_old=365)
+        old_pending, new_paid = self.booking(days_old=365), self.booking(Booking.PAID)
+        with override_settings(BOOKING_ARCHIVE_AFTER_DAYS=180):
+            self.assertEqual(lifecycle.archive_finished(batch_size=1), 1)
+            self.assertEqual(lifecycle.archive_finished(), 1)
+        self.assertEqual(set(Booking.objects.values_list('pk', flat=True)), {old_pending.pk, new_paid.pk})
+        archived = ArchivedBooking.objects.get(unique_id=old_paid.unique_id)
+        self.assertEqual(archived.lines, [{'ticket_type_id': self.ticket_type.pk, 'ticket_type': 'Gold', 'quantity': 2, 'subtotal': '200.00'}])
+        self.assertTrue(ArchivedBooking.objects.filter(unique_id=old_failed.unique_id, status='failed').exists())
+        # Sales rebuilt from the tables still count the archived paid booking
+        rebuild_ticket_sales()
+        self.assertEqual(TicketSales.objects.get().sold_quantity, 4)
+
+
+    def test_sales_rebuild_adds_what_changed_after_its_snapshot(self):
+        for booking in (self.booking(Booking.PAID, days_old=365), self.booking(Booking.PAID)):
+            record_sale(booking)
+        late = self.booking()
+        TicketSales.objects.update(sold_quantity=100) # Drifted
+        read_snapshot = sales._read_snapshot
+
+        @contextmanager
+        def snapshot_then_changes():
+            with read_snapshot():
+                yield
+            # Committed by others after the rebuild read its snapshot, before it writes
+            lifecycle.archive_finished()
+            Booking.objects.filter(pk=late.pk).update(is_paid=True, status=Booking.PAID)
+            record_sale(late)
+
+        with mock.patch('tickets.sales._read_snapshot', snapshot_then_changes):
+            rebuild_ticket_sales()
+        # The two bookings of the snapshot (one archived since, but counted once) plus the late payment
+        self.assertEqual(TicketSales.objects.get().sold_quantity, 6)
+        self.assertEqual(TicketSales.objects.get().revenue, Decimal('600.00'))
+        rebuild_ticket_sales()
+        self.assertEqual(TicketSales.objects.get().sold_quantity, 6)
+
+    def test_sales_snapshot_joins_an_outer_transaction(self):
+        # On PostgreSQL, SET TRANSACTION would fail in the savepoint of an outer transaction
+        with transaction.atomic(), mock.patch.object(connection, 'vendor', 'postgresql'):
+            with CaptureQueriesContext(connection) as queries, sales._read_snapshot():
+                pass
+        self.assertFalse([query for query in queries if 'SET TRANSACTION' in query['sql']])
+
+
+@override_settings(OUTBOX_LEASE_SECONDS=300, OUTBOX_RETRY_BASE_SECONDS=30, OUTBOX_MAX_ATTEMPTS=3, TICKET_ARTIFACT_WORKERS=0)
+class OutboxTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(TICKET_ARTIFACT_DIR=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        booking = Booking.objects.create(customer_name='Guest', customer_email='guest@example.com', is_paid=True)
+        ticket_type = TicketType.objects.create(name='Gold', price=Decimal('100.00'), available_quantity=10)
+        BookedTicket.objects.create(booking=booking, ticket_type=ticket_type, quantity=1)
+        self.entry = outbox.enqueue_confirmation_email(booking)
+        self.now = timezone.now()
+
+    def at(self, seconds):
+        """
+        Runs the outbox `seconds` from the start of the test.
+        """
+        return mock.patch('tickets.outbox.timezone.now', return_value=self.now + timedelta(seconds=seconds))
+
+    def smtp_down(self):
+        return mock.patch('tickets.outbox.get_connection', return_value=mock.Mock(open=mock.Mock(side_effect=OSError('refused'))))
+
+    def test_lease_expiry_makes_a_claimed_email_claimable_again(self):
+        with self.at(1):
+            self.assertEqual([e.pk for e in outbox.claim_batch(10)], [self.entry.pk])
+        with self.at(2):
+            self.assertEqual(outbox.claim_batch(10), []) # Leased to the first worker
+        with self.at(302):
+            self.assertEqual([e.attempts for e in outbox.claim_batch(10)], [2])
+
+    def test_smtp_failures_back_off_then_dead_letter(self):
+        elapsed = 1
+        for attempt in range(1, 4):
+            with self.smtp_down(), self.at(elapsed):
+                self.assertEqual(outbox.deliver_batch(), (0, 1))
+            entry = EmailOutbox.objects.get()
+            self.assertEqual((entry.attempts, entry.last_error), (attempt, 'refused'))
+            if attempt < 3:
+                # Base delay doubling per attempt, with jitter of +/- 50%
+                delay = (entry.next_attempt_at - self.now).total_seconds() - elapsed
+                self.assertGreaterEqual(delay, 30 * 2 ** (attempt - 1) * 0.5)
+                self.assertLessEqual(delay, 30 * 2 ** (attempt - 1) * 1.5)
+                self.assertEqual(entry.status, EmailOutbox.PENDING)
+                with self.at(elapsed + delay - 1):
+                    self.assertEqual(outbox.claim_batch(10), []) # Not due yet
+                elapsed += delay + 1
+        self.assertEqual(entry.status, EmailOutbox.DEAD)
+        with self.at(elapsed + 86400):
+            self.assertEqual(outbox.deliver_batch(), (0, 0))
+        self.assertEqual(mail.outbox, [])
+
+    def test_delivered_email_is_sent_once(self):
+        with self.at(1):
+            self.assertEqual(outbox.deliver_batch(), (1, 0))
+        with self.at(86400): # Long after the lease
+            self.assertEqual(outbox.deliver_batch(), (0, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['guest@example.com'])
+        self.assertEqual(len(mail.outbox[0].attachments), 1) # The PDF ticket
+        entry = EmailOutbox.objects.get()
+        self.assertEqual((entry.status, entry.attempts), (EmailOutbox.SENT, 1))
+
+
+class TicketArtifactTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(TICKET_ARTIFACT_DIR=directory.name, TICKET_ARTIFACT_WORKERS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.booking = Booking.objects.create(customer_name='Guest', customer_email='guest@example.com', is_paid=True)
+        self.lines = [
+            BookedTicket.objects.create(
+                booking=self.booking, quantity=2,
+                ticket_type=TicketType.objects.create(name=name, price=Decimal('100.00'), available_quantity=10),
+            )
+            for name in ('Gold', 'Silver')
+        ]
+
+    def url(self, line, kind='pdf'):
+        return f"/api/bookings/{self.booking.unique_id}/tickets/{line.pk}.{kind}"
+
+    def test_download(self):
+        response = self.client.get(self.url(self.lines[0]))
+        self.assertEqual((response.status_code, response['Content-Type']), (200, 'application/pdf'))
+        self.assertTrue(response.content.startswith(b'%PDF-'))
+        # Downloads are served from the cache, or not at all when the client's copy is current
+        with mock.patch('tickets.artifacts.render') as render:
+            again = self.client.get(self.url(self.lines[0]))
+            not_modified = self.client.get(self.url(self.lines[0]), HTTP_IF_NONE_MATCH=response['ETag'])
+        render.assert_not_called()
+        self.assertEqual(again.content, response.content)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertIn('max-age', response['Cache-Control'])
+
+        png = self.client.get(self.url(self.lines[1], 'png'))
+        self.assertEqual((png.status_code, png['Content-Type']), (200, 'image/png'))
+        self.assertEqual(self.client.get(self.url(self.lines[0], 'gif')).status_code, 404)
+        Booking.objects.filter(pk=self.booking.pk).update(is_paid=False)
+        self.assertEqual(self.client.get(self.url(self.lines[0])).status_code, 404)
+
+    def test_confirmation_email_attaches_tickets(self):
+        outbox.enqueue_confirmation_email(self.booking)
+        self.assertEqual(outbox.deliver_batch(), (1, 0))
+        attachments = mail.outbox[0].attachments
+        self.assertEqual([a[2] for a in attachments], ['application/pdf', 'application/pdf'])
+        self.assertEqual(len({a[1] for a in attachments}), 2)
+
+    def test_least_recently_used_are_evicted(self):
+        store = artifacts.DiskStore(artifacts.get_store().directory, max_bytes=250)
+        for key, mtime in (('aa1', 1000), ('bb2', 2000)):
+            store.write(key, 'pdf', b'x' * 100)
+            os.utime(store.path(key, 'pdf'), (mtime, mtime))
+        store.read('aa1', 'pdf') # Now the most recently used
+        store.write('cc3', 'pdf', b'x' * 100)
+        self.assertEqual([store.read(key, 'pdf') is not None for key in ('aa1', 'bb2', 'cc3')], [True, False, True])
+
+    def test_worker_pool(self):
+        jobs = [(kind, artifacts.ticket_fields(line)) for line in self.lines for kind in ('pdf', 'png')]
+        with override_settings(TICKET_ARTIFACT_WORKERS=2):
+            self.addCleanup(artifacts.shutdown_pool)
+            rendered = artifacts.render_many(jobs)
+        self.assertEqual(len(rendered), 3) # The two lines share the booking's QR code
+        self.assertEqual(rendered[artifacts.artifact_key(*jobs[0])], artifacts.render(*jobs[0]))
+
+
+class SerializerFastPathTests(TestCase):
+    """
+    The fast paths must give exactly what the DRF serializers give, errors included.
+    """
+    class FullBookingSerializer(BookingSerializer):
+        fast_path = False
+
+    def setUp(self):
+        self.ticket_types = [
+            TicketType.objects.create(name=f"Type {i}", price=Decimal(price), available_quantity=10, held_quantity=i)
+            for i, price in enumerate(('100.00', '49.5', '0'))
+        ]
+
+    def test_bookings_validate_like_the_serializer(self):
+        first, second, _ = (t.pk for t in self.ticket_types)
+        valid = {'customer_name': ' Ann ', 'customer_email': 'ann@example.com', 'booked_tickets': [{'ticket_type': first, 'quantity': 2}]}
+        payloads = [
+            valid,
+            {**valid, 'booked_tickets': [{'ticket_type': str(first)}, {'ticket_type': second, 'quantity': 0, 'subtotal': 1}]},
+            {**valid, 'booked_tickets': []},
+            {**valid, 'is_paid': True, 'status': 'paid'},
+            {**valid, 'customer_name': '   '},
+            {**valid, 'customer_name': 'x' * 101},
+            {**valid, 'customer_name': 'Ann\x00'},
+            {**valid, 'customer_name': 42},
+            {**valid, 'customer_email': 'not-an-email'},
+            {'customer_name': 'Ann'},
+            {**valid, 'booked_tickets': 'tickets'},
+            {**valid, 'booked_tickets': [{'ticket_type': 99999}]},
+            {**valid, 'booked_tickets': [{'ticket_type': 'abc'}, {'ticket_type': True}, {'ticket_type': '²'}]},
+            {**valid, 'booked_tickets': [{'ticket_type': first, 'quantity': -1}, {'ticket_type': first, 'quantity': '3'}]},
+            {**valid, 'booked_tickets': [{'ticket_type': first, 'quantity': 2.0}, {'ticket_type': first, 'quantity': None}]},
+            {**valid, 'booked_tickets': [['not', 'a', 'line']]},
+            [valid],
+        ]
+        for payload in payloads:
+            with self.subTest(payload=payload):
+                full, fast = self.FullBookingSerializer(data=payload), BookingSerializer(data=payload)
+                self.assertEqual(fast.is_valid(), full.is_valid())
+                self.assertEqual(fast.errors, full.errors)
+                if not full.errors:
+                    self.assertEqual(fast.validated_data, full.validated_data)
+
+    def test_valid_booking_skips_field_validation(self):
+        serializer = BookingSerializer(data={
+            'customer_name': 'Ann', 'customer_email': 'ann@example.com',
+            'booked_tickets': [{'ticket_type': t.pk, 'quantity': 1} for t in self.ticket_types],
+        })
+        with mock.patch.object(BookingSerializer, 'to_internal_value', side_effect=AssertionError), self.assertNumQueries(1):
+            self.assertTrue(serializer.is_valid())
+
+    def test_catalogue_matches_the_serializer(self):
+        self.assertEqual(ticket_type_data(self.ticket_types), TicketTypeSerializer(self.ticket_types, many=True).data)
+
+
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch('tickets.db_router.connections', mock.Mock(settings={'default': {}, 'replica': {}}))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.router = PrimaryReplicaRouter()
+
+    def route(self, method, path, write=False, cookies=None):
+        """
+        Runs a request through the middleware; returns (databases read from, response).
+        """
+        request = getattr(RequestFactory(), method)(path)
+        request.COOKIES.update(cookies or {})
+        request.resolver_match = match = resolve(path)
+        reads = []
+
+        def view(request):
+            middleware.process_view(request, match.func, (), {})
+            reads.append(self.router.db_for_read(TicketType))
+            if write:
+                self.assertEqual(self.router.db_for_write(Booking), 'default')
+                reads.append(self.router.db_for_read(TicketType))
+            return HttpResponse()
+
+        middleware = ReplicaRoutingMiddleware(view)
+        return reads, middleware(request)
+
+    def test_routing(self):
+        self.assertEqual(self.route('get', '/api/ticket-types/')[0], ['replica'])
+        self.assertEqual(self.route('get', '/api/async/ticket-types/')[0], ['replica'])
+        self.assertEqual(self.route('get', '/admin/tickets/booking/')[0], ['replica'])
+        self.assertEqual(self.route('get', '/')[0], ['default'])
+        self.assertEqual(self.route('post', '/api/book-tickets/')[0], ['default'])
+        self.assertEqual(self.router.db_for_read(TicketType), 'default') # Outside requests
+
+    def test_reads_stick_to_the_primary_after_a_write(self):
+        reads, response = self.route('get', '/admin/tickets/booking/', write=True)
+        self.assertEqual(reads, ['replica', 'default'])
+        self.assertEqual(response.cookies[PRIMARY_COOKIE]['max-age'], 10)
+        reads, _ = self.route('get', '/api/ticket-types/', cookies={PRIMARY_COOKIE: '1'})
+        self.assertEqual(reads, ['default'])
+        self.assertNotIn(PRIMARY_COOKIE, self.route('get', '/api/ticket-types/')[1].cookies)
+
+    def test_catalogue_cache_is_built_from_the_primary(self):
+        routing = _Routing()
+        routing.replica_reads = True
+        token = _routing.set(routing)
+        try:
+            self.assertEqual(self.router.db_for_read(TicketType), 'replica')
+            self.assertEqual(_catalogue_queryset().db, 'default')
+        finally:
+            _routing.reset(token)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Checks SQLite query plans')
+class QueryPlanTests(TestCase):
+    """
+    The hot queries must be served from an index. A plan line such as "SCAN tickets_booking"
+    (with no USING INDEX) means a full table scan, usually because a query no longer matches
+    the index it was written for.
+    """
+    FULL_SCAN = re.compile(r'\bSCAN \w+$')
+
+    def hot_queries(self):
+        now = timezone.now()
+        tran_id = str(uuid.uuid4())
+        return {
+            'catalogue': _catalogue_queryset(),
+            'unpaid bookings by age': Booking.objects.filter(is_paid=False).order_by('booking_time'),
+            'admin: paid bookings': Booking.objects.filter(is_paid=True).order_by('-booking_time', '-pk')[:100],
+            'admin: bookings by date': Booking.objects.filter(booking_time__gte=now - timedelta(days=7)),
+            'admin: booking by email': Booking.objects.filter(customer_email='customer@example.com'),
+            'admin: booking by transaction': Booking.objects.filter(transaction_id='VAL-1'),
+            'booking by tran_id': Booking.objects.filter(unique_id=tran_id, is_paid=False),
+            'booked lines': BookedTicket.objects.filter(booking_id=1).select_related('ticket_type'),
+            'active holds of booking': TicketHold.objects.filter(booking_id=1, status=TicketHold.ACTIVE),
+            'expired holds': TicketHold.objects.filter(status=TicketHold.ACTIVE, expires_at__lte=now).order_by('expires_at'),
+            'due emails': EmailOutbox.objects.filter(status=EmailOutbox.PENDING, next_attempt_at__lte=now).order_by('next_attempt_at'),
+            'admin: older page': Booking.objects.filter(_older_than(now, 1)).order_by('-booking_time', '-pk')[:100],
+            'admin: search': BookingAdmin(Booking, site).get_search_results(None, Booking.objects.all(), 'customer@')[0],
+            'payment event': PaymentEvent.objects.filter(tran_id=tran_id, val_id='VAL-1'),
+            'pending payment events': PaymentEvent.objects.filter(status=PaymentEvent.PENDING, pk__gt=0).order_by('pk'),
+            'reaper: stale pending bookings': Booking.objects.filter(status=Booking.PENDING, is_paid=False, booking_time__lt=now).order_by('booking_time'),
+            'archive: old finished bookings': Booking.objects.filter(status__in=Booking.FINISHED, booking_time__lt=now).order_by('booking_time'),
+            'check-in: bookings paid since': Booking.objects.filter(is_paid=True, paid_at__gte=now),
+            'check-in: entries of bookings': CheckIn.objects.filter(status=CheckIn.ADMITTED, booking_id__in=[1, 2]),
+        }
+
+    def test_hot_queries_use_indexes(self):
+        for name, queryset in self.hot_queries().items():
+            plan = queryset.explain()
+            with self.subTest(name):
+                full_scans = [line for line in plan.splitlines() if self.FULL_SCAN.search(line)]
+                self.assertFalse(full_scans, f"{name} scans a whole table:\n{plan}")
+
+
+class BookingAdminTests(TestCase):
+    def setUp(self):
+        admin_user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.client.force_login(admin_user)
+        ticket_type = TicketType.objects.create(name='Gold', price=Decimal('100.00'), available_quantity=50)
+        self.bookings = []
+        for i in range(5):
+            booking = Booking.objects.create(customer_name=f"Customer {i}", customer_email=f"customer{i}@example.com")
+            BookedTicket.objects.create(booking=booking, ticket_type=ticket_type, quantity=i + 1)
+            self.bookings.append(booking)
+        self.bookings.reverse() # Newest first
+
+    def changelist(self, query=''):
+        response = self.client.get(f'/admin/tickets/booking/{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.context['cl']
+
+    @mock.patch.object(BookingAdmin, 'list_per_page', 2)
+    def test_keyset_pages(self):
+        cl = self.changelist()
+        pages = [list(cl.result_list)]
+        while cl.older_url:
+            cl = self.changelist(cl.older_url)
+            pages.append(list(cl.result_list))
+        self.assertEqual([b for page in pages for b in page], self.bookings)
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual(pages[0][0].ticket_count, 5)
+
+        cl = self.changelist(cl.newer_url)
+        self.assertEqual(list(cl.result_list), self.bookings[2:4])
+        cl = self.changelist(cl.newer_url)
+        self.assertEqual(list(cl.result_list), self.bookings[:2])
+        self.assertFalse(cl.newer_url)
+
+    def test_ticket_type_edit_keeps_concurrent_holds(self):
+        model_admin = site._registry[TicketType]
+        request = RequestFactory().post('/')
+        ticket_type = TicketType.objects.get()
+        # A hold is placed while the change form is open
+        TicketType.objects.filter(pk=ticket_type.pk).update(held_quantity=F('held_quantity') + 3)
+        ticket_type.price, ticket_type.available_quantity = Decimal('120.00'), 60
+        model_admin.save_model(request, ticket_type, mock.Mock(changed_data=['price', 'available_quantity']), True)
+        ticket_type.refresh_from_db()
+        self.assertEqual((ticket_type.price, ticket_type.available_quantity, ticket_type.held_quantity), (Decimal('120.00'), 60, 3))
+
+        # Sharded: the row's stock column is left alone, and the admin is told why
+        inventory.reshard(ticket_type.pk, 2)
+        ticket_type.available_quantity = 999
+        with mock.patch.object(model_admin, 'message_user') as message_user:
+            model_admin.save_model(request, ticket_type, mock.Mock(changed_data=['available_quantity']), True)
+        message_user.assert_called_once()
+        self.assertEqual(TicketType.objects.get().available_quantity, 60)
+        self.assertEqual(TicketStockShard.objects.aggregate(total=Sum('available_quantity'))['total'], 60)
+
+    def test_payment_state_is_read_only(self):
+        booking = self.bookings[0]
+        response = self.client.get(f'/admin/tickets/booking/{booking.pk}/change/')
+        self.assertEqual(response.status_code, 200)
+        fields = response.context['adminform'].form.fields
+        self.assertNotIn('is_paid', fields)
+        self.assertNotIn('status', fields)
+        self.assertIn('customer_name', fields)
+
+    def test_search(self):
+        cl = self.changelist('?q=customer3')
+        self.assertEqual([b.customer_name for b in cl.result_list], ['Customer 3'])
+        cl = self.changelist(f'?q={self.bookings[0].unique_id}')
+        self.assertEqual(list(cl.result_list), self.bookings[:1])
+        self.assertEqual((cl.result_count, cl.result_count_exact), (1, True))
+
+    @mock.patch.object(BookingAdmin, 'count_limit', 3)
+    def test_count_is_capped(self):
+        cl = self.changelist()
+        self.assertEqual((cl.result_count, cl.result_count_exact), (3, False))
+        self.assertEqual(len(cl.result_list), 5)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        gold = TicketType.objects.create(name='Gold', price=Decimal('100.00'), available_quantity=50)
+        silver = TicketType.objects.create(name='Silver', price=Decimal('50.00'), available_quantity=50)
+        self.paid = Booking.objects.create(customer_name='Paid', customer_email='paid@example.com', is_paid=True, transaction_id='VAL-1')
+        self.unpaid = Booking.objects.create(customer_name='Unpaid', customer_email='unpaid@example.com')
+        BookedTicket.objects.create(booking=self.paid, ticket_type=gold, quantity=2)
+        BookedTicket.objects.create(booking=self.paid, ticket_type=silver, quantity=1)
+        BookedTicket.objects.create(booking=self.unpaid, ticket_type=silver, quantity=3)
+
+    def get(self, query=''):
+        return self.client.get(f'/api/export/bookings/{query}')
+
+    def test_staff_only(self):
+        self.assertEqual(self.get().status_code, 302) # To the admin login
+        user = get_user_model().objects.create_user('customer', 'customer@example.com', 'secret')
+        self.client.force_login(user)
+        self.assertEqual(self.get().status_code, 302)
+
+    def test_csv_and_ndjson(self):
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@example.com', 'secret'))
+        response = self.get()
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(
+            [(r['booking_id'], r['ticket_type'], r['quantity'], r['subtotal']) for r in rows],
+            [(str(self.paid.unique_id), 'Gold', '2', '200.00'), (str(self.paid.unique_id), 'Silver', '1', '50.00'),
+             (str(self.unpaid.unique_id), 'Silver', '3', '150.00')],
+        )
+
+        response = self.get('?format=ndjson&paid=false')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(r['customer_email'], r['is_paid'], r['subtotal']) for r in rows], [('unpaid@example.com', False, '150.00')])
+
+        tomorrow = (timezone.now() + timedelta(days=1)).date().isoformat()
+        self.assertEqual(b''.join(self.get(f'?format=ndjson&since={tomorrow}').streaming_content), b'')
+        self.assertEqual(self.get('?format=xml').status_code, 400)
+        self.assertEqual(self.get('?since=yesterday').status_code, 400)
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('export_bookings', '--paid', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 3) # Header and the paid booking's two lines
+        self.assertTrue(lines[0].startswith('booking_id,customer_name'))
+
+
+@override_settings(SSLCOMMERZ_STORE_ID='test-store', SSLCOMMERZ_STORE_PASSWORD='secret')
+class AsyncBookingTests(TransactionTestCase):
+    """
+    The async view saves bookings from a worker thread with its own connection, hence TransactionTestCase.
+    """
+    def setUp(self):
+        self.ticket_type = TicketType.objects.create(name='Front Row', price=Decimal('500.00'), available_quantity=10, admission_rate=2)
+        self.gateway = FakeSSLCommerzServer(store_id='test-store').start()
+        self.addCleanup(self.gateway.stop)
+        cache.clear()
+        ratelimit.reset()
+
+    async def admission(self):
+        response = await self.async_client.post('/api/waiting-room/', {'ticket_types': [self.ticket_type.id]}, content_type='application/json')
+        return response.json()['admission_token']
+
+    async def book(self, client, token, email='customer@example.com'):
+        with mock.patch('tickets.async_views.get_async_client', return_value=client):
+            return await self.async_client.post('/api/async/book-tickets/', {
+                'customer_name': 'Test Customer', 'customer_email': email,
+                'booked_tickets': [{'ticket_type': self.ticket_type.id, 'quantity': 3}],
+            }, content_type='application/json', headers={waiting_room.TOKEN_HEADER: token})
+
+    async def test_booking(self):
+        client = AsyncSSLCommerzClient(base_url=self.gateway.url)
+        try:
+            response = await self.book(client, await self.admission())
+        finally:
+            await client.close()
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body['gateway_url'], f"{self.gateway.url}/gwprocess/v4/gw.php?Q=pay&SESSIONKEY=SESSION-{body['booking_id']}")
+
+        booking = await Booking.objects.aget(unique_id=body['booking_id'])
+        self.assertEqual((booking.total_amount, booking.status, booking.is_paid), (Decimal('1500.00'), Booking.PENDING, False))
+        holds = [(h.quantity, h.status) async for h in TicketHold.objects.filter(booking=booking)]
+        self.assertEqual(holds, [(3, TicketHold.ACTIVE)])
+        self.assertEqual((await TicketType.objects.aget(pk=self.ticket_type.pk)).held_quantity, 3)
+
+    async def test_gateway_failure_releases_the_admission(self):
+        token = await self.admission()
+        client = AsyncSSLCommerzClient(base_url=self.gateway.url)
+        try:
+            with mock.patch.object(client, 'initiate_payment', side_effect=GatewayError('unreachable')):
+                response = await self.book(client, token)
+            self.assertEqual(response.status_code, 500)
+            # The admission was handed back, so the customer can retry without queueing again
+            response = await self.book(client, token, email='retry@example.com')
+        finally:
+            await client.close()
+        self.assertEqual(response.status_code, 200)
+
+
+class BookingBenchmarkTests(TransactionTestCase):
+    def test_small_run(self):
+        out = io.StringIO()
+        call_command(
+            'bench_booking', '--ticket-types', '2', '--stock', '5', '--seed-bookings', '20', '--bookings', '12',
+            '--catalogue-requests', '5', '--concurrency', '1', '--json', stdout=out,
+        )
+        result = json.loads(out.getvalue())
+        phases = {phase['label']: phase for phase in result['phases']}
+        self.assertEqual(list(phases), ['catalogue', 'book', 'ipn', 'success'])
+        self.assertEqual(phases['catalogue']['statuses'], {'200': 5})
+        booked = phases['book']['statuses'].get('200', 0)
+        self.assertGreater(booked, 0)
+        self.assertGreater(phases['book']['statuses'].get('400', 0), 0) # Demand exceeds the stock
+        self.assertEqual(phases['ipn']['statuses'], {'200': booked})
+        self.assertIsNotNone(phases['ipn']['queries_max'])
+        self.assertEqual(result['oversold'], {})
+        self.assertFalse(TicketType.objects.exists()) # Cleaned up
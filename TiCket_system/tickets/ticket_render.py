@@ -0,0 +1,107 @@
+# tickets/ticket_render.py
+"""
+Rendering of ticket artifacts: the QR code of a booking as a PNG, and a one-page PDF ticket per
+booked line carrying the same QR code.
+
+The QR code encodes the booking id, which is what the gate scanners send to /api/checkin/.
+This module does not touch Django, so `tickets.artifacts` can run it in worker processes; its
+output depends only on the payload, which is what lets artifacts be cached by their inputs.
+"""
+import io
+import zlib
+import segno
+
+RENDER_VERSION = 1 # Bump when the output changes, so cached artifacts are not served any more
+PNG_SCALE = 8      # Pixels per QR module
+PAGE_SIZE = (298, 420) # A6 portrait, in points
+QR_SIZE = 200          # Side of the QR code on the PDF ticket, in points
+
+
+def qr_png(code):
+    buffer = io.BytesIO()
+    segno.make(code, error='m', micro=False).save(buffer, kind='png', scale=PNG_SCALE, border=4)
+    return buffer.getvalue()
+
+
+def _pdf_text(value):
+    # Latin-1 for the standard Helvetica font, with the string delimiters escaped
+    text = value.encode('latin-1', 'replace').decode('latin-1')
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def _qr_path(code, left, bottom, size):
+    """
+    PDF path operators filling the dark modules of the QR code, one rectangle per horizontal run.
+    """
+    matrix = segno.make(code, error='m', micro=False).matrix
+    module = size / len(matrix)
+    ops = []
+    for row, cells in enumerate(matrix):
+        y = bottom + size - (row + 1) * module
+        column = 0
+        while column < len(cells):
+            if not cells[column]:
+                column += 1
+                continue
+            run = column
+            while run < len(cells) and cells[run]:
+                run += 1
+            ops.append(f"{left + column * module:.2f} {y:.2f} {(run - column) * module:.2f} {module:.2f} re")
+            column = run
+    ops.append('f')
+    return '\n'.join(ops)
+
+
+def ticket_pdf(ticket):
+    """
+    A one-page PDF ticket. `ticket` has the keys code, ticket_type, quantity, customer_name and
+    booking_time (strings or numbers).
+    """
+    width, height = PAGE_SIZE
+    lines = [
+        (16, ticket['ticket_type']),
+        (12, f"Admits {ticket['quantity']}"),
+        (10, ticket['customer_name']),
+        (8, f"Booked {ticket['booking_time']}"),
+        (8, f"Booking {ticket['code']}"),
+    ]
+    text = ['BT']
+    y = height - 40
+    for size, value in lines:
+        text.append(f"/F1 {size} Tf 1 0 0 1 24 {y} Tm ({_pdf_text(str(value))}) Tj")
+        y -= size + 8
+    text.append('ET')
+    qr = _qr_path(ticket['code'], (width - QR_SIZE) / 2, 30, QR_SIZE)
+    content = zlib.compress(('\n'.join(text) + '\n' + qr).encode('latin-1'), 6)
+
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width} {height}] "
+        f"/Resources << /Font << /F1 5 0 R >> >> /Contents 4 0 R >>".encode(),
+        b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(content) + content + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b''.join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(pdf)
+
+
+RENDERERS = {
+    'png': lambda ticket: qr_png(ticket['code']),
+    'pdf': ticket_pdf,
+}
+
+
+def render(kind, ticket):
+    """
+    Renders one artifact. Runs in the worker processes of `tickets.artifacts`.
+    """
+    return RENDERERS[kind](ticket)
@@ -1,12 +1,23 @@
 from django.urls import path
-from . import views
+from . import views, async_views
+from .db_router import replica_reads
 
 urlpatterns = [
     path('', views.landing_page, name='landing_page'),
-    path('api/ticket-types/', views.TicketTypeListView.as_view(), name='ticket_type_list'),
+    path('api/ticket-types/', replica_reads(views.TicketTypeListView.as_view()), name='ticket_type_list'),
     path('api/book-tickets/', views.CreateBookingView.as_view(), name='create_booking'),
+    # Async variants, for deployments served through core.asgi
+    path('api/async/ticket-types/', replica_reads(async_views.ticket_type_list), name='ticket_type_list_async'),
+    path('api/async/book-tickets/', async_views.create_booking, name='create_booking_async'),
+    path('api/availability/stream/', async_views.availability_stream, name='availability_stream'),
+    path('api/waiting-room/', views.waiting_room_view, name='waiting_room'),
+    path('api/bookings/<uuid:booking_id>/tickets/<int:line_id>.<str:kind>', views.ticket_artifact, name='ticket_artifact'),
+    path('api/checkin/', views.checkin_view, name='checkin'),
+    path('api/checkin/manifest/', views.checkin_manifest, name='checkin_manifest'),
+    path('api/export/bookings/', views.export_bookings, name='export_bookings'),
     path('sslcommerz/success/', views.sslcommerz_success, name='sslcommerz_success'),
     path('sslcommerz/fail/', views.sslcommerz_fail, name='sslcommerz_fail'),
     path('sslcommerz/cancel/', views.sslcommerz_cancel, name='sslcommerz_cancel'),
     path('sslcommerz/ipn/', views.sslcommerz_ipn, name='sslcommerz_ipn'),
+    path('metrics', views.metrics, name='metrics'),
 ]
\ No newline at end of file
@@ -0,0 +1,108 @@
+# tickets/validation.py
+"""
+Server-side verification of SSLCommerz payments against the validator API.
+
+Confirmed payments are cached per `val_id`, so the success redirect and the IPN for the
+same payment cost at most one validator round-trip between them.
+"""
+import asyncio
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.core.cache import cache
+from .gateway import AsyncSSLCommerzClient, GatewayError, get_client
+
+VALID_STATUSES = {'VALID', 'VALIDATED'}
+VALIDATED_CACHE_KEY = 'tickets:validated:{}'
+
+
+def _same_amount(a, b):
+    try:
+        return Decimal(str(a)) == Decimal(str(b))
+    except (InvalidOperation, TypeError):
+        return False
+
+
+def _check(confirmed, tran_id, amount):
+    """
+    Returns None if the confirmed payment matches the callback, else the reason it does not.
+    """
+    if confirmed.get('tran_id') != str(tran_id):
+        return f"val_id belongs to transaction {confirmed.get('tran_id')}"
+    if amount is not None and not _same_amount(confirmed.get('amount'), amount):
+        return f"amount {amount} does not match validated amount {confirmed.get('amount')}"
+    return None
+
+
+def _confirmed(data):
+    """
+    Returns the fields worth caching from a validator response, or None if it does not confirm a payment.
+    """
+    if data.get('status') not in VALID_STATUSES:
+        return None
+    return {'tran_id': data.get('tran_id'), 'amount': data.get('amount')}
+
+
+def verify_payment(tran_id, val_id, amount, client=None):
+    """
+    Checks a payment callback against the validator API.
+
+    Returns (True, None) if SSLCommerz confirms `val_id` for `tran_id` and `amount`, otherwise
+    (False, reason). Raises GatewayError if the validator cannot be reached, in which case the
+    payment is neither confirmed nor rejected.
+    """
+    if not val_id:
+        return False, 'missing val_id'
+    key = VALIDATED_CACHE_KEY.format(val_id)
+    confirmed = cache.get(key)
+    if confirmed is None:
+        data = (client or get_client()).validate(val_id)
+        confirmed = _confirmed(data)
+        if confirmed is None:
+            return False, f"validator status {data.get('status')}"
+        cache.set(key, confirmed, settings.SSLCOMMERZ_VALIDATION_CACHE_SECONDS)
+    reason = _check(confirmed, tran_id, amount)
+    return reason is None, reason
+
+
+async def averify_payment(client, tran_id, val_id, amount):
+    """
+    Async counterpart of `verify_payment` using an `AsyncSSLCommerzClient`.
+    """
+    if not val_id:
+        return False, 'missing val_id'
+    key = VALIDATED_CACHE_KEY.format(val_id)
+    confirmed = await cache.aget(key)
+    if confirmed is None:
+        data = await client.validate(val_id)
+        confirmed = _confirmed(data)
+        if confirmed is None:
+            return False, f"validator status {data.get('status')}"
+        await cache.aset(key, confirmed, settings.SSLCOMMERZ_VALIDATION_CACHE_SECONDS)
+    reason = _check(confirmed, tran_id, amount)
+    return reason is None, reason
+
+
+def verify_many(payments, concurrency=20, **client_options):
+    """
+    Verifies many (tran_id, val_id, amount) tuples with up to `concurrency` validator calls in flight.
+
+    Returns one result per tuple, in order: (True, None), (False, reason), or the GatewayError raised
+    for that payment.
+    """
+    async def run():
+        client = AsyncSSLCommerzClient(pool_size=concurrency, **client_options)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def verify(payment):
+            async with semaphore:
+                try:
+                    return await averify_payment(client, *payment)
+                except GatewayError as e:
+                    return e
+
+        try:
+            return await asyncio.gather(*(verify(payment) for payment in payments))
+        finally:
+            await client.close()
+
+    return asyncio.run(run()) if payments else []
@@ -1,18 +1,28 @@
 # tickets/views.py
 from django.shortcuts import render, redirect
 from django.conf import settings
+from django.core import signing
+from django.core.exceptions import ValidationError
 from django.views.decorators.csrf import csrf_exempt
 from django.urls import reverse
-from django.template.loader import render_to_string
-from django.core.mail import send_mail
-from django.http import JsonResponse
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework import status
-from .models import TicketType, Booking, BookedTicket
-from .serializers import TicketTypeSerializer, BookingSerializer
+from rest_framework import serializers, status
+from .models import Booking, BookedTicket, CheckIn, PaymentEvent
+from .serializers import BookingSerializer
+from .gateway import get_client, GatewayError
+from .payments import process_payment
+from .instrumentation import render_prometheus, timed
+from .log import dropped_records, log_context
+from .ratelimit import BookingThrottle, CatalogueThrottle
+from . import artifacts, catalogue, checkin, export, lifecycle, payments, waiting_room
+import functools
+import io
 import json
-import requests
 import logging
 
 logger = logging.getLogger(__name__)
@@ -21,92 +31,117 @@ logger = logging.getLogger(__name__)
 class TicketTypeListView(APIView):
     """
     API endpoint to list available ticket types.
-    Filters for active tickets with available quantity greater than 0.
+    Filters for active tickets with unreserved quantity greater than 0.
+    The JSON is served from the catalogue cache and supports conditional GETs,
+    so clients revalidating an unchanged catalogue get a 304 without any DB query.
     """
+    throttle_classes = [CatalogueThrottle]
+
     def get(self, request):
-        ticket_types = TicketType.objects.filter(is_active=True, available_quantity__gt=0)
-        serializer = TicketTypeSerializer(ticket_types, many=True)
-        return Response(serializer.data)
+        version = catalogue.current_version()
+        etag = catalogue.etag_for(version)
+        last_modified = catalogue.last_modified_for(version)
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = HttpResponse(catalogue.get_catalogue(version), content_type='application/json')
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        response['Cache-Control'] = 'no-cache' # Browsers may store it but must revalidate
+        return response
 
 class CreateBookingView(APIView):
     """
     API endpoint to create a new booking and initiate payment with SSLCommerz.
     """
+    throttle_classes = [BookingThrottle]
+
     def post(self, request):
+        # Admission control before any DB work: clients without a turn from the waiting room are turned away here
+        try:
+            admission_id = waiting_room.admit(request.data, request.headers.get(waiting_room.TOKEN_HEADER))
+        except waiting_room.AdmissionError as e:
+            return Response(e.payload(), status=e.status)
+
         serializer = BookingSerializer(data=request.data)
         if serializer.is_valid():
-            # Calculate total amount for the booking
-            total_amount = 0
-            for ticket_data in serializer.validated_data['booked_tickets']:
-                try:
-                    ticket_type = TicketType.objects.get(id=ticket_data['ticket_type'].id)
-                    quantity = ticket_data['quantity']
-                    total_amount += ticket_type.price * quantity
-                except TicketType.DoesNotExist:
-                    return Response({'error': 'One or more ticket types not found.'}, status=status.HTTP_400_BAD_REQUEST)
-                except Exception as e:
-                    logger.error(f"Error calculating total for booking: {e}")
-                    return Response({'error': 'Error processing ticket selection.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-            # Save the booking to get a unique_id before redirecting to payment
-            booking = serializer.save()
+            # Save the booking (with its total amount) to get a unique_id before redirecting to payment
+            try:
+                booking = serializer.save()
+            except serializers.ValidationError as e:
+                # Sold out since validation: the booking was rolled back
+                waiting_room.release(admission_id)
+                return Response(e.detail, status=status.HTTP_400_BAD_REQUEST)
 
             # --- SSLCommerz Payment Initiation ---
-            store_id = settings.SSLCOMMERZ_STORE_ID
-            store_passwd = settings.SSLCOMMERZ_STORE_PASSWORD
-            
-            # Determine SSLCommerz API endpoint based on DEBUG setting
-            if settings.DEBUG:
-                base_url = "https://sandbox.sslcommerz.com/gwprocess/v4/api.php"
-            else:
-                base_url = "https://securepay.sslcommerz.com/gwprocess/v4/api.php"
-
-            post_data = {
-                'store_id': store_id,
-                'store_passwd': store_passwd,
-                'total_amount': total_amount,
-                'currency': 'BDT',
-                'tran_id': str(booking.unique_id), # Use booking's unique_id as transaction ID
-                'success_url': request.build_absolute_uri(reverse('sslcommerz_success')),
-                'fail_url': request.build_absolute_uri(reverse('sslcommerz_fail')),
-                'cancel_url': request.build_absolute_uri(reverse('sslcommerz_cancel')),
-                'ipn_url': request.build_absolute_uri(reverse('sslcommerz_ipn')), # Important for server-to-server validation
-                'cus_name': booking.customer_name,
-                'cus_email': booking.customer_email,
-                'cus_add1': 'N/A', # Placeholder, can be collected from form if needed
-                'cus_phone': 'N/A', # Placeholder
-                'cus_city': 'Dhaka', # <--- ADDED THIS LINE
-                'cus_state': 'Dhaka', # <--- ADDED THIS LINE
-                'cus_postcode': '1000', # <--- ADDED THIS LINE
-                'cus_country': 'Bangladesh', # <--- ADDED THIS LINE
-                'shipping_method': 'NO',
-                'product_name': 'Ticket Booking',
-                'product_category': 'Tickets',
-                'product_profile': 'general',
-            }
+            post_data = build_payment_data(request, booking)
 
             try:
-                response = requests.post(base_url, data=post_data)
-                response_data = response.json()
-                
+                response_data = get_client().initiate_payment(post_data)
+
                 if response_data['status'] == 'SUCCESS':
                     # Return the GatewayPageURL to the frontend for redirection
                     return Response({'gateway_url': response_data['GatewayPageURL'], 'booking_id': str(booking.unique_id)}, status=status.HTTP_200_OK)
                 else:
-                    logger.error(f"SSLCommerz initiation failed for booking {booking.unique_id}: {response_data}")
+                    logger.error("SSLCommerz initiation failed for booking %s: %s", booking.unique_id, response_data)
+                    waiting_room.release(admission_id)
                     return Response({'error': response_data.get('failedreason', 'Payment initiation failed')}, status=status.HTTP_400_BAD_REQUEST)
-            except requests.exceptions.RequestException as e:
-                logger.error(f"Error connecting to SSLCommerz for booking {booking.unique_id}: {e}")
+            except GatewayError as e:
+                logger.error("Error connecting to SSLCommerz for booking %s: %s", booking.unique_id, e)
+                waiting_room.release(admission_id)
                 return Response({'error': 'Failed to connect to payment gateway. Please try again later.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+        # Let the client fix the form and retry without queueing again
+        waiting_room.release(admission_id)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+
+def build_payment_data(request, booking):
+    """
+    Builds the SSLCommerz session request for a booking.
+    Store credentials and the sandbox/live endpoint are added by the gateway client.
+    """
+    post_data = {
+        'total_amount': booking.total_amount,
+        'currency': 'BDT',
+        'tran_id': str(booking.unique_id), # Use booking's unique_id as transaction ID
+        'success_url': request.build_absolute_uri(reverse('sslcommerz_success')),
+        'fail_url': request.build_absolute_uri(reverse('sslcommerz_fail')),
+        'cancel_url': request.build_absolute_uri(reverse('sslcommerz_cancel')),
+        'ipn_url': request.build_absolute_uri(reverse('sslcommerz_ipn')), # Important for server-to-server validation
+        'cus_name': booking.customer_name,
+        'cus_email': booking.customer_email,
+        'cus_add1': 'N/A', # Placeholder, can be collected from form if needed
+        'cus_phone': 'N/A', # Placeholder
+        'cus_city': 'Dhaka', # <--- ADDED THIS LINE
+        'cus_state': 'Dhaka', # <--- ADDED THIS LINE
+        'cus_postcode': '1000', # <--- ADDED THIS LINE
+        'cus_country': 'Bangladesh', # <--- ADDED THIS LINE
+        'shipping_method': 'NO',
+        'product_name': 'Ticket Booking',
+        'product_category': 'Tickets',
+        'product_profile': 'general',
+    }
+    return post_data
+
+
 # --- SSLCommerz Callback Views ---
+def tran_id_log_context(view):
+    """
+    Tags everything logged while handling a gateway callback with its tran_id.
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        with log_context(tran_id=request.POST.get('tran_id')):
+            return view(request, *args, **kwargs)
+    return wrapper
+
 @csrf_exempt # CSRF protection is not needed for external POST requests from payment gateway
+@tran_id_log_context
 def sslcommerz_success(request):
     """
     Handles the success callback from SSLCommerz after a successful payment.
-    Updates booking status, decrements ticket quantity, and sends confirmation email.
+    Updates booking status, decrements ticket quantity, and queues the confirmation email.
     """
     if request.method == 'POST':
         data = request.POST
@@ -115,48 +150,33 @@ def sslcommerz_success(request):
         amount = data.get('amount')
         currency = data.get('currency')
 
-        logger.info(f"SSLCommerz Success Callback - Tran ID: {tran_id}, Val ID: {val_id}, Amount: {amount}")
+        logger.info("SSLCommerz Success Callback - Tran ID: %s, Val ID: %s, Amount: %s", tran_id, val_id, amount)
 
+        # The redirect comes through the customer's browser, so the payment is confirmed with
+        # SSLCommerz's validation API before the booking is marked paid.
         try:
-            booking = Booking.objects.get(unique_id=tran_id)
-            if not booking.is_paid:
-                # IMPORTANT: In a production environment, you should perform server-side validation here
-                # by calling SSLCommerz's validation API with `val_id` to ensure the payment is genuine.
-                # For simplicity, this example assumes the success callback is reliable.
-
-                booking.is_paid = True
-                booking.transaction_id = val_id
-                booking.save()
-
-                # Decrease available ticket quantity for each booked ticket
-                for booked_ticket in booking.booked_tickets.all():
-                    ticket_type = booked_ticket.ticket_type
-                    if ticket_type.available_quantity >= booked_ticket.quantity:
-                        ticket_type.available_quantity -= booked_ticket.quantity
-                        ticket_type.save()
-                    else:
-                        logger.warning(f"Insufficient quantity for {ticket_type.name} (ID: {ticket_type.id}) for booking {booking.unique_id}. Booked: {booked_ticket.quantity}, Available: {ticket_type.available_quantity}")
-                        # You might want to handle this more robustly, e.g., refund or alert admin.
-
-                # Send confirmation email to the customer
-                send_confirmation_email(booking)
-
-                # Redirect to landing page with success message and unique ID
-                return redirect(reverse('landing_page') + f'?status=success&id={booking.unique_id}')
-            else:
-                # Booking was already marked as paid (e.g., via IPN), just redirect
-                logger.info(f"SSLCommerz Success: Booking {tran_id} already paid.")
-                return redirect(reverse('landing_page') + f'?status=success&id={booking.unique_id}')
-
-        except Booking.DoesNotExist:
-            logger.error(f"SSLCommerz Success: Booking with tran_id {tran_id} not found.")
-            return redirect(reverse('landing_page') + '?status=error&msg=BookingNotFound')
+            outcome, booking = process_payment(tran_id, val_id, amount, PaymentEvent.SUCCESS_REDIRECT)
         except Exception as e:
-            logger.error(f"Error processing SSLCommerz success for tran_id {tran_id}: {e}")
+            logger.error("Error processing SSLCommerz success for tran_id %s: %s", tran_id, e)
             return redirect(reverse('landing_page') + '?status=error&msg=PaymentProcessingError')
+
+        if outcome == payments.NOT_FOUND:
+            logger.error("SSLCommerz Success: Booking with tran_id %s not found.", tran_id)
+            return redirect(reverse('landing_page') + '?status=error&msg=BookingNotFound')
+        if outcome == payments.REJECTED:
+            return redirect(reverse('landing_page') + f'?status=error&msg=PaymentValidationFailed&id={tran_id}')
+        if outcome == payments.PENDING:
+            # The validator is unreachable; the IPN or `reconcile_payments` will confirm the payment
+            return redirect(reverse('landing_page') + f'?status=pending&id={tran_id}')
+        if outcome != payments.APPLIED:
+            # Booking was already marked as paid (e.g., via IPN), just redirect
+            logger.info("SSLCommerz Success: Booking %s already paid.", tran_id)
+        # Redirect to landing page with success message and unique ID
+        return redirect(reverse('landing_page') + f'?status=success&id={tran_id}')
     return redirect(reverse('landing_page') + '?status=error&msg=InvalidRequest') # If not a POST request
 
 @csrf_exempt
+@tran_id_log_context
 def sslcommerz_fail(request):
     """
     Handles the fail callback from SSLCommerz when payment fails.
@@ -164,12 +184,14 @@ def sslcommerz_fail(request):
     if request.method == 'POST':
         data = request.POST
         tran_id = data.get('tran_id')
-        logger.warning(f"SSLCommerz Fail Callback - Tran ID: {tran_id}")
-        # Optionally, update booking status to failed in your DB
+        logger.warning("SSLCommerz Fail Callback - Tran ID: %s", tran_id)
+        # Give the reserved tickets back to other customers
+        release_unpaid_holds(tran_id, Booking.FAILED)
         return redirect(reverse('landing_page') + f'?status=failed&id={tran_id}')
     return redirect(reverse('landing_page') + '?status=error&msg=InvalidRequest')
 
 @csrf_exempt
+@tran_id_log_context
 def sslcommerz_cancel(request):
     """
     Handles the cancel callback from SSLCommerz when payment is cancelled by user.
@@ -177,12 +199,19 @@ def sslcommerz_cancel(request):
     if request.method == 'POST':
         data = request.POST
         tran_id = data.get('tran_id')
-        logger.info(f"SSLCommerz Cancel Callback - Tran ID: {tran_id}")
-        # Optionally, update booking status to cancelled in your DB
+        logger.info("SSLCommerz Cancel Callback - Tran ID: %s", tran_id)
+        release_unpaid_holds(tran_id, Booking.CANCELLED)
         return redirect(reverse('landing_page') + f'?status=cancelled&id={tran_id}')
     return redirect(reverse('landing_page') + '?status=error&msg=InvalidRequest')
 
+# IPN statuses that end a payment attempt, and the booking status they close it with
+IPN_CLOSED_STATUSES = {
+    'FAILED': Booking.FAILED,
+    'CANCELLED': Booking.CANCELLED,
+}
+
 @csrf_exempt
+@tran_id_log_context
 def sslcommerz_ipn(request):
     """
     Handles the Instant Payment Notification (IPN) from SSLCommerz.
@@ -197,92 +226,195 @@ def sslcommerz_ipn(request):
         amount = data.get('amount')
         currency = data.get('currency')
 
-        logger.info(f"SSLCommerz IPN Callback - Tran ID: {tran_id}, Status: {status_code}, Val ID: {val_id}")
+        logger.info("SSLCommerz IPN Callback - Tran ID: %s, Status: %s, Val ID: %s", tran_id, status_code, val_id)
 
         if status_code == 'VALID' or status_code == 'VALIDATED':
+            # --- CRITICAL: Server-side validation using SSLCommerz API ---
+            # process_payment verifies val_id and the amount with the validation API before
+            # marking the booking paid. This prevents forged notifications.
             try:
-                booking = Booking.objects.get(unique_id=tran_id)
-                if not booking.is_paid:
-                    # --- CRITICAL: Server-side validation using SSLCommerz API ---
-                    # This step verifies the payment authenticity and prevents fraud.
-                    # You would typically make another request to SSLCommerz's validation API.
-                    # Example (pseudo-code, replace with actual SSLCommerz validation logic):
-                    # validation_url = "https://sandbox.sslcommerz.com/validator/api/validationserverAPI.php"
-                    # validation_params = {
-                    #     'val_id': val_id,
-                    #     'store_id': settings.SSLCOMMERZ_STORE_ID,
-                    #     'store_passwd': settings.SSLCOMMERZ_STORE_PASSWORD,
-                    # }
-                    # validation_response = requests.get(validation_url, params=validation_params)
-                    # validation_data = validation_response.json()
-                    #
-                    # if validation_data.get('status') == 'VALID' and float(validation_data.get('amount')) == float(amount):
-                    #     # Payment is truly valid and amount matches
-                    #     booking.is_paid = True
-                    #     booking.transaction_id = val_id
-                    #     booking.save()
-                    #
-                    #     # Decrease available ticket quantity
-                    #     for booked_ticket in booking.booked_tickets.all():
-                    #         ticket_type = booked_ticket.ticket_type
-                    #         if ticket_type.available_quantity >= booked_ticket.quantity:
-                    #             ticket_type.available_quantity -= booked_ticket.quantity
-                    #             ticket_type.save()
-                    #
-                    #     send_confirmation_email(booking)
-                    #     return JsonResponse({'status': 'SUCCESS'})
-                    # else:
-                    #     logger.error(f"IPN Validation Failed for tran_id {tran_id}. Validation data: {validation_data}")
-                    #     return JsonResponse({'status': 'VALIDATION_FAILED'}, status=400)
-                    
-                    # For demonstration, we'll assume IPN is valid if status is 'VALID'/'VALIDATED'
-                    booking.is_paid = True
-                    booking.transaction_id = val_id
-                    booking.save()
-
-                    # Decrease available ticket quantity
-                    for booked_ticket in booking.booked_tickets.all():
-                        ticket_type = booked_ticket.ticket_type
-                        if ticket_type.available_quantity >= booked_ticket.quantity:
-                            ticket_type.available_quantity -= booked_ticket.quantity
-                            ticket_type.save()
-
-                    send_confirmation_email(booking)
-                    return JsonResponse({'status': 'SUCCESS'})
-                else:
-                    logger.info(f"SSLCommerz IPN: Booking {tran_id} already paid.")
-                    return JsonResponse({'status': 'ALREADY_PAID'})
-
-            except Booking.DoesNotExist:
-                logger.error(f"SSLCommerz IPN: Booking with tran_id {tran_id} not found.")
-                return JsonResponse({'status': 'BOOKING_NOT_FOUND'}, status=404)
+                outcome, booking = process_payment(tran_id, val_id, amount, PaymentEvent.IPN)
             except Exception as e:
-                logger.error(f"Error processing SSLCommerz IPN for tran_id {tran_id}: {e}")
+                logger.error("Error processing SSLCommerz IPN for tran_id %s: %s", tran_id, e)
                 return JsonResponse({'status': 'ERROR'}, status=500)
+
+            if outcome == payments.NOT_FOUND:
+                logger.error("SSLCommerz IPN: Booking with tran_id %s not found.", tran_id)
+                return JsonResponse({'status': 'BOOKING_NOT_FOUND'}, status=404)
+            if outcome == payments.REJECTED:
+                return JsonResponse({'status': 'VALIDATION_FAILED'}, status=400)
+            if outcome == payments.PENDING:
+                # Not a 2xx, so SSLCommerz retries the IPN later
+                return JsonResponse({'status': 'VALIDATION_PENDING'}, status=503)
+            if outcome != payments.APPLIED:
+                logger.info("SSLCommerz IPN: Booking %s already paid.", tran_id)
+                return JsonResponse({'status': 'ALREADY_PAID'})
+            return JsonResponse({'status': 'SUCCESS'})
         else:
-            logger.warning(f"SSLCommerz IPN: Unsuccessful payment status: {status_code} for tran_id {tran_id}")
-            # You might want to log this or update booking status to failed/cancelled if it's not already.
+            logger.warning("SSLCommerz IPN: Unsuccessful payment status: %s for tran_id %s", status_code, tran_id)
+            # Close the booking like the fail/cancel redirects, in case the customer never comes back through them
+            if status_code in IPN_CLOSED_STATUSES:
+                release_unpaid_holds(tran_id, IPN_CLOSED_STATUSES[status_code])
             return JsonResponse({'status': 'UNSUCCESSFUL_PAYMENT'}, status=200)
     return JsonResponse({'status': 'INVALID_REQUEST'}, status=400)
 
 
-def send_confirmation_email(booking):
+@csrf_exempt # Anonymous, like the booking API; joining only takes a number
+def waiting_room_view(request):
     """
-    Sends a confirmation email to the customer with booking details.
+    The waiting room for ticket types with an admission rate.
+    POST {"ticket_types": [ids]} joins the queues of those ticket types; GET ?ticket=<queue_ticket> polls.
+    Both return the queue position, seconds to wait before polling again (also as Retry-After) and,
+    once admitted, the admission token to send with the booking in the X-Admission-Token header.
     """
-    subject = 'Your Ticket Booking Confirmation'
-    # Render the HTML email template with booking data
-    message = render_to_string('tickets/confirmation_email.html', {
-        'booking': booking,
-    })
-    from_email = settings.DEFAULT_FROM_EMAIL
-    recipient_list = [booking.customer_email]
+    if request.method == 'POST':
+        try:
+            ticket_type_ids = [int(pk) for pk in json.loads(request.body)['ticket_types']]
+        except (ValueError, KeyError, TypeError):
+            return JsonResponse({'error': 'Expected {"ticket_types": [ids]}.'}, status=400)
+        result = waiting_room.join(ticket_type_ids)
+    elif request.method == 'GET':
+        try:
+            result = waiting_room.status(request.GET.get('ticket', ''))
+        except signing.BadSignature:
+            return JsonResponse({'error': 'Invalid or expired queue ticket, please join again.'}, status=400)
+    else:
+        return HttpResponseNotAllowed(['GET', 'POST'])
 
+    response = JsonResponse(result)
+    if result['retry_after']:
+        response['Retry-After'] = str(result['retry_after'])
+    return response
+
+
+@staff_member_required
+def export_bookings(request):
+    """
+    Streams booked tickets as CSV (default) or NDJSON for staff.
+    Query parameters: format=csv|ndjson, since/until (ISO date or datetime), paid=true|false.
+    """
+    format = request.GET.get('format', 'csv')
+    if format not in export.FORMATS:
+        return HttpResponseBadRequest(f"Unknown format {format!r}.")
+    try:
+        since = export.parse_when(request.GET['since']) if request.GET.get('since') else None
+        until = export.parse_when(request.GET['until'], end=True) if request.GET.get('until') else None
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    paid = request.GET.get('paid')
+    is_paid = None if paid in (None, '') else paid.lower() in ('1', 'true', 'yes')
+
+    response = StreamingHttpResponse(
+        export.export_chunks(format, since=since, until=until, is_paid=is_paid),
+        content_type=export.FORMATS[format],
+    )
+    response['Content-Disposition'] = f'attachment; filename="bookings.{format}"'
+    return response
+
+
+def ticket_artifact(request, booking_id, line_id, kind):
+    """
+    Serves a paid booked line's PDF ticket, or its booking's QR code as a PNG, from the artifact cache.
+    Anyone holding the booking id may download its tickets, just as they could get in with it at the gate.
+    """
+    if kind not in artifacts.CONTENT_TYPES:
+        raise Http404
+    line = (
+        BookedTicket.objects.select_related('booking', 'ticket_type')
+        .filter(pk=line_id, booking__unique_id=booking_id, booking__is_paid=True).first()
+    )
+    if line is None:
+        raise Http404
+    ticket = artifacts.ticket_fields(line)
+    # The cache key covers every rendered field, so it is a strong validator
+    etag = f'"{artifacts.artifact_key(kind, ticket)}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        _, data = artifacts.read_or_render(kind, ticket)
+        response = HttpResponse(data, content_type=artifacts.CONTENT_TYPES[kind])
+        response['Content-Disposition'] = f'inline; filename="ticket-{booking_id}-{line_id}.{kind}"'
+    response['ETag'] = etag
+    response['Cache-Control'] = f"private, max-age={settings.TICKET_ARTIFACT_CACHE_SECONDS}"
+    return response
+
+
+def _gate_authorized(request):
+    # Gate scanners authenticate with `Authorization: Bearer <CHECKIN_TOKEN>`; without the setting check-in is off
+    token = settings.CHECKIN_TOKEN
+    return bool(token) and request.headers.get('Authorization') == f"Bearer {token}"
+
+
+# HTTP status of each scan outcome; scanners show the `status` from the body either way
+CHECKIN_RESPONSE_STATUS = {
+    CheckIn.ADMITTED: 200,
+    CheckIn.ALREADY_USED: 409,
+    CheckIn.UNPAID: 402,
+    CheckIn.UNKNOWN: 404,
+}
+
+
+@csrf_exempt # Token-authenticated, no session
+def checkin_view(request):
+    """
+    Checks in a scanned booking code at a venue gate: POST {"code": "<booking id>", "gate": "north-1"}.
+    Returns {"status": ...} with the entry number and the booking's ticket count once the booking is found.
+    """
+    if not _gate_authorized(request):
+        return HttpResponse(status=401)
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
     try:
-        send_mail(subject, message, from_email, recipient_list, html_message=message)
-        logger.info(f"Confirmation email sent to {booking.customer_email} for booking {booking.unique_id}")
-    except Exception as e:
-        logger.error(f"Failed to send confirmation email to {booking.customer_email}: {e}")
+        data = json.loads(request.body)
+        code, gate = str(data['code']), str(data.get('gate', ''))
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Expected {"code": "<booking id>", "gate": "<gate>"}.'}, status=400)
+    outcome, details = checkin.scan(code, gate)
+    return JsonResponse({'status': outcome, **details}, status=CHECKIN_RESPONSE_STATUS[outcome])
+
+
+def checkin_manifest(request):
+    """
+    The check-in manifest (see tickets.checkin) for gate devices that validate offline.
+    """
+    if not _gate_authorized(request):
+        return HttpResponse(status=401)
+    manifest = io.BytesIO()
+    checkin.write_manifest(manifest)
+    response = HttpResponse(manifest.getvalue(), content_type='application/octet-stream')
+    response['Content-Disposition'] = 'attachment; filename="checkin-manifest.bin"'
+    return response
+
+
+def metrics(request):
+    """
+    Request timing histograms and payment outcome counters of this process, in the Prometheus text format.
+    Requires `Authorization: Bearer <TICKETS_METRICS_TOKEN>` when that setting is set.
+    """
+    token = settings.TICKETS_METRICS_TOKEN
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        return HttpResponse(status=401)
+    counters = [(
+        'tickets_payment_outcomes_total', 'Payment notifications handled, by outcome.',
+        {(('outcome', outcome),): count for outcome, count in payments.payment_metrics().items()},
+    ), (
+        'tickets_log_records_dropped_total', 'Log records dropped because the log queue was full.',
+        {(): dropped_records()},
+    )]
+    return HttpResponse(render_prometheus(counters), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def release_unpaid_holds(tran_id, status):
+    """
+    Marks an unpaid booking failed or cancelled (`status`) and releases the stock it held.
+    """
+    try:
+        booking = Booking.objects.get(unique_id=tran_id, is_paid=False)
+    except (Booking.DoesNotExist, ValidationError):
+        return
+    released = lifecycle.close_unpaid(booking, status)
+    if released:
+        logger.info("Released %s hold(s) for booking %s", released, tran_id)
+
 
 # --- Frontend Landing Page View ---
 def landing_page(request):
@@ -290,10 +422,11 @@ def landing_page(request):
     Renders the main landing page, displaying success/failure messages
     and unique booking ID after payment redirects.
     """
-    status_msg = request.GET.get('status') # 'success', 'failed', 'cancelled', 'error'
+    status_msg = request.GET.get('status') # 'success', 'pending', 'failed', 'cancelled', 'error'
     unique_id = request.GET.get('id') # Unique booking ID or transaction ID
-    return render(request, 'tickets/landing_page.html', {
-        'status_msg': status_msg,
-        'unique_id': unique_id
-    })
+    with timed('template'):
+        return render(request, 'tickets/landing_page.html', {
+            'status_msg': status_msg,
+            'unique_id': unique_id
+        })
 
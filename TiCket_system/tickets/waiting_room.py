@@ -0,0 +1,172 @@
+# tickets/waiting_room.py
+"""
+Waiting room for on-sales: admission control in front of the booking API.
+
+A ticket type with an `admission_rate` has a virtual queue. Clients join it and get a numbered,
+signed queue ticket; the gate lets `admission_rate` numbers through per second (after an initial
+burst of the same size), and a client whose number has been reached gets a single-use, signed
+admission token. Booking those ticket types requires the token in the X-Admission-Token header.
+
+Everything lives in the cache (WAITING_ROOM_CACHE), so rejecting a client without a token costs no
+database work. The gate is computed from the clock rather than advanced by a worker:
+
+    admitted through number = base + rate * (now - start) + burst
+
+and re-anchored at the current end of the queue when the queue has been idle, so a quiet period
+does not bank admissions for the next spike. With several processes the cache must be shared
+(e.g. Redis), otherwise each process runs its own queues.
+"""
+import math
+import time
+import uuid
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+from .models import TicketType
+
+TOKEN_HEADER = 'X-Admission-Token'
+QUEUE_SALT = 'tickets.waiting_room.queue'
+ADMISSION_SALT = 'tickets.waiting_room.admission'
+RATES_KEY = 'tickets:waiting-room:rates'
+TAIL_KEY = 'tickets:waiting-room:{}:tail' # Last number handed out
+GATE_KEY = 'tickets:waiting-room:{}:gate' # (start, base) of the admission line
+USED_KEY = 'tickets:waiting-room:used:{}'
+MAX_RETRY_AFTER = 30 # Seconds; clients poll at least this often
+
+
+class AdmissionError(Exception):
+    """Raised when a booking needs an admission token it does not carry."""
+    def __init__(self, message, status=429, ticket_types=()):
+        super().__init__(message)
+        self.status = status
+        self.ticket_types = sorted(ticket_types)
+
+    def payload(self):
+        return {'error': str(self), 'waiting_room': True, 'ticket_types': self.ticket_types}
+
+
+def _cache():
+    return caches[settings.WAITING_ROOM_CACHE]
+
+
+def admission_rates():
+    """
+    Returns {ticket type id: admission rate} for the ticket types that have a waiting room.
+    Cached until a ticket type is saved (see signals.py).
+    """
+    cache = _cache()
+    rates = cache.get(RATES_KEY)
+    if rates is None:
+        rates = dict(TicketType.objects.filter(admission_rate__isnull=False).values_list('pk', 'admission_rate'))
+        cache.set(RATES_KEY, rates, 300)
+    return rates
+
+
+def forget_rates():
+    _cache().delete(RATES_KEY)
+
+
+def _admitted_through(gate, rate, now):
+    start, base = gate
+    return math.floor(base + rate * (now - start)) + rate
+
+
+def _take_number(ticket_type_id, rate, now):
+    cache = _cache()
+    tail_key = TAIL_KEY.format(ticket_type_id)
+    cache.add(tail_key, 0, None)
+    gate = cache.get(GATE_KEY.format(ticket_type_id))
+    if gate is None or _admitted_through(gate, rate, now) > cache.get(tail_key, 0) + rate:
+        # Idle queue: re-anchor the gate at the current end of the queue
+        cache.set(GATE_KEY.format(ticket_type_id), (now, cache.get(tail_key, 0)), None)
+    return cache.incr(tail_key)
+
+
+def _position(ticket_type_id, rate, number, now):
+    gate = _cache().get(GATE_KEY.format(ticket_type_id))
+    if gate is None: # Evicted: whoever is queued may go
+        return 0
+    return max(0, number - _admitted_through(gate, rate, now))
+
+
+def _status(numbers, now):
+    """
+    Returns the response for a queue ticket holding {ticket type id: number}.
+    """
+    rates = admission_rates()
+    positions = {pk: _position(pk, rates[pk], number, now) for pk, number in numbers.items() if pk in rates}
+    waiting = {pk: position for pk, position in positions.items() if position}
+    if waiting:
+        retry_after = max(math.ceil(position / rates[pk]) for pk, position in waiting.items())
+        return {'position': max(waiting.values()), 'retry_after': min(max(retry_after, 1), MAX_RETRY_AFTER), 'admission_token': None}
+    # The id comes from the queue numbers, so polling again cannot mint tokens for more bookings
+    admission_id = '-'.join(f"{pk}.{number}" for pk, number in sorted(numbers.items())) or uuid.uuid4().hex
+    token = signing.dumps({'t': sorted(numbers), 'n': admission_id}, salt=ADMISSION_SALT)
+    return {'position': 0, 'retry_after': 0, 'admission_token': token}
+
+
+def join(ticket_type_ids):
+    """
+    Queues the client for the given ticket types. Returns the status (see `status`) plus a
+    `queue_ticket` to poll with.
+    """
+    rates = admission_rates()
+    now = time.time()
+    numbers = {pk: _take_number(pk, rates[pk], now) for pk in sorted(set(ticket_type_ids)) if pk in rates}
+    queue_ticket = signing.dumps({'q': [[pk, number] for pk, number in numbers.items()]}, salt=QUEUE_SALT)
+    return {**_status(numbers, now), 'queue_ticket': queue_ticket}
+
+
+def status(queue_ticket):
+    """
+    Returns {'position', 'retry_after', 'admission_token'} for a queue ticket; the token is set
+    once every queue the ticket is in has reached it. Raises signing.BadSignature for an invalid
+    or expired ticket.
+    """
+    payload = signing.loads(queue_ticket, salt=QUEUE_SALT, max_age=settings.WAITING_ROOM_QUEUE_TTL_SECONDS)
+    return _status(dict(payload['q']), time.time())
+
+
+def _requested_types(data):
+    """
+    The ticket type ids in booking request data. Malformed entries are left to the serializer.
+    """
+    ids = set()
+    lines = data.get('booked_tickets') if isinstance(data, dict) else None
+    for line in lines if isinstance(lines, list) else ():
+        try:
+            ids.add(int(line['ticket_type']))
+        except (KeyError, TypeError, ValueError):
+            pass
+    return ids
+
+
+def admit(data, token):
+    """
+    Checks that a booking request may proceed. Returns the id of the admission token it used
+    (pass it to `release` if the booking is not created), or None when no ticket type in it has
+    a waiting room. Raises AdmissionError otherwise.
+    """
+    gated = _requested_types(data) & admission_rates().keys()
+    if not gated:
+        return None
+    if not token:
+        raise AdmissionError('These tickets are on sale through the waiting room.', ticket_types=gated)
+    try:
+        payload = signing.loads(token, salt=ADMISSION_SALT, max_age=settings.WAITING_ROOM_ADMISSION_TTL_SECONDS)
+    except signing.BadSignature:
+        raise AdmissionError('Your admission has expired, please join the waiting room again.', ticket_types=gated)
+    if not gated <= set(payload['t']):
+        raise AdmissionError('Your admission does not cover these tickets.', status=403, ticket_types=gated)
+    # Kept as long as the queue ticket lives, since polling it returns tokens with the same id
+    if not _cache().add(USED_KEY.format(payload['n']), 1, settings.WAITING_ROOM_QUEUE_TTL_SECONDS):
+        raise AdmissionError('This admission has already been used.', status=409, ticket_types=gated)
+    return payload['n']
+
+
+def release(admission_id):
+    """
+    Makes an admission token usable again, e.g. after the booking it was used for failed validation.
+    """
+    if admission_id is not None:
+        _cache().delete(USED_KEY.format(admission_id))